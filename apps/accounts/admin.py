@@ -8,6 +8,7 @@ from .models import (
     UserAccount,
     UserProfile,
     UserLoginHistory,
+    UserLoginDailySummary,
 )
 
 
@@ -403,3 +404,24 @@ class UserLoginHistoryAdmin(admin.ModelAdmin):
 # 设置管理后台标题
 admin.site.site_header = "MiniTieba管理系统"
 admin.site.site_title = "MiniTieba管理后台"
+
+
+@admin.register(UserLoginDailySummary)
+class UserLoginDailySummaryAdmin(admin.ModelAdmin):
+    """用户每日登录汇总（由登录历史定期汇总生成，只读）"""
+
+    list_display = ("id", "user", "date", "login_count", "ip_count", "last_login_at")
+    search_fields = ("user__username",)
+    list_filter = ("date",)
+    ordering = ("-date",)
+    list_per_page = 50
+    date_hierarchy = "date"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("user")
@@ -0,0 +1,130 @@
+import io
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from common.utils.image_utils import ImageProcessor
+
+
+def legacy_compress(file_obj, max_width, quality):
+    """优化前的处理路径：整份复制 + 全尺寸解码 + 直接 LANCZOS，用作对照"""
+    file_obj.seek(0)
+    img = Image.open(io.BytesIO(file_obj.read()))
+    # 与优化后路径编码为同一格式，只比较解码与缩放的差异
+    fmt = (img.format or "JPEG").upper()
+    img.load()
+    w, h = img.size
+    if max(w, h) > max_width:
+        scale = max_width / max(w, h)
+        img = img.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
+    return ImageProcessor.encode(img, fmt, quality)
+
+
+def legacy_derivatives(file_obj, sizes, max_width, quality, webp):
+    """优化前的衍生图生成：每个变体都从原图重新解码、全尺寸缩放"""
+    data = file_obj.read()
+    variants = {"orig": legacy_compress(io.BytesIO(data), max_width, quality)}
+    for size in sizes:
+        variants[str(size)] = legacy_compress(io.BytesIO(data), size, quality)
+        if webp:
+            img = Image.open(io.BytesIO(data))
+            img.load()
+            img.thumbnail((size, size), Image.LANCZOS)
+            variants[f"{size}.webp"] = ImageProcessor.encode(img, "WEBP", quality)
+    return variants
+
+
+def sample_corpus():
+    """未指定样本目录时生成的样本：不同尺寸的 JPEG 照片与 PNG 图片"""
+    samples = []
+    for size, fmt in (
+        ((4032, 3024), "JPEG"),
+        ((3000, 2000), "JPEG"),
+        ((1600, 1200), "JPEG"),
+        ((2400, 2400), "PNG"),
+    ):
+        img = Image.radial_gradient("L").resize(size).convert("RGB")
+        buf = io.BytesIO()
+        img.save(buf, format=fmt, quality=92)
+        samples.append((f"{size[0]}x{size[1]}.{fmt.lower()}", buf.getvalue()))
+    return samples
+
+
+# 被测代码在 common.utils.image_utils，但 common 不是 Django 应用、无法承载管理命令；
+# 头像上传是图片管线的主要入口，与 captcha_pool_worker 一样放在 accounts 下
+class Command(BaseCommand):
+    help = "对比图片处理优化前后的耗时（compress_image 与 generate_derivatives）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corpus", default=None, help="样本图片目录")
+        parser.add_argument("--iterations", type=int, default=5, help="每张重复次数")
+        parser.add_argument("--max-width", type=int, default=None, help="最长边上限")
+
+    @staticmethod
+    def _measure(func, data, iterations):
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            func(io.BytesIO(data))
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def handle(self, *args, **options):
+        max_width = options["max_width"] or getattr(
+            settings, "OSS_MAX_IMAGE_WIDTH", 2000
+        )
+        quality = getattr(settings, "OSS_DEFAULT_IMAGE_QUALITY", 85)
+        iterations = options["iterations"]
+
+        if options["corpus"]:
+            samples = [
+                (path.name, path.read_bytes())
+                for path in sorted(Path(options["corpus"]).iterdir())
+                if path.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp")
+            ]
+        else:
+            samples = sample_corpus()
+
+        sizes = sorted(
+            set(getattr(settings, "OSS_IMAGE_DERIVATIVE_SIZES", [64, 256, 1024])),
+            reverse=True,
+        )
+        webp = getattr(settings, "OSS_IMAGE_WEBP_VARIANTS", True)
+        self._compare(
+            "compress_image",
+            samples,
+            lambda f: legacy_compress(f, max_width, quality),
+            lambda f: ImageProcessor.compress_image(f, max_width, quality),
+            iterations,
+        )
+        self._compare(
+            f"generate_derivatives（尺寸 {sizes}，WebP {'开' if webp else '关'}）",
+            samples,
+            lambda f: legacy_derivatives(f, sizes, max_width, quality, webp),
+            lambda f: ImageProcessor.generate_derivatives(f, sizes, max_width, quality),
+            iterations,
+        )
+
+    def _compare(self, title, samples, legacy_func, current_func, iterations):
+        self.stdout.write(title)
+        total_legacy = total_current = 0
+        for name, data in samples:
+            legacy = self._measure(legacy_func, data, iterations)
+            current = self._measure(current_func, data, iterations)
+            total_legacy += legacy
+            total_current += current
+            self.stdout.write(
+                f"{name:<24} 优化前 {legacy:8.1f} ms  优化后 {current:8.1f} ms  "
+                f"加速 {legacy / current:5.2f}x"
+            )
+        if samples:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"合计 优化前 {total_legacy:.1f} ms  优化后 {total_current:.1f} ms  "
+                    f"加速 {total_legacy / total_current:.2f}x"
+                )
+            )
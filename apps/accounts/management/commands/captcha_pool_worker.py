@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from common.utils.captcha_utils import CaptchaPoolService
+
+
+class Command(BaseCommand):
+    help = "常驻补充预渲染验证码池：低于低水位时用进程池并行渲染到高水位"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="只补充一次后退出")
+        parser.add_argument("--workers", type=int, default=None, help="渲染进程数")
+        parser.add_argument(
+            "--low-watermark", type=int, default=None, help="触发补充的池大小"
+        )
+        parser.add_argument(
+            "--high-watermark", type=int, default=None, help="补充到的池大小"
+        )
+
+    def handle(self, *args, **options):
+        interval = getattr(settings, "CAPTCHA_POOL_POLL_SECONDS", 1)
+        while True:
+            try:
+                added = CaptchaPoolService.refill(
+                    low_watermark=options["low_watermark"],
+                    high_watermark=options["high_watermark"],
+                    workers=options["workers"],
+                )
+                if added:
+                    self.stdout.write(f"验证码池补充 {added} 张")
+            except Exception as e:
+                self.stderr.write(f"验证码池补充失败: {e}")
+                if options["once"]:
+                    raise
+            if options["once"]:
+                break
+            time.sleep(interval)
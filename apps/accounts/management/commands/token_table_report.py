@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from common.auth import TokenPruneService
+
+
+class Command(BaseCommand):
+    help = "统计令牌表规模与可回收（已过期）行数，可选立即分批清理"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--prune", action="store_true", help="统计后立即分批删除过期令牌"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=None, help="每批删除的令牌数量"
+        )
+
+    def handle(self, *args, **options):
+        counts = TokenPruneService.reclaimable_counts()
+        self.stdout.write(
+            f"OutstandingToken: {counts['outstanding']} 行，"
+            f"可回收 {counts['outstanding_expired']} 行"
+        )
+        self.stdout.write(
+            f"BlacklistedToken: {counts['blacklisted']} 行，"
+            f"可回收 {counts['blacklisted_expired']} 行"
+        )
+
+        if options["prune"]:
+            deleted = TokenPruneService.prune_expired(batch_size=options["batch_size"])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"已删除 OutstandingToken {deleted['outstanding']} 行，"
+                    f"BlacklistedToken {deleted['blacklisted']} 行"
+                )
+            )
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, UserManager
+from django.utils import timezone
 from rest_framework.exceptions import ValidationError
 
 
@@ -140,7 +141,9 @@ class UserAccount(AbstractUser):
         related_name="users",
         verbose_name="角色",
     )
-    avatar_url = models.URLField(blank=True, null=True, verbose_name="头像URL")
+    avatar_url = models.URLField(
+        max_length=1024, blank=True, null=True, verbose_name="头像URL"
+    )
     bio = models.TextField(blank=True, null=True, verbose_name="个人简介")
     gender = models.CharField(
         max_length=10,
@@ -229,7 +232,10 @@ class UserLoginHistory(models.Model):
     device_info = models.CharField(
         max_length=255, blank=True, null=True, verbose_name="设备信息"
     )
-    login_time = models.DateTimeField(auto_now_add=True, verbose_name="登录时间")
+    # 登录事件异步批量落库，登录时间取事件发生时间而非写入时间
+    login_time = models.DateTimeField(
+        default=timezone.now, db_index=True, verbose_name="登录时间"
+    )
 
     class Meta:
         db_table = "user_login_history"
@@ -239,3 +245,29 @@ class UserLoginHistory(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.login_ip} ({self.login_time})"
+
+
+class UserLoginDailySummary(models.Model):
+    """用户每日登录汇总表（超过保留期的登录历史汇总到这里）"""
+
+    user = models.ForeignKey(
+        "accounts.UserAccount",
+        on_delete=models.CASCADE,
+        related_name="login_summaries",
+        verbose_name="用户",
+    )
+    date = models.DateField(verbose_name="日期")
+    login_count = models.PositiveIntegerField(default=0, verbose_name="登录次数")
+    ip_count = models.PositiveIntegerField(default=0, verbose_name="登录IP数")
+    first_login_at = models.DateTimeField(verbose_name="当日首次登录时间")
+    last_login_at = models.DateTimeField(verbose_name="当日最后登录时间")
+
+    class Meta:
+        db_table = "user_login_daily_summary"
+        verbose_name = "用户每日登录汇总"
+        verbose_name_plural = "用户每日登录汇总列表"
+        unique_together = ("user", "date")
+        ordering = ["-date"]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.date} ({self.login_count})"
@@ -6,9 +6,13 @@ from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 
 from common.utils.email_utils import EmailService
-from common.utils.oss_utils import MinioClientWrapper, BaseImageUploadSerializer
+from common.utils.oss_utils import (
+    MinioClientWrapper,
+    BaseImageUploadSerializer,
+    ImageSrcsetField,
+)
 from .models import UserProfile, Role, Permission, RolePermissionMap
-from apps.common.auth import CaptchaValidateMixin
+from apps.common.auth import CaptchaValidateMixin, LoginGuardService, get_client_ip
 from apps.common.utils.oss_utils import OssService
 
 UserModel = get_user_model()
@@ -102,8 +106,16 @@ class LoginSerializer(serializers.Serializer):
         if not identifier:
             raise serializers.ValidationError("用户名或邮箱不能为空")
 
+        # 失败次数过多时直接拒绝，不查库、不做密码哈希
+        request = self.context.get("request")
+        remaining = LoginGuardService.lock_remaining(identifier, get_client_ip(request))
+        if remaining:
+            raise serializers.ValidationError(
+                f"登录失败次数过多，请 {remaining} 秒后再试"
+            )
+
         # authenticate 会自动判断用户名或邮箱
-        user = authenticate(username=identifier, password=password)
+        user = authenticate(request=request, username=identifier, password=password)
 
         # 检查用户状态
         if not user:
@@ -168,6 +180,7 @@ class UserBasicInfoSerializer(serializers.ModelSerializer):
             )
         ],
     )
+    avatar_srcset = ImageSrcsetField(source="avatar_url")
 
     class Meta:
         model = UserModel
@@ -177,6 +190,7 @@ class UserBasicInfoSerializer(serializers.ModelSerializer):
             "email",
             "mobile",
             "avatar_url",
+            "avatar_srcset",
             "bio",
             "gender",
         ]
@@ -0,0 +1,32 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from accounts.models import Permission, Role, RolePermissionMap, UserAccount
+from common.auth import LoginGuardService
+from common.utils.rbac_utils import PermissionTreeService, RBACService
+
+
+# ========== RBAC 权限集缓存失效 ==========
+
+
+@receiver([post_save, post_delete], sender=Role)
+@receiver([post_save, post_delete], sender=Permission)
+@receiver([post_save, post_delete], sender=RolePermissionMap)
+def bump_rbac_version(sender, instance, **kwargs):
+    """角色等级、权限树、角色授权任一变化都会影响编译后的权限集"""
+    RBACService.bump_version_on_commit()
+
+
+@receiver([post_save, post_delete], sender=Permission)
+def bump_permission_tree_version(sender, instance, **kwargs):
+    """权限新增、修改、删除后重新生成权限树"""
+    PermissionTreeService.bump_version_on_commit()
+
+
+# ========== 登录负缓存失效 ==========
+
+
+@receiver(post_save, sender=UserAccount)
+def clear_login_unknown_cache(sender, instance, **kwargs):
+    """注册或修改用户名/邮箱后，新标识不能再被负缓存判为不存在"""
+    LoginGuardService.clear_unknown(instance.username, instance.email)
@@ -0,0 +1,22 @@
+from celery import shared_task
+
+from accounts.utils.login_utils import LoginHistoryService
+from common.auth import TokenPruneService
+
+
+@shared_task
+def prune_expired_tokens():
+    """分批清理已过期的 OutstandingToken / BlacklistedToken，并记录表规模指标"""
+    return TokenPruneService.prune_expired()
+
+
+@shared_task
+def flush_login_history():
+    """将 Redis 队列中的登录事件批量写入登录历史"""
+    return LoginHistoryService.flush()
+
+
+@shared_task
+def rollup_login_history():
+    """将超过保留期的登录历史按天汇总后删除"""
+    return LoginHistoryService.rollup()
@@ -1,3 +1,899 @@
-from django.test import TestCase
+import io
+import json
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from minio import Minio
+from PIL import Image, ImageFile
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+
+from common.auth import (
+    LoginGuardService,
+    RevocationAwareJWTAuthentication,
+    TokenPruneService,
+    TokenRevocationService,
+    generate_tokens_for_user,
+    get_client_ip,
+)
+from common.permissions import RBACPermission
+from common.exceptions import UploadImageError
+from common.tasks import flush_email_outbox, process_uploaded_image
+from common.utils.captcha_utils import CaptchaPoolService
+from common.utils.image_utils import ImageProcessor
+from common.utils.lock_utils import RedisLockService
+from common.utils.mail_utils import EmailDeliveryService
+from common.utils.metrics_utils import MetricsService
+from common.utils.oss_utils import (
+    ImagePipelineService,
+    MinioClientWrapper,
+    OssService,
+)
+from common.utils.sms_utils import SMSService, StubSMSBackend
+from common.utils.rbac_utils import PermissionTreeService, RBACService
+
+from .models import (
+    Permission,
+    Role,
+    RolePermissionMap,
+    UserLoginDailySummary,
+    UserLoginHistory,
+    UserProfile,
+)
+from .utils.login_utils import LoginHistoryService
+from .views import PermissionListView
+
+UserModel = get_user_model()
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RBACPermissionCacheTest(TestCase):
+    """RBAC 编译权限集缓存"""
+
+    def setUp(self):
+        cache.clear()
+        RBACService._get_compiled.cache_clear()
+        self.role = Role.objects.create(name="editor", level=10)
+        self.user = UserModel.objects.create(
+            username="editor", email="e@test.com", role=self.role
+        )
+        self.parent = Permission.objects.create(code="forums", name="贴吧")
+        self.child = Permission.objects.create(
+            code="forums.edit_forum", name="编辑贴吧", parent=self.parent
+        )
+        self.other = Permission.objects.create(code="rbac.view_roles", name="角色")
+
+    def test_parent_grant_includes_children_and_checks_are_query_free(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            RolePermissionMap.objects.create(role=self.role, permission=self.parent)
+
+        self.assertTrue(RBACPermission.user_has_permission(self.user, "forums"))
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                RBACPermission.user_has_permission(self.user, "forums.edit_forum")
+            )
+            self.assertFalse(
+                RBACPermission.user_has_permission(self.user, "rbac.view_roles")
+            )
+
+    def test_grant_change_bumps_version(self):
+        self.assertFalse(
+            RBACPermission.user_has_permission(self.user, "rbac.view_roles")
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            RolePermissionMap.objects.create(role=self.role, permission=self.other)
+        self.assertTrue(
+            RBACPermission.user_has_permission(self.user, "rbac.view_roles")
+        )
+
+    def test_version_survives_eviction_and_cache_outage(self):
+        cache.set(RBACService.VERSION_KEY, 42, timeout=None)
+        RBACService.bump_version()
+        old_version = RBACService.get_version()
+        self.assertEqual(old_version, 43)
+        cache.delete(RBACService.VERSION_KEY)
+        # 版本号丢失后重新生成的版本一定大于旧版本，旧 LRU 项不会被命中
+        self.assertGreater(RBACService.get_version(), old_version)
+
+        with mock.patch.object(RBACService, "_cache") as broken:
+            broken.return_value.incr.side_effect = ConnectionError("redis down")
+            with self.captureOnCommitCallbacks(execute=True):
+                RolePermissionMap.objects.create(role=self.role, permission=self.other)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PermissionTreeCacheTest(TestCase):
+    """权限树缓存与 ETag"""
+
+    def setUp(self):
+        cache.clear()
+        RBACService._get_compiled.cache_clear()
+        self.user = UserModel.objects.create(
+            username="root", email="r@test.com", is_superuser=True
+        )
+        self.user.role = Role.objects.create(name="super", level=100)
+        self.user.save()
+        root = Permission.objects.create(code="rbac", name="权限管理")
+        Permission.objects.create(code="rbac.view", name="查看", parent=root)
+        Permission.objects.create(code="rbac.edit", name="编辑", parent=root)
+
+    def _get(self, **headers):
+        request = APIRequestFactory().get("/api/accounts/permissions/", **headers)
+        force_authenticate(request, user=self.user)
+        return PermissionListView.as_view()(request)
+
+    def test_tree_cached_with_etag(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        tree = json.loads(response.content)["detail"]
+        self.assertEqual([node["code"] for node in tree], ["rbac"])
+        self.assertEqual(
+            [child["code"] for child in tree[0]["children"]], ["rbac.view", "rbac.edit"]
+        )
+
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            self.assertEqual(self._get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Permission.objects.create(code="forums", name="贴吧")
+        response = self._get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TokenRevocationTest(TestCase):
+    """用户令牌批量吊销"""
+
+    def test_revoke_blacklists_refresh_and_rejects_access(self):
+        cache.clear()
+        user = UserModel.objects.create(username="u", email="u@test.com")
+        tokens = [generate_tokens_for_user(user) for _ in range(3)]
+        auth = RevocationAwareJWTAuthentication()
+        auth.get_validated_token(tokens[0][0].encode())
+
+        with self.assertNumQueries(2):
+            TokenRevocationService.revoke_user_tokens(user)
+        self.assertEqual(BlacklistedToken.objects.filter(token__user=user).count(), 3)
+        # 重复吊销不会报错，也不会重复插入
+        self.assertEqual(TokenRevocationService.blacklist_user_tokens(user), 0)
+
+        with self.assertNumQueries(0), self.assertRaises(InvalidToken):
+            auth.get_validated_token(tokens[0][0].encode())
+
+    def test_token_issued_right_after_revocation_is_valid(self):
+        cache.clear()
+        user = UserModel.objects.create(username="u", email="u@test.com")
+        auth = RevocationAwareJWTAuthentication()
+        now = int(time.time()) + 0.2
+        with mock.patch("common.auth.time.time", return_value=now):
+            old_access, _ = generate_tokens_for_user(user)
+            TokenRevocationService.revoke_user_tokens(user)
+        # 吊销后同一秒内重新登录
+        with mock.patch("common.auth.time.time", return_value=now + 0.5):
+            new_access, _ = generate_tokens_for_user(user)
+
+        self.assertTrue(TokenRevocationService.is_revoked(user.pk, int(now)))
+        self.assertTrue(TokenRevocationService.is_revoked(user.pk, now))
+        self.assertFalse(TokenRevocationService.is_revoked(user.pk, now + 0.5))
+        validated = auth.get_validated_token(new_access.encode())
+        self.assertEqual(validated["iat"], now + 0.5)
+        with self.assertRaises(InvalidToken):
+            auth.get_validated_token(old_access.encode())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TokenPruneTest(TestCase):
+    """过期令牌分批清理"""
+
+    def test_prune_only_expired_tokens(self):
+        user = UserModel.objects.create(username="u", email="u@test.com")
+        for _ in range(5):
+            generate_tokens_for_user(user)
+        expired_ids = list(OutstandingToken.objects.values_list("id", flat=True)[:3])
+        OutstandingToken.objects.filter(id__in=expired_ids).update(
+            expires_at=timezone.now() - timezone.timedelta(days=1)
+        )
+        BlacklistedToken.objects.create(token_id=expired_ids[0])
+
+        counts = TokenPruneService.reclaimable_counts()
+        self.assertEqual(counts["outstanding_expired"], 3)
+        self.assertEqual(counts["blacklisted_expired"], 1)
+
+        deleted = TokenPruneService.prune_expired(batch_size=2)
+        self.assertEqual(deleted, {"outstanding": 3, "blacklisted": 1})
+        self.assertEqual(OutstandingToken.objects.count(), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class LoginHistoryTest(TestCase):
+    """登录历史批量落库与按天汇总"""
+
+    def setUp(self):
+        self.user = UserModel.objects.create(username="u", email="u@test.com")
+        UserProfile.objects.create(user=self.user)
+
+    def test_write_batch_updates_last_login_ip(self):
+        now = timezone.now()
+        LoginHistoryService._write(
+            [
+                (self.user.pk, "10.0.0.2", None, now),
+                (self.user.pk, "10.0.0.1", "ua", now - timezone.timedelta(minutes=1)),
+            ]
+        )
+        self.assertEqual(UserLoginHistory.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(
+            UserProfile.objects.get(user=self.user).last_login_ip, "10.0.0.2"
+        )
+
+    def test_flush_skips_while_another_run_holds_lock(self):
+        redis = mock.Mock()
+        redis.set.return_value = None
+        with mock.patch.object(LoginHistoryService, "_redis", return_value=redis):
+            self.assertEqual(LoginHistoryService.flush(), 0)
+        redis.xreadgroup.assert_not_called()
+
+    def test_flush_releases_lock_after_run(self):
+        redis = mock.Mock()
+        redis.set.return_value = True
+        redis.xreadgroup.return_value = []
+        with mock.patch.object(LoginHistoryService, "_redis", return_value=redis):
+            self.assertEqual(LoginHistoryService.flush(), 0)
+        token = redis.set.call_args.args[1]
+        # 按令牌比较后释放，不会误删其他任务的锁
+        self.assertEqual(
+            redis.eval.call_args.args[2:], (LoginHistoryService.FLUSH_LOCK_KEY, token)
+        )
+
+    def test_rollup_old_history(self):
+        old = timezone.now() - timezone.timedelta(days=100)
+        for ip in ("10.0.0.1", "10.0.0.1", "10.0.0.2"):
+            UserLoginHistory.objects.create(user=self.user, login_ip=ip, login_time=old)
+        UserLoginHistory.objects.create(user=self.user, login_ip="10.0.0.3")
+
+        self.assertEqual(LoginHistoryService.rollup(retention_days=90), 1)
+        summary = UserLoginDailySummary.objects.get(user=self.user)
+        self.assertEqual((summary.login_count, summary.ip_count), (3, 2))
+        self.assertEqual(UserLoginHistory.objects.filter(user=self.user).count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, LOGIN_FAIL_THRESHOLD=2)
+class LoginGuardTest(TestCase):
+    """登录防护与哈希升级"""
+
+    def setUp(self):
+        cache.clear()
+        self.request = APIRequestFactory().post("/", REMOTE_ADDR="10.0.0.1")
+        self.user = UserModel.objects.create(
+            username="alice",
+            email="a@test.com",
+            password=make_password("secret123", hasher="pbkdf2_sha256"),
+        )
+
+    def _login(self, username, password):
+        return authenticate(self.request, username=username, password=password)
+
+    def test_unknown_identifier_is_negatively_cached(self):
+        self.assertIsNone(self._login("nobody", "x"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(self._login("nobody", "x"))
+        UserModel.objects.create(username="nobody", email="n@test.com")
+        self.assertFalse(LoginGuardService.is_unknown("nobody"))
+
+    def test_unknown_cache_ignores_case_and_whitespace(self):
+        self.assertIsNone(self._login("Ghost", "x"))
+        self.assertTrue(LoginGuardService.is_unknown(" ghost "))
+        # 存在大小写变体的账号不能被标记，否则会挡住真实用户
+        self.assertIsNone(self._login("ALICE", "x"))
+        self.assertFalse(LoginGuardService.is_unknown("alice"))
+        UserModel.objects.create(username="GHOST", email="g@test.com")
+        self.assertFalse(LoginGuardService.is_unknown("ghost"))
+
+    def test_lockout_skips_db_and_hashing(self):
+        self.assertIsNone(self._login("alice", "wrong"))
+        self.assertIsNone(self._login("alice", "wrong"))
+        self.assertGreater(LoginGuardService.lock_remaining("alice", None), 0)
+        with self.assertNumQueries(0):
+            self.assertIsNone(self._login("alice", "secret123"))
+
+    def test_client_ip_ignores_spoofed_forwarded_for(self):
+        factory = APIRequestFactory()
+        request = factory.post(
+            "/", REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="1.2.3.4, 10.0.0.9"
+        )
+        self.assertEqual(get_client_ip(request), "10.0.0.1")
+        # 一层可信代理：取代理追加的最后一个地址，客户端伪造的前缀被忽略
+        with override_settings(TRUSTED_PROXY_COUNT=1):
+            self.assertEqual(get_client_ip(request), "10.0.0.9")
+            self.assertEqual(
+                get_client_ip(factory.post("/", REMOTE_ADDR="10.0.0.1")), "10.0.0.1"
+            )
+
+    def test_legacy_hash_upgraded_on_login(self):
+        self.assertEqual(self._login("alice", "secret123"), self.user)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("argon2"))
+
+
+@override_settings(
+    CACHES={
+        **LOCMEM_CACHE,
+        "captcha": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+)
+class CaptchaPoolTest(TestCase):
+    """验证码池"""
+
+    def test_issue_falls_back_to_inline_render(self):
+        # 本地内存缓存没有 Redis 连接，取池失败时应当场渲染
+        self.assertIsNone(CaptchaPoolService.pop())
+        captcha_id, img_base64 = CaptchaPoolService.issue()
+        code = caches["captcha"].get(f"captcha:{captcha_id}")
+        self.assertEqual(len(code), 5)
+        self.assertEqual(code, code.lower())
+        self.assertTrue(img_base64)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, EMAIL_EXPIRE_SECONDS=600)
+class EmailDeliveryTest(TestCase):
+    """邮件投递管线"""
+
+    def tearDown(self):
+        EmailDeliveryService.reset_connection()
+
+    def test_render_uses_precompiled_template(self):
+        subject, plain, html = EmailDeliveryService.render("verify", "ABC123")
+        self.assertEqual(subject, "MiniTieba 邮箱验证邮件")
+        self.assertIn("ABC123", html)
+        self.assertIn("10 分钟", plain)
+        self.assertNotIn("<p>", plain)
+        with self.assertRaises(ValueError):
+            EmailDeliveryService.render("unknown", "x")
+
+    def test_enqueue_without_redis_sends_inline(self):
+        EmailDeliveryService.enqueue("a@test.com", "ABC123", mode="verify")
+        EmailDeliveryService.enqueue(["b@test.com"], "XYZ789", mode="verify")
+        self.assertEqual([m.to for m in mail.outbox], [["a@test.com"], ["b@test.com"]])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], "text/html")
+
+
+class FakeListRedis:
+    """只实现邮件/短信队列用到的列表、集合与锁命令的内存 Redis"""
+
+    def __init__(self):
+        self.lists = {}
+        self.zsets = {}
+        self.values = {}
+
+    def rpush(self, key, *values):
+        items = self.lists.setdefault(key, [])
+        items.extend(v.encode() if isinstance(v, str) else v for v in values)
+        return len(items)
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def lmove(self, src, dst, wherefrom, whereto):
+        items = self.lists.get(src)
+        if not items:
+            return None
+        value = items.pop(0 if wherefrom == "LEFT" else -1)
+        target = self.lists.setdefault(dst, [])
+        if whereto == "LEFT":
+            target.insert(0, value)
+        else:
+            target.append(value)
+        return value
+
+    def lrem(self, key, count, value):
+        items = self.lists.get(key, [])
+        if value in items:
+            items.remove(value)
+            return 1
+        return 0
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def zrangebyscore(self, key, low, high):
+        return [
+            m for m, score in self.zsets.get(key, {}).items() if low <= score <= high
+        ]
+
+    def zrem(self, key, member):
+        return self.zsets.get(key, {}).pop(member, None) is not None
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def eval(self, script, numkeys, key, token):
+        # 只支持 RedisLockService 的比较后删除脚本
+        if self.values.get(key) == token.encode():
+            del self.values[key]
+            return 1
+        return 0
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+            self.lists.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return FakeListPipeline(self)
+
+
+class FakeListPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        return [getattr(self.redis, name)(*a, **kw) for name, a, kw in calls]
+
+
+@override_settings(CACHES=LOCMEM_CACHE, EMAIL_EXPIRE_SECONDS=600)
+class EmailOutboxTest(TestCase):
+    """邮件队列的处理中列表与确认"""
+
+    def setUp(self):
+        self.redis = FakeListRedis()
+        patcher = mock.patch.object(
+            EmailDeliveryService, "_redis", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(EmailDeliveryService.reset_connection)
+
+    def push(self, to, code):
+        item = EmailDeliveryService.normalize(to, code, "verify")
+        self.redis.rpush(EmailDeliveryService.OUTBOX_KEY, json.dumps(item))
+
+    def test_flush_acks_sent_messages_and_recovers_orphans(self):
+        self.push("a@test.com", "AAA111")
+        self.push("b@test.com", "BBB222")
+        # 模拟上一个 worker 取出后崩溃：消息停留在处理中列表
+        EmailDeliveryService._take_batch(self.redis, 1)
+        self.assertEqual(self.redis.llen(EmailDeliveryService.PROCESSING_KEY), 1)
+
+        self.assertEqual(EmailDeliveryService.flush(batch_size=10), 2)
+        self.assertEqual(
+            sorted(m.to[0] for m in mail.outbox), ["a@test.com", "b@test.com"]
+        )
+        self.assertEqual(self.redis.llen(EmailDeliveryService.PROCESSING_KEY), 0)
+        self.assertEqual(EmailDeliveryService.backlog(), 0)
+        self.assertNotIn(EmailDeliveryService.LOCK_KEY, self.redis.values)
+
+    def test_failed_message_moves_to_retry_and_is_acked(self):
+        self.push("a@test.com", "AAA111")
+        with mock.patch.object(
+            EmailDeliveryService, "send", side_effect=OSError("smtp down")
+        ):
+            self.assertEqual(EmailDeliveryService.flush(batch_size=10), 0)
+        self.assertEqual(self.redis.llen(EmailDeliveryService.PROCESSING_KEY), 0)
+        (raw,) = self.redis.zsets[EmailDeliveryService.RETRY_KEY]
+        self.assertEqual(json.loads(raw)["attempts"], 1)
+
+    def test_flush_skips_when_another_worker_holds_lock(self):
+        self.push("a@test.com", "AAA111")
+        self.redis.set(EmailDeliveryService.LOCK_KEY, "other-worker")
+        self.assertIsNone(EmailDeliveryService.flush(batch_size=10))
+        self.assertEqual(EmailDeliveryService.backlog(), 1)
+        # 未持锁的任务不再重复投递，由持锁方结束时负责
+        with mock.patch("common.tasks.flush_email_outbox.delay") as delay:
+            flush_email_outbox()
+        delay.assert_not_called()
+
+    def test_expired_lock_holder_does_not_release_new_owner_lock(self):
+        token = RedisLockService.acquire(self.redis, "lock:test", 300)
+        # 旧持有者的锁已过期，被新持有者重新获取
+        self.redis.values["lock:test"] = b"new-owner"
+        self.assertFalse(RedisLockService.release(self.redis, "lock:test", token))
+        self.assertEqual(self.redis.get("lock:test"), b"new-owner")
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE,
+    SMS_BACKEND="common.utils.sms_utils.StubSMSBackend",
+    SMS_DAILY_LIMIT=2,
+)
+class SMSServiceTest(TestCase):
+    """短信验证码发送"""
+
+    def setUp(self):
+        cache.clear()
+        StubSMSBackend.outbox.clear()
+
+    def test_send_code_rate_limited_per_phone(self):
+        self.assertTrue(SMSService.send_code("13800000000", 123456))
+        self.assertFalse(SMSService.send_code("13800000000", 654321))
+        self.assertEqual(StubSMSBackend.outbox, [("13800000000", ["123456", "5"])])
+        self.assertTrue(SMSService.verify_code("13800000000", 123456))
+
+        cache.delete(SMSService.COOLDOWN_KEY.format("13800000000"))
+        self.assertTrue(SMSService.send_code("13800000000", 111111))
+        cache.delete(SMSService.COOLDOWN_KEY.format("13800000000"))
+        self.assertFalse(SMSService.send_code("13800000000", 222222))
+
+    def test_failed_delivery_refunds_quota_and_drops_code(self):
+        with mock.patch.object(
+            StubSMSBackend, "send_messages", return_value=set()
+        ) as send_messages:
+            self.assertTrue(SMSService.send_code("13800000000", 123456))
+        send_messages.assert_called_once_with([("13800000000", ["123456", "5"])])
+        self.assertFalse(SMSService.verify_code("13800000000", 123456))
+
+        # 额度已退还：无需等待发送间隔，当日仍可发送 SMS_DAILY_LIMIT 条
+        self.assertTrue(SMSService.send_code("13800000000", 111111))
+        cache.delete(SMSService.COOLDOWN_KEY.format("13800000000"))
+        self.assertTrue(SMSService.send_code("13800000000", 222222))
+        self.assertTrue(SMSService.verify_code("13800000000", 222222))
+
+
+@override_settings(MINIO_BUCKET_NAME="test-bucket", MINIO_USE_SSL=True)
+class MinioClientWrapperTest(TestCase):
+    """MinIO 客户端封装"""
+
+    def setUp(self):
+        MinioClientWrapper._verified_buckets.clear()
+
+    def test_client_is_shared_and_bucket_checked_once(self):
+        self.assertIs(MinioClientWrapper.get_client(), MinioClientWrapper.get_client())
+
+        client = mock.Mock()
+        client.bucket_exists.return_value = True
+        MinioClientWrapper.upload_bytes(b"a", "x/1.jpg", "image/jpeg", client=client)
+        MinioClientWrapper.upload_bytes(b"b", "x/2.jpg", "image/jpeg", client=client)
+        self.assertEqual(client.bucket_exists.call_count, 1)
+        self.assertEqual(client.put_object.call_count, 2)
+
+    @override_settings(OSS_MULTIPART_PART_SIZE=1024)
+    def test_upload_stream_reads_one_part_at_a_time(self):
+        data = bytes(range(256)) * 20
+        reads = []
+        client = mock.Mock()
+        client.bucket_exists.return_value = True
+
+        def put_object(bucket, name, stream, length, content_type, part_size):
+            self.assertEqual((length, part_size), (len(data), 1024))
+            while chunk := stream.read(part_size):
+                reads.append(len(chunk))
+
+        client.put_object.side_effect = put_object
+        uploaded = MinioClientWrapper.upload_stream(
+            SimpleUploadedFile("big.bin", data), "x/big.bin", "image/png", client=client
+        )
+        self.assertEqual(uploaded["checksum"], OssService.calc_checksum(data))
+        self.assertEqual(uploaded["size"], len(data))
+        self.assertEqual(max(reads), 1024)
+
+    @override_settings(OSS_PRESIGN_SAFETY_MARGIN_SECONDS=60)
+    def test_presigned_urls_cached_within_window(self):
+        MinioClientWrapper._presign_cache.clear()
+        client = Minio("127.0.0.1:9000", "ak", "sk", secure=False, region="us-east-1")
+        expires = timedelta(seconds=600)
+        now = 1_700_000_000 - 1_700_000_000 % 540  # 窗口 = 600 - 60 秒
+        with mock.patch("common.utils.oss_utils.time.time", return_value=now + 10):
+            urls = MinioClientWrapper.get_presigned_urls(
+                ["a.jpg", "b.jpg"], client=client, expires_time=expires
+            )
+        with mock.patch.object(client, "presigned_get_object") as sign:
+            with mock.patch("common.utils.oss_utils.time.time", return_value=now + 500):
+                self.assertEqual(
+                    MinioClientWrapper.get_presigned_url(
+                        "a.jpg", client=client, expires_time=expires
+                    ),
+                    urls["a.jpg"],
+                )
+            sign.assert_not_called()
+            # 进入下一个窗口后重新签名
+            with mock.patch("common.utils.oss_utils.time.time", return_value=now + 541):
+                MinioClientWrapper.get_presigned_url(
+                    "a.jpg", client=client, expires_time=expires
+                )
+            sign.assert_called_once()
+        # 按 有效期 + 窗口 签名：窗口末尾拿到的链接仍有完整的 600 秒
+        self.assertIn("X-Amz-Expires=1140", urls["b.jpg"])
+
+    def test_presign_window_respects_s3_limit(self):
+        week = MinioClientWrapper.PRESIGN_MAX_SECONDS
+        self.assertEqual(MinioClientWrapper._presign_window(week - 100), 100)
+        self.assertEqual(MinioClientWrapper._presign_window(week), 1)
+
+    @override_settings(CACHES=LOCMEM_CACHE, OSS_PRESIGN_METRICS_FLUSH_SECONDS=3600)
+    def test_presign_stats_counted_in_process(self):
+        MinioClientWrapper._presign_cache.clear()
+        MinioClientWrapper.flush_presign_stats()
+        cache.clear()
+        client = Minio("127.0.0.1:9000", "ak", "sk", secure=False, region="us-east-1")
+        with mock.patch.object(MetricsService, "incr") as incr:
+            for _ in range(3):
+                MinioClientWrapper.get_presigned_url("a.jpg", client=client)
+        # 未到写入间隔，不产生任何指标写入
+        incr.assert_not_called()
+        self.assertEqual(MinioClientWrapper._presign_stats, {"hit": 2, "miss": 1})
+        MinioClientWrapper.flush_presign_stats()
+        self.assertEqual(
+            (
+                MetricsService.get("oss_presign.hit"),
+                MetricsService.get("oss_presign.miss"),
+            ),
+            (2, 1),
+        )
+        self.assertEqual(MinioClientWrapper._presign_stats, {"hit": 0, "miss": 0})
+
+    def test_public_url_is_pure_string_build(self):
+        with mock.patch.object(MinioClientWrapper, "get_client") as get_client:
+            url = MinioClientWrapper.get_public_url("avatars/a.jpg")
+        get_client.assert_not_called()
+        self.assertTrue(url.endswith("/test-bucket/avatars/a.jpg"))
+        self.assertTrue(url.startswith("https://"))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class OssUploadDedupTest(TestCase):
+    """上传去重"""
+
+    def setUp(self):
+        cache.clear()
+        buf = io.BytesIO()
+        Image.new("RGB", (32, 32), "red").save(buf, format="PNG")
+        self.raw = buf.getvalue()
+
+    def _upload(self, wrapper, processor):
+        return OssService.upload_image(
+            SimpleUploadedFile("a.png", self.raw, content_type="image/png"),
+            folder_name="avatars",
+            processor=processor,
+            client_wrapper=wrapper,
+        )
+
+    def test_repeat_upload_skips_compress_and_transfer(self):
+        wrapper = mock.Mock()
+        wrapper.stat_object.return_value = None
+        wrapper.get_public_url.side_effect = lambda name: f"http://oss/{name}"
+        processor = mock.Mock()
+        processor.generate_derivatives.return_value = {"orig": (b"small", "image/png")}
+
+        first = self._upload(wrapper, processor)
+        second = self._upload(wrapper, processor)
+        self.assertEqual(first, second)
+        self.assertEqual(first["checksum"], OssService.calc_checksum(self.raw))
+        self.assertEqual(first["size"], 5)
+        self.assertEqual(processor.generate_derivatives.call_count, 1)
+        # 原图 + 清单
+        self.assertEqual(wrapper.upload_bytes.call_count, 2)
+        self.assertEqual(wrapper.stat_object.call_count, 1)
+
+
+class FakeObjectStore:
+    """内存对象存储，实现 ImagePipelineService 用到的 MinioClientWrapper 接口"""
+
+    def __init__(self):
+        self.objects = {}
+        self.buckets = {}
+
+    def upload_bytes(self, data, object_name, content_type, bucket=None):
+        self.objects[object_name] = data
+        self.buckets[object_name] = (bucket, content_type)
+
+    def upload_stream(self, file_obj, object_name, content_type, bucket=None):
+        self.buckets[object_name] = (bucket, content_type)
+        return MinioClientWrapper.upload_stream(
+            file_obj, object_name, content_type, bucket="test", client=self
+        )
+
+    def put_object(self, bucket, object_name, data, length, content_type, part_size):
+        # 模拟 MinIO 分片上传：每次只读取一个分片
+        parts = iter(lambda: data.read(part_size), b"")
+        self.objects[object_name] = b"".join(parts)
+
+    def bucket_exists(self, bucket):
+        return True
+
+    def download_bytes(self, object_name, bucket=None):
+        return self.objects[object_name]
+
+    def remove_object(self, object_name, bucket=None):
+        self.objects.pop(object_name)
+
+    def stat_object(self, object_name):
+        return None
+
+    def get_public_url(self, object_name):
+        return f"http://oss/{object_name}"
+
+    def get_presigned_url(self, object_name, bucket=None, expires_time=None):
+        return f"http://oss/{bucket}/{object_name}?X-Amz-Signature=sig"
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ImagePipelineTest(TestCase):
+    """请求外图片处理"""
+
+    def setUp(self):
+        cache.clear()
+        self.store = FakeObjectStore()
+        self.user = UserModel.objects.create(username="alice", email="a@test.com")
+        buf = io.BytesIO()
+        Image.new("RGB", (64, 48), "blue").save(buf, format="JPEG")
+        self.file = SimpleUploadedFile(
+            "a.jpg", buf.getvalue(), content_type="image/jpeg"
+        )
+
+    def _stage_and_process(self, changed_url=None):
+        staged = ImagePipelineService.stage(self.file, "avatars", self.store)
+        self.assertTrue(staged["pending"])
+        self.assertIn(staged["pending_object"], self.store.objects)
+        self.user.avatar_url = staged["url"]
+        self.user.save()
+        if changed_url:
+            UserModel.objects.filter(pk=self.user.pk).update(avatar_url=changed_url)
+        swapped = ImagePipelineService.process(
+            UserModel._meta.label,
+            self.user.pk,
+            "avatar_url",
+            staged["url"],
+            staged["pending_object"],
+            staged["object_name"],
+            staged["content_type"],
+            client_wrapper=self.store,
+        )
+        self.assertNotIn(staged["pending_object"], self.store.objects)
+        self.assertIn(staged["object_name"], self.store.objects)
+        self.user.refresh_from_db()
+        return swapped, staged
+
+    def test_process_swaps_pending_url(self):
+        swapped, staged = self._stage_and_process()
+        self.assertTrue(swapped)
+        self.assertEqual(self.user.avatar_url, f"http://oss/{staged['object_name']}")
+        # 同一文件再次上传直接得到正式 URL
+        again = ImagePipelineService.stage(self.file, "avatars", self.store)
+        self.assertEqual(
+            (again["pending"], again["url"]), (False, self.user.avatar_url)
+        )
+
+    @override_settings(OSS_IMAGE_DERIVATIVE_SIZES=[16, 32])
+    def test_process_uploads_derivatives_and_srcset(self):
+        _, staged = self._stage_and_process()
+        directory = staged["object_name"].rsplit("/", 1)[0]
+        self.assertEqual(
+            sorted(self.store.objects),
+            sorted(
+                f"{directory}/{name}"
+                for name in (
+                    "orig.jpg",
+                    "16.jpg",
+                    "32.jpg",
+                    "16.webp",
+                    "32.webp",
+                    "manifest.json",
+                )
+            ),
+        )
+        with Image.open(io.BytesIO(self.store.objects[f"{directory}/16.webp"])) as img:
+            self.assertEqual((img.format, max(img.size)), ("WEBP", 16))
+
+        srcset = OssService.build_srcset(self.user.avatar_url)
+        self.assertEqual(srcset["sizes"]["32"], f"http://oss/{directory}/32.jpg")
+        self.assertEqual(srcset["webp"]["16"], f"http://oss/{directory}/16.webp")
+        self.assertEqual(
+            OssService.build_srcset("http://oss/old.jpg"),
+            {"original": "http://oss/old.jpg"},
+        )
+
+    def test_process_keeps_newer_url(self):
+        swapped, _ = self._stage_and_process(changed_url="http://oss/newer.jpg")
+        self.assertFalse(swapped)
+        self.assertEqual(self.user.avatar_url, "http://oss/newer.jpg")
+
+    @override_settings(MINIO_PENDING_BUCKET_NAME="pending-bucket")
+    def test_stage_uses_private_bucket_and_detected_type(self):
+        buf = io.BytesIO()
+        Image.new("RGB", (8, 8), "red").save(buf, format="PNG")
+        # 客户端声明的类型与扩展名不可信
+        disguised = SimpleUploadedFile(
+            "a.html", buf.getvalue(), content_type="text/html"
+        )
+        staged = ImagePipelineService.stage(disguised, "avatars", self.store)
+        self.assertTrue(staged["pending_object"].endswith(".png"))
+        self.assertTrue(staged["object_name"].endswith(".png"))
+        self.assertEqual(staged["content_type"], "image/png")
+        self.assertEqual(
+            self.store.buckets[staged["pending_object"]],
+            ("pending-bucket", "image/png"),
+        )
+        self.assertIn("X-Amz-Signature", staged["url"])
+
+        not_image = SimpleUploadedFile(
+            "b.jpg", b"<html></html>", content_type="image/jpeg"
+        )
+        with self.assertRaises(UploadImageError):
+            ImagePipelineService.stage(not_image, "avatars", self.store)
+
+    def test_final_failure_restores_previous_url(self):
+        self.user.avatar_url = "http://oss/old.jpg"
+        self.user.save()
+        staged = ImagePipelineService.stage(self.file, "avatars", self.store)
+        UserModel.objects.filter(pk=self.user.pk).update(avatar_url=staged["url"])
+        args = (
+            UserModel._meta.label,
+            self.user.pk,
+            "avatar_url",
+            staged["url"],
+            staged["pending_object"],
+            staged["object_name"],
+            staged["content_type"],
+            "http://oss/old.jpg",
+        )
+        with mock.patch.object(
+            ImagePipelineService, "process", side_effect=RuntimeError("boom")
+        ), mock.patch.object(MinioClientWrapper, "remove_object") as remove:
+            process_uploaded_image.push_request(retries=3)
+            try:
+                with self.assertRaises(RuntimeError):
+                    process_uploaded_image.run(*args)
+            finally:
+                process_uploaded_image.pop_request()
+        remove.assert_called_once_with(
+            staged["pending_object"], bucket=ImagePipelineService.pending_bucket()
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_url, "http://oss/old.jpg")
+
+
+class ImageProcessorTest(TestCase):
+    """图片解码路径"""
+
+    @staticmethod
+    def _jpeg(size, orientation=None):
+        buf = io.BytesIO()
+        img = Image.new("RGB", size, "green")
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        img.save(buf, format="JPEG", exif=exif)
+        return buf
+
+    def test_draft_decode_and_exif_rotation(self):
+        data, content_type = ImageProcessor.compress_image(
+            self._jpeg((1600, 800), orientation=6), max_width=200
+        )
+        with Image.open(io.BytesIO(data)) as img:
+            self.assertEqual((content_type, img.size), ("image/jpeg", (100, 200)))
+
+    @override_settings(OSS_MAX_IMAGE_PIXELS=1000)
+    def test_oversize_pixels_rejected_before_decode(self):
+        with mock.patch.object(ImageFile.ImageFile, "load") as load:
+            with self.assertRaises(UploadImageError):
+                ImageProcessor.compress_image(self._jpeg((100, 100)))
+        load.assert_not_called()
@@ -0,0 +1,240 @@
+import logging
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from accounts.models import UserLoginDailySummary, UserLoginHistory, UserProfile
+from common.auth import get_client_ip
+from common.utils.lock_utils import RedisLockService
+
+logger = logging.getLogger("feat")
+
+
+class LoginHistoryService:
+    """
+    登录历史异步批量写入
+      - 登录接口只 XADD 一条事件到 Redis Stream（accounts:login:events）
+      - 定时任务持锁以消费组读取，bulk_create 登录历史、bulk_update 最后登录 IP 后 XACK + XDEL
+        （消费者名固定，每次先重读未确认事件，必须互斥，否则重叠的两次任务会重复写入）
+      - 超过保留期的明细按天汇总到 UserLoginDailySummary 后删除
+    """
+
+    LOGIN_CACHE_NAME = "default"
+    STREAM_KEY = "accounts:login:events"
+    GROUP_NAME = "login-history"
+    CONSUMER_NAME = "writer"
+    FLUSH_LOCK_KEY = "accounts:login:flush:lock"
+    STREAM_MAXLEN = 100000
+    DEVICE_INFO_MAX_LENGTH = 255
+
+    @staticmethod
+    def _redis():
+        return get_redis_connection(LoginHistoryService.LOGIN_CACHE_NAME)
+
+    @staticmethod
+    def record(request, user):
+        """记录一次登录事件（只写 Redis，失败时降级为同步写库）"""
+        login_ip = get_client_ip(request)
+        if not login_ip:
+            return
+        device_info = request.META.get("HTTP_USER_AGENT", "")[
+            : LoginHistoryService.DEVICE_INFO_MAX_LENGTH
+        ]
+        login_time = timezone.now()
+        try:
+            LoginHistoryService._redis().xadd(
+                LoginHistoryService.STREAM_KEY,
+                {
+                    "user_id": user.pk,
+                    "login_ip": login_ip,
+                    "device_info": device_info,
+                    "login_time": login_time.isoformat(),
+                },
+                maxlen=LoginHistoryService.STREAM_MAXLEN,
+                approximate=True,
+            )
+        except Exception as e:
+            logger.warning(f"{user.pk}:登录事件写入队列失败，同步写库，原因：{e}")
+            LoginHistoryService._write(
+                [(user.pk, login_ip, device_info or None, login_time)]
+            )
+
+    @staticmethod
+    def _ensure_group(redis):
+        try:
+            redis.xgroup_create(
+                LoginHistoryService.STREAM_KEY,
+                LoginHistoryService.GROUP_NAME,
+                id="0",
+                mkstream=True,
+            )
+        except Exception as e:
+            # 消费组已存在
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    @staticmethod
+    def _write(events):
+        """events: [(user_id, login_ip, device_info, login_time)]"""
+        last_ips = {}
+        for user_id, login_ip, _, login_time in sorted(events, key=lambda e: e[3]):
+            last_ips[user_id] = login_ip
+
+        with transaction.atomic():
+            UserLoginHistory.objects.bulk_create(
+                [
+                    UserLoginHistory(
+                        user_id=user_id,
+                        login_ip=login_ip,
+                        device_info=device_info,
+                        login_time=login_time,
+                    )
+                    for user_id, login_ip, device_info, login_time in events
+                ]
+            )
+            profiles = list(
+                UserProfile.objects.filter(user_id__in=last_ips.keys()).only(
+                    "id", "user_id", "last_login_ip"
+                )
+            )
+            for profile in profiles:
+                profile.last_login_ip = last_ips[profile.user_id]
+            UserProfile.objects.bulk_update(profiles, ["last_login_ip"])
+
+    @staticmethod
+    def flush(batch_size=None):
+        """
+        将队列中的登录事件批量落库，返回写入的记录数
+        先处理上次未确认（写库失败）的事件，再读取新事件；上一次任务未结束时跳过
+        """
+        redis = LoginHistoryService._redis()
+        token = RedisLockService.acquire(
+            redis,
+            LoginHistoryService.FLUSH_LOCK_KEY,
+            getattr(settings, "LOGIN_HISTORY_FLUSH_LOCK_SECONDS", 300),
+        )
+        if token is None:
+            logger.info("登录历史落库正在进行，跳过本次")
+            return 0
+        try:
+            return LoginHistoryService._flush_stream(redis, batch_size)
+        finally:
+            RedisLockService.release(redis, LoginHistoryService.FLUSH_LOCK_KEY, token)
+
+    @staticmethod
+    def _flush_stream(redis, batch_size=None):
+        batch_size = batch_size or getattr(settings, "LOGIN_HISTORY_FLUSH_BATCH", 1000)
+        LoginHistoryService._ensure_group(redis)
+
+        written = 0
+        for start_id in ("0", ">"):
+            while True:
+                response = redis.xreadgroup(
+                    LoginHistoryService.GROUP_NAME,
+                    LoginHistoryService.CONSUMER_NAME,
+                    {LoginHistoryService.STREAM_KEY: start_id},
+                    count=batch_size,
+                )
+                messages = response[0][1] if response else []
+                if not messages:
+                    break
+
+                message_ids, events = [], []
+                for message_id, fields in messages:
+                    message_ids.append(message_id)
+                    try:
+                        events.append(
+                            (
+                                int(fields[b"user_id"]),
+                                fields[b"login_ip"].decode(),
+                                fields[b"device_info"].decode() or None,
+                                datetime.fromisoformat(fields[b"login_time"].decode()),
+                            )
+                        )
+                    except (KeyError, ValueError) as e:
+                        logger.error(f"登录事件格式错误，已丢弃 {message_id}: {e}")
+                if events:
+                    LoginHistoryService._write(events)
+                    written += len(events)
+
+                pipe = redis.pipeline()
+                pipe.xack(
+                    LoginHistoryService.STREAM_KEY,
+                    LoginHistoryService.GROUP_NAME,
+                    *message_ids,
+                )
+                pipe.xdel(LoginHistoryService.STREAM_KEY, *message_ids)
+                pipe.execute()
+                if len(messages) < batch_size:
+                    break
+
+        if written:
+            logger.info(f"登录历史落库完成，共 {written} 条")
+        return written
+
+    @staticmethod
+    def rollup(retention_days=None):
+        """
+        将保留期之前的登录明细按 用户 + 天 汇总后删除，返回汇总的天数
+        每天一个事务：汇总写入与明细删除同时提交，中途失败可安全重跑
+        """
+        retention_days = retention_days or getattr(
+            settings, "LOGIN_HISTORY_RETENTION_DAYS", 90
+        )
+        tz = timezone.get_current_timezone()
+        cutoff_date = timezone.localdate() - timedelta(days=retention_days)
+        cutoff = timezone.make_aware(datetime.combine(cutoff_date, time.min), tz)
+
+        days = 0
+        while True:
+            oldest = (
+                UserLoginHistory.objects.filter(login_time__lt=cutoff)
+                .order_by("login_time")
+                .values_list("login_time", flat=True)
+                .first()
+            )
+            if oldest is None:
+                break
+            day = timezone.localtime(oldest, tz).date()
+            day_start = timezone.make_aware(datetime.combine(day, time.min), tz)
+            day_rows = UserLoginHistory.objects.filter(
+                login_time__gte=day_start,
+                login_time__lt=day_start + timedelta(days=1),
+            )
+            with transaction.atomic():
+                summaries = (
+                    day_rows.order_by()
+                    .values("user_id")
+                    .annotate(
+                        login_count=Count("id"),
+                        ip_count=Count("login_ip", distinct=True),
+                        first_login_at=Min("login_time"),
+                        last_login_at=Max("login_time"),
+                    )
+                )
+                UserLoginDailySummary.objects.bulk_create(
+                    [UserLoginDailySummary(date=day, **row) for row in summaries],
+                    update_conflicts=True,
+                    # MySQL 的 ON DUPLICATE KEY UPDATE 不支持指定冲突字段
+                    unique_fields=(
+                        ["user", "date"]
+                        if connection.features.supports_update_conflicts_with_target
+                        else None
+                    ),
+                    update_fields=[
+                        "login_count",
+                        "ip_count",
+                        "first_login_at",
+                        "last_login_at",
+                    ],
+                )
+                day_rows.delete()
+            days += 1
+
+        if days:
+            logger.info(f"登录历史汇总完成，共 {days} 天")
+        return days
@@ -1,9 +1,6 @@
-import base64
 import logging
 import random
-import uuid
 
-from captcha.image import ImageCaptcha
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from rest_framework.exceptions import NotFound
@@ -17,14 +14,12 @@ from rest_framework.generics import (
 )
 from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
 from rest_framework.views import APIView
-from rest_framework_simplejwt.token_blacklist.models import (
-    OutstandingToken,
-    BlacklistedToken,
-)
 
 from common.permissions import RBACPermission
-from common.utils.cache_utils import CacheService
+from common.utils.captcha_utils import CaptchaPoolService
+from common.utils.rbac_utils import PermissionTreeService
 from common.utils.sms_utils import SMSService
+from .utils.login_utils import LoginHistoryService
 from .models import (
     UserProfile,
     GenderChoices,
@@ -56,6 +51,7 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.exceptions import TokenError
 
 from django.db import transaction
+from django.http import HttpResponse
 from django.conf import settings
 from rest_framework import status
 from rest_framework.response import Response
@@ -64,8 +60,7 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from apps.common.permissions import IsSelf, CanViewUserProfile
 from apps.common.auth import (
     generate_tokens_for_user,
-    make_random_code,
-    CaptchaValidateMixin,
+    TokenRevocationService,
 )
 from apps.common.utils.email_utils import EmailService
 
@@ -109,6 +104,8 @@ class LoginView(GenericAPIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data.get("user")
         access_token, refresh_token = generate_tokens_for_user(user)
+        # 登录历史只入队，由定时任务批量落库
+        LoginHistoryService.record(request, user)
         logger.info(f"{user.id}:{user.username}普通登录成功")
         return Response(
             {
@@ -192,10 +189,8 @@ class DestroyUserView(APIView):
     def post(self, request):
         user = request.user
         try:
-            # refresh token 拉入黑名单
-            tokens = OutstandingToken.objects.filter(user=user)
-            for t in tokens:
-                BlacklistedToken.objects.get_or_create(token=t)
+            # 批量吊销全部 refresh / access token
+            TokenRevocationService.revoke_user_tokens(user)
         except Exception as e:
             logger.error(
                 f"{user.id}:{user.username}token已过期或已登出，原因：{str(e)}"
@@ -232,10 +227,8 @@ class ResetPasswordView(GenericAPIView):
             user.set_password(password)
             user.save()
 
-            # 注销 refresh token，强制当前登录状态下线（不依赖前端）
-            tokens = OutstandingToken.objects.filter(user=user)
-            for t in tokens:
-                BlacklistedToken.objects.get_or_create(token=t)
+            # 吊销全部 refresh / access token，强制当前登录状态下线（不依赖前端）
+            TokenRevocationService.revoke_user_tokens(user)
 
             logger.info(f"{user.id}:{user.username}重置密码成功")
             return Response(
@@ -345,25 +338,8 @@ class ImageCaptchaView(GenericAPIView):
     throttle_classes = [CaptchaRateThrottle]
 
     def get(self, request):
-        """生成图片验证码并返回给前端"""
-        # 生成随机验证码
-        code = make_random_code()
-
-        # 生成验证码图片
-        image = ImageCaptcha(width=280, height=90)
-        img_bytes = image.generate(code).read()
-        img_base64 = base64.b64encode(img_bytes).decode("utf-8")
-
-        # 将验证码保存到 Redis
-        captcha_id = str(uuid.uuid4()).replace("-", "")
-        key = f"captcha:{captcha_id}"
-        code = code.lower()
-        CacheService.set_value(
-            key,
-            code,
-            cache=CaptchaValidateMixin.CAPTCHA_CACHE_NAME,
-            exp=int(settings.CAPTCHA_EXPIRE_SECONDS),
-        )
+        """从预渲染验证码池取出一张验证码返回给前端，池空时当场生成"""
+        captcha_id, img_base64 = CaptchaPoolService.issue()
 
         # 组织响应数据
         data = {
@@ -463,7 +439,11 @@ class UserMobileVerifySendView(GenericAPIView):
         # 发送验证码
         mobile = serializer.validated_data["mobile"]
         random_code = random.randint(100000, 999999)
-        SMSService.send_code(mobile, random_code)
+        if not SMSService.send_code(mobile, random_code):
+            return Response(
+                {"detail": "验证码发送过于频繁，请稍后再试"},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
         logger.info(f"用户{request.user.id}发送手机验证码成功，手机号：{mobile}")
         return Response({"detail": "手机验证码发送成功"}, status=status.HTTP_200_OK)
 
@@ -483,6 +463,8 @@ class PermissionListView(ListAPIView):
     serializer_class = PermissionListSerializer
     permission_classes = [IsAuthenticated, RBACPermission]
     permission_code = "rbac.view_permissions"
+    # 权限树整体返回，不再按根节点分页（分页会截断树）
+    pagination_class = None
 
     def get_queryset(self):
         # 只获取根节点（parent is null）
@@ -490,6 +472,16 @@ class PermissionListView(ListAPIView):
             "children"
         )
 
+    def list(self, request, *args, **kwargs):
+        # 整棵树一次查询组装并缓存为渲染好的 JSON，未变化时返回 304
+        tree = PermissionTreeService.get_tree()
+        if request.headers.get("If-None-Match") == tree["etag"]:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(tree["body"], content_type="application/json")
+        response["ETag"] = tree["etag"]
+        return response
+
 
 class RolePermissionView(GenericAPIView):
     """角色对应权限查看视图"""
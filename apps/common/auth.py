@@ -1,20 +1,42 @@
+import hashlib
+import logging
 import random
 import string
+import time
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from apps.common.utils.cache_utils import CacheService
+from apps.common.utils.metrics_utils import MetricsService
 
 User = get_user_model()
+logger = logging.getLogger("feat")
 
 
 def generate_tokens_for_user(user):
-    """使用 simple-jwt 生成 access/refresh token"""
+    """
+    使用 simple-jwt 生成 access/refresh token
+    iat 改为带小数的时间戳，吊销判断可以区分吊销同一秒内、吊销之后签发的新令牌
+    """
+    issued_at = time.time()
     refresh = RefreshToken.for_user(user)
-    return str(refresh.access_token), str(refresh)
+    refresh["iat"] = issued_at
+    access = refresh.access_token
+    access["iat"] = issued_at
+    return str(access), str(refresh)
 
 
 def make_random_code(length=5):
@@ -51,21 +73,350 @@ class CaptchaValidateMixin:
         return attrs
 
 
+def get_client_ip(request):
+    """
+    获取客户端 IP
+    X-Forwarded-For 最左侧的地址由客户端任意填写，不可信；
+    只有部署在 TRUSTED_PROXY_COUNT 层可信反向代理之后时，才取从右数第 N 个地址，
+    否则（默认 0）直接使用 REMOTE_ADDR
+    """
+    if request is None:
+        return None
+    proxy_count = getattr(settings, "TRUSTED_PROXY_COUNT", 0)
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+    if proxy_count and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if len(hops) >= proxy_count:
+            return hops[-proxy_count]
+    return request.META.get("REMOTE_ADDR")
+
+
+class LoginGuardService:
+    """
+    登录防护（均在查库、哈希之前判断）
+      - 不存在账号的负缓存：auth:unknown:{digest}，撞库时不再反复查库
+      - 失败计数：auth:fail:{id|ip}:{digest}，窗口期内累计
+      - 指数锁定：失败次数达到阈值后锁定 base * 2^(超出次数) 秒，封顶 max
+    """
+
+    GUARD_CACHE_NAME = "default"
+    UNKNOWN_KEY = "auth:unknown:{}"
+    FAIL_KEY = "auth:fail:{}:{}"  # scope, digest
+    LOCK_KEY = "auth:lock:{}:{}"  # scope, digest
+
+    @staticmethod
+    def _cache():
+        return caches[LoginGuardService.GUARD_CACHE_NAME]
+
+    @staticmethod
+    def _digest(value):
+        return hashlib.sha1(str(value).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _identifier_digest(identifier):
+        """账号维度统一去空白、忽略大小写后再取摘要，避免换大小写绕过计数或负缓存"""
+        return LoginGuardService._digest(str(identifier).strip().lower())
+
+    @staticmethod
+    def _scopes(identifier, ip):
+        """(作用域, 摘要, 失败阈值)"""
+        scopes = []
+        if identifier:
+            scopes.append(
+                (
+                    "id",
+                    LoginGuardService._identifier_digest(identifier),
+                    getattr(settings, "LOGIN_FAIL_THRESHOLD", 5),
+                )
+            )
+        if ip:
+            scopes.append(
+                (
+                    "ip",
+                    LoginGuardService._digest(ip),
+                    getattr(settings, "LOGIN_IP_FAIL_THRESHOLD", 20),
+                )
+            )
+        return scopes
+
+    @staticmethod
+    def is_unknown(identifier):
+        try:
+            return bool(
+                LoginGuardService._cache().get(
+                    LoginGuardService.UNKNOWN_KEY.format(
+                        LoginGuardService._identifier_digest(identifier)
+                    )
+                )
+            )
+        except Exception as e:
+            logger.warning(f"登录负缓存读取失败: {e}")
+            return False
+
+    @staticmethod
+    def mark_unknown(identifier):
+        try:
+            LoginGuardService._cache().set(
+                LoginGuardService.UNKNOWN_KEY.format(
+                    LoginGuardService._identifier_digest(identifier)
+                ),
+                1,
+                getattr(settings, "LOGIN_UNKNOWN_CACHE_SECONDS", 300),
+            )
+        except Exception as e:
+            logger.warning(f"登录负缓存写入失败: {e}")
+
+    @staticmethod
+    def clear_unknown(*identifiers):
+        """注册、修改用户名/邮箱后清除负缓存"""
+        keys = [
+            LoginGuardService.UNKNOWN_KEY.format(
+                LoginGuardService._identifier_digest(i)
+            )
+            for i in identifiers
+            if i
+        ]
+        try:
+            LoginGuardService._cache().delete_many(keys)
+        except Exception as e:
+            logger.warning(f"登录负缓存清除失败: {e}")
+
+    @staticmethod
+    def lock_remaining(identifier, ip):
+        """返回剩余锁定秒数，未锁定返回 0"""
+        keys = [
+            LoginGuardService.LOCK_KEY.format(scope, digest)
+            for scope, digest, _ in LoginGuardService._scopes(identifier, ip)
+        ]
+        try:
+            locks = LoginGuardService._cache().get_many(keys)
+        except Exception as e:
+            logger.warning(f"登录锁定状态读取失败: {e}")
+            return 0
+        now = time.time()
+        return max(
+            [int(until - now) + 1 for until in locks.values() if until > now], default=0
+        )
+
+    @staticmethod
+    def record_failure(identifier, ip):
+        """记录一次失败，超过阈值后按指数退避锁定"""
+        cache = LoginGuardService._cache()
+        window = getattr(settings, "LOGIN_FAIL_WINDOW_SECONDS", 900)
+        base = getattr(settings, "LOGIN_LOCK_BASE_SECONDS", 60)
+        ceiling = getattr(settings, "LOGIN_LOCK_MAX_SECONDS", 3600)
+        for scope, digest, threshold in LoginGuardService._scopes(identifier, ip):
+            fail_key = LoginGuardService.FAIL_KEY.format(scope, digest)
+            try:
+                cache.add(fail_key, 0, window)
+                failures = cache.incr(fail_key)
+                if failures >= threshold:
+                    seconds = min(base * 2 ** (failures - threshold), ceiling)
+                    cache.set(
+                        LoginGuardService.LOCK_KEY.format(scope, digest),
+                        time.time() + seconds,
+                        seconds,
+                    )
+                    MetricsService.incr("auth_guard.lockout")
+            except Exception as e:
+                logger.warning(f"登录失败计数写入失败: {e}")
+
+    @staticmethod
+    def reset(identifier):
+        """登录成功后清除账号维度的失败计数与锁定（IP 维度保留）"""
+        digest = LoginGuardService._identifier_digest(identifier)
+        try:
+            LoginGuardService._cache().delete_many(
+                [
+                    LoginGuardService.FAIL_KEY.format("id", digest),
+                    LoginGuardService.LOCK_KEY.format("id", digest),
+                ]
+            )
+        except Exception as e:
+            logger.warning(f"登录失败计数清除失败: {e}")
+
+
 class EmailOrUsernameBackend(ModelBackend):
     """
     自定义验证后端，支持用户名或邮箱登录
+    锁定检查、不存在账号的负缓存都在查库和密码哈希之前完成
     """
 
     def authenticate(self, request, username=None, password=None, **kwargs):
         if username is None:
             username = kwargs.get("email")
+        if not username or password is None:
+            return None
+
+        ip = get_client_ip(request)
+        if LoginGuardService.lock_remaining(username, ip):
+            MetricsService.incr("auth_guard.rejected_locked")
+            return None
+        if LoginGuardService.is_unknown(username):
+            MetricsService.incr("auth_guard.rejected_unknown")
+            LoginGuardService.record_failure(None, ip)
+            return None
+
+        field = "email" if "@" in username else "username"
         try:
-            if "@" in username:
-                user = User.objects.get(email=username)
-            else:
-                user = User.objects.get(username=username)
+            user = User.objects.get(**{field: username})
         except User.DoesNotExist:
+            # 负缓存按忽略大小写的键记录，只有不存在任何大小写变体时才能标记
+            if not User.objects.filter(
+                **{f"{field}__iexact": username.strip()}
+            ).exists():
+                LoginGuardService.mark_unknown(username)
+            LoginGuardService.record_failure(None, ip)
             return None
+        # check_password 在首选哈希算法或参数变化时会自动重新哈希并保存
         if user.check_password(password):
+            LoginGuardService.reset(username)
             return user
+        LoginGuardService.record_failure(username, ip)
         return None
+
+
+class TokenRevocationService:
+    """
+    用户令牌批量吊销
+      - refresh token：一条 INSERT ... ON CONFLICT DO NOTHING 批量拉黑，不再逐条 get_or_create
+      - access token：在 Redis 记录 auth:revoked_before:{user_id}（带小数的吊销时间戳），
+        认证时签发时间不晚于该时间的令牌一律无效，O(1) 且不查库
+    """
+
+    REVOKE_CACHE_NAME = "default"
+    REVOKED_BEFORE_KEY = "auth:revoked_before:{}"
+
+    @staticmethod
+    def _cache():
+        return caches[TokenRevocationService.REVOKE_CACHE_NAME]
+
+    @staticmethod
+    def _key_ttl():
+        # 超过最长令牌有效期后，旧令牌本身已过期，记录无需保留
+        lifetime = max(
+            jwt_settings.ACCESS_TOKEN_LIFETIME, jwt_settings.REFRESH_TOKEN_LIFETIME
+        )
+        return int(lifetime.total_seconds())
+
+    @staticmethod
+    def blacklist_user_tokens(user):
+        """批量拉黑用户所有未过期、未拉黑的 refresh token，返回新拉黑的数量"""
+        token_ids = OutstandingToken.objects.filter(
+            user=user, expires_at__gt=timezone.now(), blacklistedtoken__isnull=True
+        ).values_list("id", flat=True)
+        created = BlacklistedToken.objects.bulk_create(
+            [BlacklistedToken(token_id=token_id) for token_id in token_ids],
+            batch_size=getattr(settings, "TOKEN_BLACKLIST_BATCH_SIZE", 1000),
+            ignore_conflicts=True,
+        )
+        return len(created)
+
+    @staticmethod
+    def revoke_user_tokens(user):
+        """吊销用户此刻之前签发的全部令牌（refresh 拉黑 + access 时间戳失效）"""
+        try:
+            TokenRevocationService._cache().set(
+                TokenRevocationService.REVOKED_BEFORE_KEY.format(user.pk),
+                time.time(),
+                TokenRevocationService._key_ttl(),
+            )
+        except Exception as e:
+            # 时间戳写入失败时 access token 仍会在短有效期后自然过期
+            logger.error(f"{user.pk}:access token 吊销时间戳写入失败，原因：{e}")
+        return TokenRevocationService.blacklist_user_tokens(user)
+
+    @staticmethod
+    def is_revoked(user_id, issued_at):
+        """
+        令牌签发时间不晚于吊销时间戳即视为已吊销（缓存不可用时放行）
+        两者都带小数，吊销后同一秒内重新登录签发的令牌不会被误判；
+        只精确到秒的旧令牌 iat 向下取整，吊销同一秒内签发的仍会失效
+        """
+        try:
+            revoked_before = TokenRevocationService._cache().get(
+                TokenRevocationService.REVOKED_BEFORE_KEY.format(user_id)
+            )
+        except Exception as e:
+            logger.warning(f"{user_id}:令牌吊销时间戳读取失败，原因：{e}")
+            return False
+        return revoked_before is not None and float(issued_at) <= float(revoked_before)
+
+
+class RevocationAwareJWTAuthentication(JWTAuthentication):
+    """在 simple-jwt 校验基础上检查用户级吊销时间戳"""
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        user_id = validated_token.get(jwt_settings.USER_ID_CLAIM)
+        issued_at = validated_token.get("iat")
+        if (
+            user_id is not None
+            and issued_at is not None
+            and TokenRevocationService.is_revoked(user_id, issued_at)
+        ):
+            raise InvalidToken({"detail": "令牌已失效，请重新登录"})
+        return validated_token
+
+
+class TokenPruneService:
+    """
+    令牌表清理：按批删除已过期的 OutstandingToken（及其 BlacklistedToken）
+    过期令牌无论是否拉黑都无法再通过校验，删除不影响安全性
+    """
+
+    @staticmethod
+    def reclaimable_counts(now=None):
+        """统计表规模与可回收行数"""
+        now = now or timezone.now()
+        expired = OutstandingToken.objects.filter(expires_at__lte=now)
+        return {
+            "outstanding": OutstandingToken.objects.count(),
+            "blacklisted": BlacklistedToken.objects.count(),
+            "outstanding_expired": expired.count(),
+            "blacklisted_expired": BlacklistedToken.objects.filter(
+                token__expires_at__lte=now
+            ).count(),
+        }
+
+    @staticmethod
+    def record_table_metrics():
+        """记录令牌表行数指标"""
+        MetricsService.gauge(
+            "auth_tokens.outstanding", OutstandingToken.objects.count()
+        )
+        MetricsService.gauge(
+            "auth_tokens.blacklisted", BlacklistedToken.objects.count()
+        )
+
+    @staticmethod
+    def prune_expired(batch_size=None, max_batches=None):
+        """
+        按主键分批删除过期令牌，每批一个短事务，避免长时间锁表
+        返回 {"outstanding": 删除数, "blacklisted": 删除数}
+        """
+        batch_size = batch_size or getattr(settings, "TOKEN_PRUNE_BATCH_SIZE", 5000)
+        max_batches = max_batches or getattr(settings, "TOKEN_PRUNE_MAX_BATCHES", 100)
+        now = timezone.now()
+        deleted = {"outstanding": 0, "blacklisted": 0}
+        for _ in range(max_batches):
+            token_ids = list(
+                OutstandingToken.objects.filter(expires_at__lte=now)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not token_ids:
+                break
+            blacklisted, _ = BlacklistedToken.objects.filter(
+                token_id__in=token_ids
+            ).delete()
+            outstanding, _ = OutstandingToken.objects.filter(id__in=token_ids).delete()
+            deleted["blacklisted"] += blacklisted
+            deleted["outstanding"] += outstanding
+            if len(token_ids) < batch_size:
+                break
+
+        MetricsService.incr("auth_tokens.pruned", deleted["outstanding"])
+        TokenPruneService.record_table_metrics()
+        logger.info(f"过期令牌清理完成: {deleted}")
+        return deleted
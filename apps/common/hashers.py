@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher
+
+from common.utils.metrics_utils import MetricsService
+
+
+class TimedHasherMixin:
+    """记录密码哈希耗时指标：auth_hash.{算法}.{encode|verify}_count / _ms"""
+
+    def _timed(self, operation, func):
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            elapsed_ms = int((time.perf_counter() - start) * 1000)
+            prefix = f"auth_hash.{self.algorithm}.{operation}"
+            MetricsService.incr(f"{prefix}_count")
+            MetricsService.incr(f"{prefix}_ms", elapsed_ms)
+
+    def encode(self, password, salt, *args, **kwargs):
+        return self._timed(
+            "encode",
+            lambda: super(TimedHasherMixin, self).encode(
+                password, salt, *args, **kwargs
+            ),
+        )
+
+    def verify(self, password, encoded):
+        return self._timed(
+            "verify", lambda: super(TimedHasherMixin, self).verify(password, encoded)
+        )
+
+
+class TunedArgon2PasswordHasher(TimedHasherMixin, Argon2PasswordHasher):
+    """
+    首选哈希算法：Argon2id，参数可通过配置调整
+    参数变化后，用户下次登录成功时会自动按新参数重新哈希
+    """
+
+    time_cost = getattr(settings, "PASSWORD_ARGON2_TIME_COST", 2)
+    memory_cost = getattr(settings, "PASSWORD_ARGON2_MEMORY_COST", 102400)
+    parallelism = getattr(settings, "PASSWORD_ARGON2_PARALLELISM", 8)
+
+
+class TimedPBKDF2PasswordHasher(TimedHasherMixin, PBKDF2PasswordHasher):
+    """兼容旧的 PBKDF2 哈希，登录成功后升级为 Argon2"""
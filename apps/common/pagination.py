@@ -0,0 +1,136 @@
+import base64
+import json
+from datetime import date, datetime
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    通用游标（keyset）分页：WHERE (a, b) > (上一页末行) ORDER BY a, b LIMIT n
+      - 翻到任意深度都只走索引范围扫描，不再有 OFFSET 和每次请求的 COUNT(*)
+      - 排序字段必须非空，且最后一个字段唯一（通常为 id）
+      - 视图可定义 get_keyset_ordering() 动态切换排序，
+        定义 get_pagination_count() 提供反规范化的总数（返回 None 则不返回 count）
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = 20
+    max_page_size = 100
+    ordering = ("id",)
+    invalid_cursor_message = "无效的游标"
+
+    def get_ordering(self, view):
+        get_ordering = getattr(view, "get_keyset_ordering", None)
+        return tuple(get_ordering()) if get_ordering else self.ordering
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, 0))
+        except ValueError:
+            size = 0
+        return min(size, self.max_page_size) if size > 0 else self.page_size
+
+    @staticmethod
+    def _encode_value(value):
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        return value
+
+    def encode_cursor(self, values):
+        raw = json.dumps([self._encode_value(v) for v in values], separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor, ordering):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            if not isinstance(values, list) or len(values) != len(ordering):
+                raise ValueError
+            # 日期时间以 ISO 字符串保存，还原后再比较，避免按字符串比较时区不一致
+            return [
+                (parse_datetime(v) or v) if isinstance(v, str) else v for v in values
+            ]
+        except (ValueError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def build_keyset_filter(ordering, values):
+        """
+        (a, b, c) > (va, vb, vc) 展开为
+        a > va OR (a = va AND b > vb) OR (a = va AND b = vb AND c > vc)
+        降序字段（"-a"）使用 lt
+        """
+        condition = Q()
+        equals = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= Q(**equals, **{f"{name}__{lookup}": value})
+            equals[name] = value
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.view = view
+        self.ordering_fields = self.get_ordering(view)
+        self.page_size_value = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering_fields)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            values = self.decode_cursor(cursor, self.ordering_fields)
+            queryset = queryset.filter(
+                self.build_keyset_filter(self.ordering_fields, values)
+            )
+
+        # 多取一条用于判断是否还有下一页
+        rows = list(queryset[: self.page_size_value + 1])
+        self.has_next = len(rows) > self.page_size_value
+        self.page = rows[: self.page_size_value]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        last = self.page[-1]
+        values = [getattr(last, field.lstrip("-")) for field in self.ordering_fields]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(values)
+        )
+
+    def get_first_link(self):
+        return remove_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param
+        )
+
+    def get_count(self):
+        get_count = getattr(self.view, "get_pagination_count", None)
+        return get_count() if get_count else None
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "count": self.get_count(),
+                "next": self.get_next_link(),
+                "first": self.get_first_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "count": {"type": "integer", "nullable": True},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "first": {"type": "string", "format": "uri"},
+                "results": schema,
+            },
+        }
@@ -3,7 +3,9 @@ from typing import Optional
 
 from rest_framework.permissions import BasePermission
 
-from forums.models import RoleChoices, Forum, ForumMember
+from forums.models import Forum
+from forums.utils.role_utils import ForumRoleService
+from common.utils.rbac_utils import RBACService
 from interactions.models import UserFollow
 from accounts.models import VisibilityChoices
 
@@ -96,12 +98,8 @@ class RBACPermission(BasePermission):
         if not user.is_authenticated:
             return False
 
-        # 超级管理员放行
-        if getattr(user.role, "level", 0) >= 100:
-            return True
-
-        # 普通角色权限判断
-        return user.role.permissions.filter(permission__code=perm_code).exists()
+        # 超级管理员放行，普通角色在编译好的权限集中查找（不访问数据库）
+        return RBACService.has_permission(user, perm_code)
 
     def has_permission(self, request, view):
         """统一入口"""
@@ -124,30 +122,24 @@ class IsForumAdmin(BasePermission):
         """平台级超级管理员判定"""
         if getattr(user, "is_superuser", False):
             return True
-        return getattr(getattr(user, "role", None), "level", 0) >= 100
+        return RBACService.get_role_level(user) >= 100
 
-    def _get_forum_from_view(self, view) -> Optional[Forum]:
-        """从 URL kwargs 中提取论坛对象"""
+    def _get_forum_id_from_view(self, view) -> Optional[int]:
+        """从 URL kwargs 中提取贴吧 ID（不查库）"""
         for key in ("pk", "id", "forum_pk", "forum_id"):
             forum_id = view.kwargs.get(key)
-            if forum_id:
-                try:
-                    return Forum.objects.get(pk=forum_id)
-                except Forum.DoesNotExist:
-                    return None
+            if forum_id and str(forum_id).isdigit():
+                return int(forum_id)
         return None
 
-    def _user_is_forum_admin(self, user, forum: Forum) -> bool:
-        """检查用户是否为该吧的管理员或吧主"""
+    def _user_is_forum_admin(self, request, forum_id: int) -> bool:
+        """检查用户是否为该吧的管理员或吧主（读取请求内/Redis 缓存的角色表）"""
+        user = request.user
         if not user or not user.is_authenticated:
             return False
         if self._is_super_admin(user):
             return True
-        return ForumMember.objects.filter(
-            forum=forum,
-            user=user,
-            role_type__in=[RoleChoices.ADMIN, RoleChoices.OWNER],
-        ).exists()
+        return ForumRoleService.is_forum_admin(user.id, forum_id, request)
 
     def has_permission(self, request, view):
         """全局权限：登录检查 + URL 贴吧检查"""
@@ -161,9 +153,12 @@ class IsForumAdmin(BasePermission):
             return True
 
         # 3. 尝试从 URL 获取贴吧并检查权限
-        forum = self._get_forum_from_view(view)
-        if forum:
-            return self._user_is_forum_admin(user, forum)
+        forum_id = self._get_forum_id_from_view(view)
+        if forum_id:
+            if self._user_is_forum_admin(request, forum_id):
+                return True
+            # 贴吧不存在时放行，交给视图返回 404（只在拒绝路径上查库）
+            return not Forum.objects.filter(pk=forum_id).exists()
 
         # 4. 无法确定贴吧时，暂时通过（留给后续检查）
         return True
@@ -182,17 +177,17 @@ class IsForumAdmin(BasePermission):
         # 3. 从对象中提取贴吧信息
         # 对象本身就是贴吧
         if isinstance(obj, Forum):
-            forum = obj
+            forum_id = obj.pk
         # 常见情况： obj 可能有 .forum 外键（例如 ForumMember, Post, Thread）
         else:
-            forum = getattr(obj, "forum", None)  # 对象有关联的贴吧
+            forum_id = getattr(obj, "forum_id", None)  # 对象有关联的贴吧
 
         # 4. 如果还找不到贴吧，尝试从 URL 获取
-        if forum is None:
-            forum = self._get_forum_from_view(view)
+        if forum_id is None:
+            forum_id = self._get_forum_id_from_view(view)
 
         # 5. 最终检查
-        if not forum:
+        if not forum_id:
             return False  # 完全无法确定贴吧，拒绝访问
 
-        return self._user_is_forum_admin(user, forum)
+        return self._user_is_forum_admin(request, forum_id)
@@ -1,8 +1,11 @@
 import logging
 from config.celery import app
 from django.conf import settings
-from django.core.mail import send_mail
-from django.utils.html import strip_tags
+
+from common.utils.mail_utils import EmailDeliveryService
+from common.utils.metrics_utils import MetricsService
+from common.utils.oss_utils import ImagePipelineService
+from common.utils.sms_utils import SMSService
 
 """
 所有发送的邮件模板集中到一个字典 HTML_MESSAGES 里
@@ -39,35 +42,65 @@ HTML_MESSAGES = {
 }
 
 
-@app.task
-def send_email(email_recv, verify_code, mode="activate"):
+@app.task(bind=True, max_retries=3)
+def send_email(self, email_recv, verify_code, mode="activate"):
+    """单封直接发送（复用常驻连接与预渲染模板），失败按指数退避重试"""
     try:
-        # 收件人列表格式化
-        if isinstance(email_recv, str):
-            email_recv = [email_recv]
-
-        if mode not in HTML_MESSAGES.keys():
-            logging.error(f"邮件发送失败: 当前类型 {mode} 错误")
-            raise ValueError("Mode is error")
-
-        subject = HTML_MESSAGES[mode]["subject"]
-        html_message = HTML_MESSAGES[mode]["html_message"]
-        html_message = html_message.format(
-            verify_code, int(settings.EMAIL_EXPIRE_SECONDS) // 60
-        )
-
-        # 纯文本内容（避免部分邮箱不支持 HTML）
-        plain_message = strip_tags(html_message)
-        # 发件人（必须和实际的邮箱一致）
-        from_email = settings.EMAIL_HOST_USER
-        # 发送
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=from_email,
-            recipient_list=email_recv,
-            html_message=html_message,
+        EmailDeliveryService.send(
+            EmailDeliveryService.normalize(email_recv, verify_code, mode)
         )
+        MetricsService.incr("email.sent")
         logging.info(f"邮件发送到: {email_recv}")
+    except ValueError as e:
+        logging.error(f"邮件发送失败: {e}")
     except Exception as e:
+        EmailDeliveryService.reset_connection()
+        MetricsService.incr("email.failed")
         logging.error(f"邮件发送失败: {e}")
+        backoff = getattr(settings, "EMAIL_RETRY_BACKOFF_SECONDS", 30)
+        raise self.retry(exc=e, countdown=backoff * 2**self.request.retries)
+
+
+@app.task
+def flush_email_outbox():
+    """批量发送邮件队列，队列仍有积压时继续投递下一轮（未拿到锁时由持锁方负责）"""
+    sent = EmailDeliveryService.flush()
+    if sent is not None and EmailDeliveryService.backlog():
+        flush_email_outbox.delay()
+    return sent
+
+
+@app.task
+def flush_sms_outbox():
+    """批量发送短信队列，队列仍有积压时继续投递下一轮"""
+    sent = SMSService.flush()
+    if SMSService.backlog():
+        flush_sms_outbox.delay()
+    return sent
+
+
+@app.task(bind=True, max_retries=3)
+def process_uploaded_image(
+    self,
+    model_label,
+    pk,
+    field_name,
+    pending_url,
+    pending_object,
+    object_name,
+    content_type,
+    previous_url=None,
+):
+    """
+    后台处理暂存的上传图片（解码、缩放、编码）并替换模型 URL 字段
+    重试耗尽后恢复上传前的 URL 并删除暂存原图
+    """
+    args = (model_label, pk, field_name, pending_url, pending_object, object_name)
+    try:
+        return ImagePipelineService.process(*args, content_type)
+    except Exception as e:
+        logging.error(f"图片处理失败 {pending_object}: {e}")
+        if self.request.retries >= self.max_retries:
+            ImagePipelineService.fail(*args, content_type, previous_url)
+            raise
+        raise self.retry(exc=e, countdown=10 * 2**self.request.retries)
@@ -4,7 +4,7 @@ from django.urls import reverse
 from urllib.parse import urlencode
 
 from apps.common.auth import make_random_code
-from apps.common.tasks import send_email
+from common.utils.mail_utils import EmailDeliveryService
 from apps.common.utils.cache_utils import CacheService
 
 
@@ -31,8 +31,8 @@ class EmailService:
             exp=int(settings.EMAIL_EXPIRE_SECONDS),
         )
 
-        # 异步发送激活链接
-        send_email.delay(email, verify_code=verify_url, mode="activate")
+        # 入队批量发送激活链接
+        EmailDeliveryService.enqueue(email, verify_code=verify_url, mode="activate")
         return True
 
     @staticmethod
@@ -61,8 +61,8 @@ class EmailService:
             exp=int(settings.EMAIL_EXPIRE_SECONDS),
         )
 
-        # 发送邮件
-        send_email.delay(email, verify_code, mode="verify")
+        # 入队批量发送
+        EmailDeliveryService.enqueue(email, verify_code, mode="verify")
         return True
 
     @staticmethod
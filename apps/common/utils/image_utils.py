@@ -2,6 +2,17 @@ import io
 from django.conf import settings
 from PIL import Image, ExifTags
 
+from common.exceptions import UploadImageError
+
+# EXIF Orientation 标签 ID，模块加载时确定一次
+ORIENTATION_TAG = ExifTags.Base.Orientation
+IMAGE_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+ORIENTATION_TRANSPOSE = {
+    3: Image.Transpose.ROTATE_180,
+    6: Image.Transpose.ROTATE_270,
+    8: Image.Transpose.ROTATE_90,
+}
+
 
 # ---------- 图片处理组件 ----------
 class ImageProcessor:
@@ -10,41 +21,78 @@ class ImageProcessor:
     @staticmethod
     def normalize_exif_orientation(img: Image.Image) -> Image.Image:
         try:
-            for k, v in ExifTags.TAGS.items():
-                if v == "Orientation":
-                    orientation_key = k
-                    break
-            exif = img._getexif()
-            if not exif:
-                return img
-            orientation = exif.get(orientation_key)
-            if orientation == 3:
-                img = img.rotate(180, expand=True)
-            elif orientation == 6:
-                img = img.rotate(270, expand=True)
-            elif orientation == 8:
-                img = img.rotate(90, expand=True)
-            return img
+            method = ORIENTATION_TRANSPOSE.get(img.getexif().get(ORIENTATION_TAG))
+            # transpose 为无损的像素重排，比 rotate(expand=True) 快
+            return img.transpose(method) if method is not None else img
         except Exception:
             return img
 
+    @staticmethod
+    def detect_format(file_obj):
+        """
+        按文件内容（而非客户端声明的类型与扩展名）识别图片格式
+        返回 (content_type, 扩展名)，不在 OSS_ALLOWED_IMAGE_TYPES 中时抛出 UploadImageError
+        """
+        file_obj.seek(0)
+        try:
+            with Image.open(file_obj) as img:
+                fmt = img.format
+        except Exception as e:
+            raise UploadImageError("无法识别的图片格式") from e
+        finally:
+            file_obj.seek(0)
+        content_type = Image.MIME.get(fmt)
+        allowed = getattr(
+            settings,
+            "OSS_ALLOWED_IMAGE_TYPES",
+            ["image/jpeg", "image/png", "image/webp"],
+        )
+        if content_type not in allowed:
+            raise UploadImageError(f"不支持的图片格式: {fmt}")
+        return content_type, IMAGE_EXTENSIONS.get(fmt, fmt.lower())
+
+    @staticmethod
+    def check_pixels(img: Image.Image):
+        """校验像素数（只依赖文件头中的尺寸，不触发解码）"""
+        w, h = img.size
+        if w * h > getattr(settings, "OSS_MAX_IMAGE_PIXELS", 40_000_000):
+            raise UploadImageError(f"图片像素数超过限制: {w}x{h}")
+
+    @staticmethod
+    def open_image(file_obj, max_side=None):
+        """
+        打开并解码图片，返回 (图片, 原格式)
+          - 只读文件头即校验像素数，超过 OSS_MAX_IMAGE_PIXELS 时不解码直接拒绝
+          - 直接从上传文件对象解码，不再复制一份 BytesIO
+          - JPEG 需要缩小时用 draft 模式在解码阶段按 1/2、1/4、1/8 缩小（DCT 缩放），
+            解码后的最长边仍不小于 max_side
+        """
+        file_obj.seek(0)
+        img = Image.open(file_obj)
+        ImageProcessor.check_pixels(img)
+        w, h = img.size
+
+        fmt = (img.format or "JPEG").upper()
+        if max_side and fmt == "JPEG" and max(w, h) > max_side:
+            scale = max_side / max(w, h)
+            img.draft(img.mode, (int(w * scale) + 1, int(h * scale) + 1))
+        img.load()
+        return ImageProcessor.normalize_exif_orientation(img), fmt
+
     @staticmethod
     def compress_image(file_obj, max_width=None, quality=None):
         """压缩图片并返回 bytes 与 content_type"""
         max_width = max_width or getattr(settings, "OSS_MAX_IMAGE_WIDTH", 2000)
         quality = quality or getattr(settings, "OSS_DEFAULT_IMAGE_QUALITY", 85)
 
-        file_obj.seek(0)
-        buf = io.BytesIO(file_obj.read())
-        img = Image.open(buf)
-        img = ImageProcessor.normalize_exif_orientation(img)
-        w, h = img.size
-        if max(w, h) > max_width:
-            scale = max_width / max(w, h)
-            img = img.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
+        img, fmt = ImageProcessor.open_image(file_obj, max_width)
+        img = ImageProcessor._fit(img, max_width)
+        return ImageProcessor.encode(img, fmt, quality)
 
+    @staticmethod
+    def encode(img: Image.Image, fmt: str, quality: int):
+        """按格式编码图片，返回 bytes 与 content_type（不支持的格式统一转 JPEG）"""
         out_buf = io.BytesIO()
-        fmt = (img.format or "JPEG").upper()
         fmt = fmt if fmt in ("JPEG", "PNG", "WEBP") else "JPEG"
 
         if fmt == "PNG":
@@ -54,7 +102,56 @@ class ImageProcessor:
             img.save(out_buf, format="WEBP", quality=quality)
             ct = "image/webp"
         else:
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
             img.save(out_buf, format="JPEG", quality=quality, optimize=True)
             ct = "image/jpeg"
 
         return out_buf.getvalue(), ct
+
+    @staticmethod
+    def generate_derivatives(file_obj, sizes=None, max_width=None, quality=None):
+        """
+        一次解码生成全部衍生图
+        返回 {变体名: (bytes, content_type)}，变体名为
+          - "orig"：限制在 max_width 内的压缩原图（保持原格式）
+          - "64" / "256" ...：最长边不超过该尺寸的缩略图（保持原格式，不放大）
+          - "64.webp" ...：同尺寸的 WebP 版本（OSS_IMAGE_WEBP_VARIANTS 开启时）
+        缩略图从大到小逐级缩放，每级只处理上一级的结果
+        """
+        sizes = sizes or getattr(
+            settings, "OSS_IMAGE_DERIVATIVE_SIZES", [64, 256, 1024]
+        )
+        max_width = max_width or getattr(settings, "OSS_MAX_IMAGE_WIDTH", 2000)
+        quality = quality or getattr(settings, "OSS_DEFAULT_IMAGE_QUALITY", 85)
+        webp = getattr(settings, "OSS_IMAGE_WEBP_VARIANTS", True)
+
+        img, fmt = ImageProcessor.open_image(file_obj, max_width)
+        img = ImageProcessor._fit(img, max_width)
+
+        variants = {"orig": ImageProcessor.encode(img, fmt, quality)}
+        current = img
+        for size in sorted(set(sizes), reverse=True):
+            current = ImageProcessor._fit(current, size)
+            variants[str(size)] = ImageProcessor.encode(current, fmt, quality)
+            if webp:
+                variants[f"{size}.webp"] = ImageProcessor.encode(
+                    current, "WEBP", quality
+                )
+        return variants
+
+    @staticmethod
+    def _fit(img: Image.Image, size: int) -> Image.Image:
+        """
+        等比缩放到最长边不超过 size
+        reducing_gap：缩小倍数较大时先整数倍快速缩小，再 LANCZOS 到目标尺寸
+        """
+        w, h = img.size
+        if max(w, h) <= size:
+            return img
+        scale = size / max(w, h)
+        return img.resize(
+            (max(1, int(w * scale)), max(1, int(h * scale))),
+            Image.LANCZOS,
+            reducing_gap=3.0,
+        )
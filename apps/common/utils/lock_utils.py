@@ -0,0 +1,36 @@
+import logging
+import uuid
+
+logger = logging.getLogger("feat")
+
+
+class RedisLockService:
+    """
+    基于 SET NX EX 的互斥锁（批量 flush 等后台任务使用）
+      - 锁的值为随机令牌，释放时用 Lua 比较后删除，
+        避免锁过期后旧持有者误删下一个持有者的锁
+    """
+
+    RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    @staticmethod
+    def acquire(redis, key, timeout):
+        """获取锁，成功返回令牌，锁已被占用返回 None"""
+        token = uuid.uuid4().hex
+        if redis.set(key, token, nx=True, ex=timeout):
+            return token
+        return None
+
+    @staticmethod
+    def release(redis, key, token):
+        """只有令牌匹配时才删除锁，返回是否释放（释放失败只记录日志，锁会自然过期）"""
+        try:
+            return bool(redis.eval(RedisLockService.RELEASE_SCRIPT, 1, key, token))
+        except Exception as e:
+            logger.warning(f"释放锁失败 {key}: {e}")
+            return False
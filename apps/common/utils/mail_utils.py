@@ -0,0 +1,266 @@
+import json
+import logging
+import smtplib
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils.html import strip_tags
+from django_redis import get_redis_connection
+
+from common.utils.lock_utils import RedisLockService
+from common.utils.metrics_utils import MetricsService
+
+logger = logging.getLogger("feat")
+
+
+class EmailDeliveryService:
+    """
+    邮件投递管线
+      - 模板按 (类型, 有效分钟数) 预渲染一次：主题、HTML、纯文本只剩验证码占位
+      - 请求线程只把 {mode, to, code, attempts} 推入 Redis 队列 email:outbox
+      - Celery worker 复用进程内常驻的 SMTP 连接，按批 LMOVE 到处理中列表
+        email:outbox:processing 后依次发送，每封发送完成（或转入重试）后再确认删除；
+        worker 崩溃遗留在处理中列表的消息由下一次持锁的 flush 移回发送队列
+      - 发送失败按指数退避进入 email:outbox:retry（ZSET，score=下次发送时间），
+        超过最大重试次数后丢弃并记录日志
+    """
+
+    EMAIL_CACHE_NAME = "default"
+    OUTBOX_KEY = "email:outbox"
+    RETRY_KEY = "email:outbox:retry"
+    PROCESSING_KEY = "email:outbox:processing"
+    LOCK_KEY = "email:outbox:lock"
+
+    # 进程内常驻的邮件后端连接，断线时重建
+    _connection = None
+
+    @staticmethod
+    def _redis():
+        return get_redis_connection(EmailDeliveryService.EMAIL_CACHE_NAME)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _compile(mode, expire_minutes):
+        """预渲染模板，返回 (主题, HTML 模板, 纯文本模板)，模板中只剩验证码占位 {}"""
+        from common.tasks import HTML_MESSAGES
+
+        if mode not in HTML_MESSAGES:
+            raise ValueError(f"不支持的邮件类型: {mode}")
+        html_template = HTML_MESSAGES[mode]["html_message"].format("{}", expire_minutes)
+        return (
+            HTML_MESSAGES[mode]["subject"],
+            html_template,
+            strip_tags(html_template),
+        )
+
+    @staticmethod
+    def render(mode, verify_code):
+        """渲染邮件，返回 (主题, 纯文本内容, HTML 内容)"""
+        subject, html_template, plain_template = EmailDeliveryService._compile(
+            mode, int(settings.EMAIL_EXPIRE_SECONDS) // 60
+        )
+        return (
+            subject,
+            plain_template.format(verify_code),
+            html_template.format(verify_code),
+        )
+
+    @staticmethod
+    def build_message(item, connection=None):
+        subject, plain_message, html_message = EmailDeliveryService.render(
+            item["mode"], item["code"]
+        )
+        message = EmailMultiAlternatives(
+            subject=subject,
+            body=plain_message,
+            from_email=settings.EMAIL_HOST_USER,
+            to=item["to"],
+            connection=connection,
+        )
+        message.attach_alternative(html_message, "text/html")
+        return message
+
+    @staticmethod
+    def get_connection():
+        """获取常驻连接（EMAIL_BACKEND 可配置为 smtp / console / filebased / locmem）"""
+        if EmailDeliveryService._connection is None:
+            connection = get_connection(fail_silently=False)
+            connection.open()
+            EmailDeliveryService._connection = connection
+        return EmailDeliveryService._connection
+
+    @staticmethod
+    def reset_connection():
+        connection, EmailDeliveryService._connection = (
+            EmailDeliveryService._connection,
+            None,
+        )
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def send(item):
+        """通过常驻连接发送一封邮件，连接被服务器断开时重连一次"""
+        for retried in (False, True):
+            connection = EmailDeliveryService.get_connection()
+            try:
+                connection.send_messages(
+                    [EmailDeliveryService.build_message(item, connection)]
+                )
+                return
+            except smtplib.SMTPServerDisconnected:
+                EmailDeliveryService.reset_connection()
+                if retried:
+                    raise
+
+    @staticmethod
+    def normalize(email_recv, verify_code, mode):
+        """把收件人、验证码、类型整理为队列消息格式，类型不支持时抛出 ValueError"""
+        if isinstance(email_recv, str):
+            email_recv = [email_recv]
+        # 提前校验类型，避免错误消息进入队列
+        EmailDeliveryService._compile(mode, int(settings.EMAIL_EXPIRE_SECONDS) // 60)
+        return {
+            "mode": mode,
+            "to": list(email_recv),
+            "code": verify_code,
+            "attempts": 0,
+        }
+
+    @staticmethod
+    def enqueue(email_recv, verify_code, mode="activate"):
+        """
+        邮件入队，队列由空变为非空时触发一次异步批量发送
+        Redis 不可用时（Broker 同样在 Redis 上）直接同步发送
+        """
+        from common.tasks import flush_email_outbox
+
+        item = EmailDeliveryService.normalize(email_recv, verify_code, mode)
+        try:
+            length = EmailDeliveryService._redis().rpush(
+                EmailDeliveryService.OUTBOX_KEY, json.dumps(item)
+            )
+        except Exception as e:
+            logger.warning(f"邮件入队失败，改为同步发送: {e}")
+            EmailDeliveryService.send(item)
+            MetricsService.incr("email.sent")
+            return
+        if length == 1:
+            flush_email_outbox.delay()
+
+    @staticmethod
+    def backlog():
+        """待发送队列长度"""
+        return EmailDeliveryService._redis().llen(EmailDeliveryService.OUTBOX_KEY)
+
+    @staticmethod
+    def _schedule_retry(redis, item, error):
+        item["attempts"] += 1
+        max_retries = getattr(settings, "EMAIL_MAX_RETRIES", 5)
+        if item["attempts"] > max_retries:
+            logger.error(f"邮件发送失败且超过重试次数，已丢弃 {item['to']}: {error}")
+            MetricsService.incr("email.dropped")
+            return
+        backoff = getattr(settings, "EMAIL_RETRY_BACKOFF_SECONDS", 30)
+        retry_at = time.time() + backoff * 2 ** (item["attempts"] - 1)
+        redis.zadd(EmailDeliveryService.RETRY_KEY, {json.dumps(item): retry_at})
+        MetricsService.incr("email.retried")
+        logger.warning(
+            f"邮件发送失败，第 {item['attempts']} 次重试 {item['to']}: {error}"
+        )
+
+    @staticmethod
+    def _requeue_due(redis):
+        """把到期的重试消息移回发送队列（ZREM 成功者才入队，避免并发重复）"""
+        for raw in redis.zrangebyscore(EmailDeliveryService.RETRY_KEY, 0, time.time()):
+            if redis.zrem(EmailDeliveryService.RETRY_KEY, raw):
+                redis.rpush(EmailDeliveryService.OUTBOX_KEY, raw)
+
+    @staticmethod
+    def _recover(redis):
+        """把上一个 worker 崩溃时遗留在处理中列表的消息移回发送队列队首"""
+        recovered = 0
+        while redis.lmove(
+            EmailDeliveryService.PROCESSING_KEY,
+            EmailDeliveryService.OUTBOX_KEY,
+            "RIGHT",
+            "LEFT",
+        ):
+            recovered += 1
+        if recovered:
+            logger.warning(f"邮件队列恢复 {recovered} 封未确认的消息")
+
+    @staticmethod
+    def _take_batch(redis, batch_size):
+        """逐条 LMOVE 到处理中列表，返回 [(原始消息, 解析后的消息)]"""
+        pipe = redis.pipeline(transaction=False)
+        for _ in range(batch_size):
+            pipe.lmove(
+                EmailDeliveryService.OUTBOX_KEY,
+                EmailDeliveryService.PROCESSING_KEY,
+                "LEFT",
+                "RIGHT",
+            )
+        return [(raw, json.loads(raw)) for raw in pipe.execute() if raw is not None]
+
+    @staticmethod
+    def _ack(redis, raw):
+        redis.lrem(EmailDeliveryService.PROCESSING_KEY, 1, raw)
+
+    @staticmethod
+    def flush(batch_size=None, max_batches=None):
+        """
+        批量发送队列中的邮件，返回成功发送的数量
+        单封失败进入退避重试，不影响同批其他邮件
+        同一时刻只有一个 worker 持锁发送，未拿到锁返回 None
+        （持锁方会发送到队列为空，由持锁方的任务在结束时检查积压并再次投递）
+        """
+        batch_size = batch_size or getattr(settings, "EMAIL_BATCH_SIZE", 50)
+        max_batches = max_batches or getattr(settings, "EMAIL_FLUSH_MAX_BATCHES", 20)
+        redis = EmailDeliveryService._redis()
+        token = RedisLockService.acquire(
+            redis,
+            EmailDeliveryService.LOCK_KEY,
+            getattr(settings, "EMAIL_FLUSH_LOCK_SECONDS", 300),
+        )
+        if token is None:
+            return None
+
+        sent = failed = 0
+        started = time.monotonic()
+        try:
+            # 持锁期间处理中列表里的消息只可能来自崩溃的 worker
+            EmailDeliveryService._recover(redis)
+            EmailDeliveryService._requeue_due(redis)
+            for _ in range(max_batches):
+                batch = EmailDeliveryService._take_batch(redis, batch_size)
+                if not batch:
+                    break
+                for raw, item in batch:
+                    try:
+                        EmailDeliveryService.send(item)
+                        sent += 1
+                    except Exception as e:
+                        failed += 1
+                        EmailDeliveryService.reset_connection()
+                        EmailDeliveryService._schedule_retry(redis, item, e)
+                    EmailDeliveryService._ack(redis, raw)
+        finally:
+            RedisLockService.release(redis, EmailDeliveryService.LOCK_KEY, token)
+
+        if sent or failed:
+            elapsed = time.monotonic() - started
+            MetricsService.incr("email.sent", sent)
+            MetricsService.incr("email.failed", failed)
+            MetricsService.gauge(
+                "email.sent_per_minute", sent * 60 / max(elapsed, 1e-3)
+            )
+            logger.info(
+                f"邮件批量发送完成：成功 {sent} 封，失败 {failed} 封，耗时 {elapsed:.2f}s"
+            )
+        return sent
@@ -0,0 +1,66 @@
+import logging
+
+from django.core.cache import caches
+from django_redis import get_redis_connection
+
+logger = logging.getLogger("feat")
+
+
+class MetricsService:
+    """轻量指标服务（基于 Redis 计数器，供命中率、吞吐量等观测使用）"""
+
+    METRICS_CACHE_NAME = "default"
+    KEY_PREFIX = "metrics"
+
+    @staticmethod
+    def _key(name):
+        return f"{MetricsService.KEY_PREFIX}:{name}"
+
+    @staticmethod
+    def incr(name, amount=1):
+        """
+        计数器自增（指标写入失败不影响业务流程）
+        Redis 后端直接执行一次 INCRBY（键不存在时从 0 开始），只有一次网络往返；
+        非 Redis 后端（本地开发、测试）退化为 add + incr
+        """
+        cache = caches[MetricsService.METRICS_CACHE_NAME]
+        key = MetricsService._key(name)
+        try:
+            try:
+                redis = get_redis_connection(MetricsService.METRICS_CACHE_NAME)
+            except NotImplementedError:
+                redis = None
+            if redis is not None:
+                # 使用缓存后端生成的完整键名，保证 get() 能读到同一个计数器
+                redis.incrby(cache.make_key(key), amount)
+                return
+            cache.add(key, 0, timeout=None)
+            cache.incr(key, amount)
+        except ValueError:
+            # DummyCache 不保存任何数据，计数无意义
+            pass
+        except Exception as e:
+            logger.warning(f"指标 {name} 记录失败: {e}")
+
+    @staticmethod
+    def gauge(name, value):
+        """记录瞬时值（如表行数），覆盖旧值"""
+        cache = caches[MetricsService.METRICS_CACHE_NAME]
+        try:
+            cache.set(MetricsService._key(name), int(value), timeout=None)
+        except Exception as e:
+            logger.warning(f"指标 {name} 记录失败: {e}")
+
+    @staticmethod
+    def get(name):
+        """获取计数器当前值"""
+        value = caches[MetricsService.METRICS_CACHE_NAME].get(MetricsService._key(name))
+        return int(value or 0)
+
+    @staticmethod
+    def ratio(hit_name, miss_name):
+        """计算命中率，无数据时返回 0"""
+        hit = MetricsService.get(hit_name)
+        miss = MetricsService.get(miss_name)
+        total = hit + miss
+        return hit / total if total else 0.0
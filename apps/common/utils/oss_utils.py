@@ -1,84 +1,369 @@
 import io
 import hashlib
+import json
 import logging
-from datetime import timedelta
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
 from typing import Optional
 
+from django.apps import apps
 from django.conf import settings
+from django.db import transaction
+import urllib3
 from minio import Minio
+from minio.error import S3Error
+from PIL import Image
 from rest_framework import serializers
 
 from common.exceptions import MinioOperationError, UploadImageError
+from common.utils.cache_utils import CacheService
 from common.utils.image_utils import ImageProcessor
+from common.utils.metrics_utils import MetricsService
 
 logger = logging.getLogger("feat")
 
+# 衍生图布局的原图 URL：.../{checksum}/orig.{ext}
+SRCSET_URL_PATTERN = re.compile(r"^(?P<base>.+/[0-9a-f]{64}/)orig\.(?P<ext>\w+)$")
+
 
 # ---------- MinIO 客户端封装 ----------
+class HashingReader:
+    """包装文件对象：按调用方请求的大小读取，同时增量计算 SHA256"""
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.file_obj.read(size)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
 class MinioClientWrapper:
-    """MinIO 客户端操作封装"""
+    """
+    MinIO 客户端操作封装
+      - 进程内单例客户端，共享一个调优过的 urllib3 连接池（fork 后按 pid 重建）
+      - 存储桶校验结果缓存在进程内，上传前不再每次 bucket_exists
+      - 公开 URL 为纯字符串拼接，不访问 MinIO
+    """
+
+    _client = None
+    _client_pid = None
+    _verified_buckets = set()
+    # (bucket, object_name, 有效秒数) -> (url, 签名窗口起点)
+    _presign_cache = OrderedDict()
+    # 临时链接缓存命中统计先在进程内累加，定期合并写入 MetricsService
+    _presign_stats = {"hit": 0, "miss": 0}
+    _presign_stats_flushed_at = time.monotonic()
+    _lock = threading.Lock()
 
     @staticmethod
-    def get_client():
-        return Minio(
-            endpoint=getattr(settings, "MINIO_ENDPOINT"),
-            access_key=getattr(settings, "MINIO_ACCESS_KEY"),
-            secret_key=getattr(settings, "MINIO_SECRET_KEY"),
-            secure=getattr(settings, "MINIO_USE_SSL", False),
+    def build_http_client():
+        return urllib3.PoolManager(
+            maxsize=getattr(settings, "MINIO_POOL_MAXSIZE", 10),
+            timeout=urllib3.Timeout(
+                connect=getattr(settings, "MINIO_CONNECT_TIMEOUT", 3),
+                read=getattr(settings, "MINIO_READ_TIMEOUT", 30),
+            ),
+            retries=urllib3.Retry(
+                total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]
+            ),
         )
 
+    @staticmethod
+    def get_client():
+        pid = os.getpid()
+        if MinioClientWrapper._client is None or MinioClientWrapper._client_pid != pid:
+            with MinioClientWrapper._lock:
+                if (
+                    MinioClientWrapper._client is None
+                    or MinioClientWrapper._client_pid != pid
+                ):
+                    MinioClientWrapper._client = Minio(
+                        endpoint=getattr(settings, "MINIO_ENDPOINT"),
+                        access_key=getattr(settings, "MINIO_ACCESS_KEY"),
+                        secret_key=getattr(settings, "MINIO_SECRET_KEY"),
+                        secure=getattr(settings, "MINIO_USE_SSL", False),
+                        # 指定 region 后签名不再请求存储桶所在区域
+                        region=getattr(settings, "MINIO_REGION", None),
+                        http_client=MinioClientWrapper.build_http_client(),
+                    )
+                    MinioClientWrapper._client_pid = pid
+        return MinioClientWrapper._client
+
     @staticmethod
     def ensure_bucket(client=None, bucket=None):
+        """确保存储桶存在，同一进程内每个桶只校验一次"""
         client = client or MinioClientWrapper.get_client()
         bucket = bucket or getattr(settings, "MINIO_BUCKET_NAME")
-        if not client.bucket_exists(bucket):
-            client.make_bucket(bucket)
+        if bucket not in MinioClientWrapper._verified_buckets:
+            if not client.bucket_exists(bucket):
+                client.make_bucket(bucket)
+            MinioClientWrapper._verified_buckets.add(bucket)
         return client, bucket
 
+    @staticmethod
+    def _put_object(
+        open_stream, object_name, content_type, length, bucket, client, **kwargs
+    ):
+        """put_object 封装：存储桶在校验后被删除时清除缓存标记，重新创建后重试一次"""
+        for retried in (False, True):
+            client, bucket = MinioClientWrapper.ensure_bucket(client, bucket)
+            try:
+                client.put_object(
+                    bucket,
+                    object_name,
+                    open_stream(),
+                    length=length,
+                    content_type=content_type,
+                    **kwargs,
+                )
+                return
+            except S3Error as e:
+                if e.code != "NoSuchBucket" or retried:
+                    raise
+                MinioClientWrapper._verified_buckets.discard(bucket)
+
     @staticmethod
     def upload_bytes(
         data: bytes, object_name: str, content_type: str, bucket=None, client=None
     ):
         """上传数据"""
         try:
-            client, bucket = MinioClientWrapper.ensure_bucket(client, bucket)
-            client.put_object(
-                bucket,
+            MinioClientWrapper._put_object(
+                lambda: io.BytesIO(data),
                 object_name,
-                io.BytesIO(data),
-                length=len(data),
-                content_type=content_type,
+                content_type,
+                len(data),
+                bucket,
+                client,
             )
             logger.info(f"上传文件成功: {object_name}")
             return object_name
         except Exception as e:
             raise MinioOperationError(f"MinIO 上传失败: {object_name}") from e
 
+    @staticmethod
+    def upload_stream(
+        file_obj, object_name: str, content_type: str, bucket=None, client=None
+    ):
+        """
+        流式上传文件对象（Django UploadedFile、临时文件等）
+          - 超过分片大小时走 MinIO 分片上传，每次只读取一个分片，内存占用与文件大小无关
+          - 读取的同时增量计算 SHA256
+        返回 {"object_name", "checksum", "size"}
+        """
+        part_size = getattr(settings, "OSS_MULTIPART_PART_SIZE", 5 * 1024 * 1024)
+        length = getattr(file_obj, "size", None)
+        readers = []
+
+        def open_stream():
+            file_obj.seek(0)
+            readers.append(HashingReader(file_obj))
+            return readers[-1]
+
+        try:
+            MinioClientWrapper._put_object(
+                open_stream,
+                object_name,
+                content_type,
+                length if length is not None else -1,
+                bucket,
+                client,
+                part_size=part_size,
+            )
+            logger.info(f"流式上传文件成功: {object_name}")
+        except Exception as e:
+            raise MinioOperationError(f"MinIO 上传失败: {object_name}") from e
+        return {
+            "object_name": object_name,
+            "checksum": readers[-1].hexdigest(),
+            "size": readers[-1].size,
+        }
+
+    @staticmethod
+    def download_bytes(object_name: str, bucket=None, client=None):
+        """下载对象内容"""
+        client = client or MinioClientWrapper.get_client()
+        bucket = bucket or getattr(settings, "MINIO_BUCKET_NAME")
+        try:
+            response = client.get_object(bucket, object_name)
+            try:
+                return response.read()
+            finally:
+                response.close()
+                response.release_conn()
+        except Exception as e:
+            raise MinioOperationError(f"MinIO 下载失败: {object_name}") from e
+
+    @staticmethod
+    def remove_object(object_name: str, bucket=None, client=None):
+        client = client or MinioClientWrapper.get_client()
+        bucket = bucket or getattr(settings, "MINIO_BUCKET_NAME")
+        try:
+            client.remove_object(bucket, object_name)
+        except Exception as e:
+            raise MinioOperationError(f"MinIO 删除失败: {object_name}") from e
+
+    @staticmethod
+    def stat_object(object_name: str, bucket=None, client=None):
+        """查询对象元数据，对象不存在时返回 None"""
+        client = client or MinioClientWrapper.get_client()
+        bucket = bucket or getattr(settings, "MINIO_BUCKET_NAME")
+        try:
+            return client.stat_object(bucket, object_name)
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchBucket", "NoSuchObject"):
+                return None
+            raise
+
+    # S3 预签名链接的最长有效期（7 天）
+    PRESIGN_MAX_SECONDS = 7 * 24 * 3600
+
+    @staticmethod
+    def _presign_window(expires_seconds):
+        """
+        签名时间窗口：窗口内的签名时间统一取窗口起点，链接按 有效期 + 窗口 签名，
+        窗口内任意时刻拿到的链接都至少还有请求的有效期；
+        窗口长度为 有效期 - OSS_PRESIGN_SAFETY_MARGIN_SECONDS，且不超过签名上限
+        """
+        margin = getattr(settings, "OSS_PRESIGN_SAFETY_MARGIN_SECONDS", 300)
+        if expires_seconds > 2 * margin:
+            window = expires_seconds - margin
+        else:
+            window = expires_seconds // 2
+        return max(
+            1, min(window, MinioClientWrapper.PRESIGN_MAX_SECONDS - expires_seconds)
+        )
+
+    @staticmethod
+    def _count_presign(hits, misses):
+        """进程内累加命中统计，距上次写入超过 OSS_PRESIGN_METRICS_FLUSH_SECONDS 时写入"""
+        interval = getattr(settings, "OSS_PRESIGN_METRICS_FLUSH_SECONDS", 60)
+        with MinioClientWrapper._lock:
+            stats = MinioClientWrapper._presign_stats
+            stats["hit"] += hits
+            stats["miss"] += misses
+            now = time.monotonic()
+            if now - MinioClientWrapper._presign_stats_flushed_at < interval:
+                return
+            MinioClientWrapper._presign_stats_flushed_at = now
+        MinioClientWrapper.flush_presign_stats()
+
+    @staticmethod
+    def flush_presign_stats():
+        """把进程内累加的命中统计写入 MetricsService 并清零"""
+        with MinioClientWrapper._lock:
+            stats = dict(MinioClientWrapper._presign_stats)
+            MinioClientWrapper._presign_stats.update(hit=0, miss=0)
+        for name, amount in stats.items():
+            if amount:
+                MetricsService.incr(f"oss_presign.{name}", amount)
+
+    @staticmethod
+    def get_presigned_urls(
+        object_names, bucket=None, client=None, expires_time=timedelta(hours=3)
+    ):
+        """
+        批量获取临时链接（列表接口一次签完整页对象），返回 {object_name: url}
+          - 签名时间对齐到时间窗口起点，同一窗口内同一对象的链接完全相同，
+            多进程间一致，也便于浏览器/CDN 缓存
+          - 按 有效期 + 窗口 签名，窗口末尾签出的链接也至少保留 expires_time 有效期
+          - 进程内 LRU 缓存到窗口结束为止
+          - 签名是纯本地计算（客户端已配置 region），不访问 MinIO
+        """
+        if any(not name for name in object_names):
+            raise MinioOperationError("获取URL失败: object_name 不能为空")
+        bucket = bucket or getattr(settings, "MINIO_BUCKET_NAME")
+        expires_seconds = int(expires_time.total_seconds())
+        window = MinioClientWrapper._presign_window(expires_seconds)
+        now = time.time()
+        window_start = int(now // window * window)
+        window_end = window_start + window
+
+        urls = {}
+        missing = []
+        cache = MinioClientWrapper._presign_cache
+        with MinioClientWrapper._lock:
+            for name in object_names:
+                cached = cache.get((bucket, name, expires_seconds))
+                if cached is not None and cached[1] == window_start:
+                    cache.move_to_end((bucket, name, expires_seconds))
+                    urls[name] = cached[0]
+                else:
+                    missing.append(name)
+        if not missing:
+            MinioClientWrapper._count_presign(len(urls), 0)
+            return urls
+
+        client = client or MinioClientWrapper.get_client()
+        request_date = datetime.fromtimestamp(window_start, tz=dt_timezone.utc)
+        signed_expires = timedelta(seconds=expires_seconds + window)
+        signed = {
+            name: client.presigned_get_object(
+                bucket, name, expires=signed_expires, request_date=request_date
+            )
+            for name in missing
+        }
+        max_size = getattr(settings, "OSS_PRESIGN_CACHE_SIZE", 10000)
+        with MinioClientWrapper._lock:
+            for name, url in signed.items():
+                cache[(bucket, name, expires_seconds)] = (url, window_start)
+                cache.move_to_end((bucket, name, expires_seconds))
+            while len(cache) > max_size:
+                cache.popitem(last=False)
+        MinioClientWrapper._count_presign(len(urls), len(signed))
+        urls.update(signed)
+        logger.debug(f"签名 {len(signed)} 个临时链接，有效至窗口结束 {window_end}")
+        return urls
+
     @staticmethod
     def get_presigned_url(
         object_name: str, bucket=None, client=None, expires_time=timedelta(hours=3)
     ):
-        """获取对象URL，可设置临时链接或者公开永久链接"""
+        """获取对象临时链接（带缓存，见 get_presigned_urls）"""
         if not object_name:
             raise MinioOperationError("获取URL失败: object_name 不能为空")
-        client, bucket = MinioClientWrapper.ensure_bucket(client, bucket)
-        return client.presigned_get_object(bucket, object_name, expires=expires_time)
+        return MinioClientWrapper.get_presigned_urls(
+            [object_name], bucket, client, expires_time
+        )[object_name]
 
     @staticmethod
     def get_public_url(object_name: str, bucket=None, client=None):
-        """获取公开URL"""
+        """获取公开URL（纯字符串拼接，不访问 MinIO）"""
         if not object_name:
             raise MinioOperationError("获取URL失败: object_name 不能为空")
-        client, bucket = MinioClientWrapper.ensure_bucket(client, bucket)
-        # return f"https://{getattr(settings, 'MINIO_ENDPOINT')}/{bucket}/{object_name}"
-        return f"http://{getattr(settings, 'MINIO_ENDPOINT')}/{bucket}/{object_name}"
+        bucket = bucket or getattr(settings, "MINIO_BUCKET_NAME")
+        scheme = "https" if getattr(settings, "MINIO_USE_SSL", False) else "http"
+        endpoint = getattr(settings, "MINIO_ENDPOINT")
+        return f"{scheme}://{endpoint}/{bucket}/{object_name}"
 
 
 # ---------- OSS 服务工具封装 ----------
 
 
 class OssService:
-    """文件上传服务（组合模式 + 静态方法）"""
+    """
+    文件上传服务（组合模式 + 静态方法）
+    对象名由原始文件的 SHA256 决定，同一文件重复上传时：
+      - 先查 Redis 去重索引 oss:dedup:{object_name}
+      - 未命中再 stat_object 确认对象是否已存在
+      - 均未命中才压缩并上传
+    """
+
+    DEDUP_KEY = "oss:dedup:{}"
 
     @staticmethod
     def calc_checksum(data: bytes) -> str:
@@ -87,6 +372,62 @@ class OssService:
         h.update(data)
         return h.hexdigest()
 
+    @staticmethod
+    def calc_file_checksum(file_obj) -> str:
+        """分块计算文件对象的 SHA256 哈希值，不把整个文件读入内存"""
+        h = hashlib.sha256()
+        file_obj.seek(0)
+        if hasattr(file_obj, "chunks"):
+            chunks = file_obj.chunks()
+        else:
+            chunks = iter(lambda: file_obj.read(64 * 1024), b"")
+        for chunk in chunks:
+            h.update(chunk)
+        file_obj.seek(0)
+        return h.hexdigest()
+
+    @staticmethod
+    def dedup_hit_rate():
+        """去重命中率（命中即跳过压缩与上传）"""
+        return MetricsService.ratio("oss_dedup.hit", "oss_dedup.miss")
+
+    @staticmethod
+    def _lookup_existing(object_name, client_wrapper):
+        """查询已上传对象的 {"size", "content_type"}，不存在返回 None"""
+        key = OssService.DEDUP_KEY.format(object_name)
+        try:
+            meta = CacheService.get_value(key)
+        except Exception as e:
+            logger.warning(f"上传去重索引读取失败 {object_name}: {e}")
+            meta = None
+        if meta is not None:
+            return meta
+
+        stat_object = getattr(client_wrapper, "stat_object", None)
+        if stat_object is None:
+            return None
+        try:
+            stat = stat_object(object_name)
+        except Exception as e:
+            logger.warning(f"查询对象失败 {object_name}: {e}")
+            return None
+        if stat is None:
+            return None
+        meta = {"size": stat.size, "content_type": stat.content_type}
+        OssService._remember(object_name, meta)
+        return meta
+
+    @staticmethod
+    def _remember(object_name, meta):
+        try:
+            CacheService.set_value(
+                OssService.DEDUP_KEY.format(object_name),
+                meta,
+                exp=getattr(settings, "OSS_DEDUP_EXPIRE_SECONDS", 7 * 24 * 3600),
+            )
+        except Exception as e:
+            logger.warning(f"上传去重索引写入失败 {object_name}: {e}")
+
     @staticmethod
     def upload_image(
         uploaded_file,
@@ -100,7 +441,8 @@ class OssService:
         上传图片并返回 URL
         processor: 可传入自定义 ImageProcessor
         client_wrapper: 可传入自定义 MinioClientWrapper 或者其他封装的第三方方API
-                        只需要实现 upload_bytes 和 get_presigned_url 方法
+                        只需要实现 upload_bytes 和 get_presigned_url 方法，
+                        实现 stat_object 时可在去重索引未命中时确认对象是否已存在
         """
         processor = processor or ImageProcessor
         if not client_wrapper:
@@ -108,24 +450,27 @@ class OssService:
         if not folder_name:
             folder_name = getattr(settings, "DEFAULT_IMAGE_FOLDER_NAME")
 
-        uploaded_file.seek(0)
-        raw_data = uploaded_file.read()
-
-        # 压缩图片
-        if compress:
-            data, content_type = processor.compress_image(io.BytesIO(raw_data))
-        else:
-            data = raw_data
-            content_type = uploaded_file.content_type
-
-        # 计算 checksum 做对象名
-        checksum = OssService.calc_checksum(data)
-        ext = uploaded_file.name.split(".")[-1].lower()
-        object_name = f"{folder_name}/{checksum}.{ext}"
+        content_type, ext = ImageProcessor.detect_format(uploaded_file)
+        checksum = OssService.calc_file_checksum(uploaded_file)
+        object_name = OssService.build_object_name(
+            checksum, f"upload.{ext}", folder_name, compress
+        )
 
         try:
-            # 上传
-            client_wrapper.upload_bytes(data, object_name, content_type)
+            meta = OssService._lookup_existing(object_name, client_wrapper)
+            if meta is not None:
+                MetricsService.incr("oss_dedup.hit")
+            else:
+                MetricsService.incr("oss_dedup.miss")
+                meta = OssService.store(
+                    uploaded_file,
+                    object_name,
+                    content_type,
+                    compress,
+                    processor,
+                    client_wrapper,
+                )
+
             # 生成 URL
             if not expires_time:
                 url = client_wrapper.get_public_url(object_name)
@@ -139,13 +484,305 @@ class OssService:
             "object_name": object_name,
             "url": url,
             "checksum": checksum,
+            "size": meta["size"],
+            "content_type": meta["content_type"],
+        }
+
+    @staticmethod
+    def build_object_name(checksum, file_name, folder_name, compress=True):
+        """
+        原始文件 checksum 做对象名，压缩前即可判断是否已上传
+        压缩上传的图片以 checksum 为目录：{folder}/{checksum}/orig.{ext}，
+        衍生图与清单位于同一目录（见 derivative_name）
+        """
+        ext = file_name.split(".")[-1].lower()
+        if compress:
+            return f"{folder_name}/{checksum}/orig.{ext}"
+        return f"{folder_name}/{checksum}-raw.{ext}"
+
+    @staticmethod
+    def upload_file(client_wrapper, file_obj, object_name, content_type, bucket=None):
+        """
+        上传文件对象：支持 upload_stream 的封装走流式分片上传，
+        否则读入内存后 upload_bytes，返回 {"object_name", "checksum", "size"}
+        """
+        upload_stream = getattr(client_wrapper, "upload_stream", None)
+        if upload_stream is not None:
+            return upload_stream(file_obj, object_name, content_type, bucket=bucket)
+        file_obj.seek(0)
+        data = file_obj.read()
+        client_wrapper.upload_bytes(data, object_name, content_type, bucket=bucket)
+        return {
+            "object_name": object_name,
+            "checksum": OssService.calc_checksum(data),
             "size": len(data),
+        }
+
+    @staticmethod
+    def derivative_name(object_name, variant):
+        """
+        衍生图对象名：orig.jpg -> 64.jpg / 64.webp / manifest.json
+        variant 为 generate_derivatives 返回的变体名或 "manifest"
+        """
+        directory, file_name = object_name.rsplit("/", 1)
+        if variant == "orig":
+            return object_name
+        if variant == "manifest":
+            return f"{directory}/manifest.json"
+        if "." in variant:
+            return f"{directory}/{variant}"
+        return f"{directory}/{variant}.{file_name.rsplit('.', 1)[-1]}"
+
+    @staticmethod
+    def build_srcset(url):
+        """
+        由图片 URL 推导多尺寸地址（纯字符串拼接）
+        返回 {"original": url, "sizes": {"64": url, ...}, "webp": {"64": url, ...}}，
+        非衍生图布局的 URL（历史图片、待处理图片）只返回 original
+        """
+        if not url:
+            return None
+        match = SRCSET_URL_PATTERN.match(url)
+        if not match:
+            return {"original": url}
+        base, ext = match.group("base"), match.group("ext")
+        sizes = [str(size) for size in sorted(OssService.derivative_sizes())]
+        srcset = {"original": url, "sizes": {s: f"{base}{s}.{ext}" for s in sizes}}
+        if getattr(settings, "OSS_IMAGE_WEBP_VARIANTS", True):
+            srcset["webp"] = {s: f"{base}{s}.webp" for s in sizes}
+        return srcset
+
+    @staticmethod
+    def derivative_sizes():
+        return getattr(settings, "OSS_IMAGE_DERIVATIVE_SIZES", [64, 256, 1024])
+
+    @staticmethod
+    def store(file_obj, object_name, content_type, compress, processor, client_wrapper):
+        """
+        压缩（可选）并上传，写入去重索引，返回 {"size", "content_type"}
+        压缩时一次解码生成原图与全部衍生图，连同清单 manifest.json 一起上传；
+        不压缩时流式上传原文件
+        """
+        if not compress:
+            size = OssService.upload_file(
+                client_wrapper, file_obj, object_name, content_type
+            )["size"]
+            meta = {"size": size, "content_type": content_type}
+            OssService._remember(object_name, meta)
+            return meta
+
+        variants = (processor or ImageProcessor).generate_derivatives(
+            file_obj, sizes=OssService.derivative_sizes()
+        )
+        manifest = {}
+        # 原图最后上传：去重以原图是否存在为准，中途失败时重试会补齐衍生图
+        for variant in sorted(variants, key=lambda name: name == "orig"):
+            data, variant_type = variants[variant]
+            name = OssService.derivative_name(object_name, variant)
+            if variant != "orig":
+                client_wrapper.upload_bytes(data, name, variant_type)
+            manifest[variant] = {
+                "object_name": name,
+                "size": len(data),
+                "content_type": variant_type,
+            }
+        manifest_data = json.dumps(manifest).encode()
+        client_wrapper.upload_bytes(
+            manifest_data,
+            OssService.derivative_name(object_name, "manifest"),
+            "application/json",
+        )
+        data, content_type = variants["orig"]
+        client_wrapper.upload_bytes(data, object_name, content_type)
+
+        meta = {"size": len(data), "content_type": content_type}
+        OssService._remember(object_name, meta)
+        return meta
+
+
+class ImagePipelineService:
+    """
+    请求外图片处理管线
+      - 请求内只把原始文件上传到私有的暂存桶，模型 URL 字段先指向该对象的临时链接
+        （待处理 URL）；对象类型取自 Pillow 识别的真实格式，而非客户端声明
+      - Celery 任务下载原图完成 EXIF 旋转、缩放、重新编码后上传正式对象，
+        再以行锁比对 URL 字段仍为待处理 URL 时替换，最后删除原图
+      - 重试耗尽仍失败时把 URL 字段恢复为上传前的值并删除原图
+      - 原始文件已处理过（去重索引命中）时直接返回正式 URL，不产生任务
+    """
+
+    PENDING_FOLDER = "pending"
+
+    @staticmethod
+    def pending_bucket():
+        """暂存桶不设置公开读策略，只能通过临时链接访问"""
+        return getattr(settings, "MINIO_PENDING_BUCKET_NAME", None) or (
+            f"{getattr(settings, 'MINIO_BUCKET_NAME')}-pending"
+        )
+
+    @staticmethod
+    def stage(uploaded_file, folder_name, client_wrapper=None):
+        """
+        暂存上传文件，返回 {"url", "pending", ...}
+        pending 为 True 时需调用 dispatch 安排后台处理
+        """
+        client_wrapper = client_wrapper or MinioClientWrapper
+        content_type, ext = ImageProcessor.detect_format(uploaded_file)
+        checksum = OssService.calc_file_checksum(uploaded_file)
+        object_name = OssService.build_object_name(
+            checksum, f"upload.{ext}", folder_name
+        )
+        if OssService._lookup_existing(object_name, client_wrapper) is not None:
+            MetricsService.incr("oss_dedup.hit")
+            return {
+                "url": client_wrapper.get_public_url(object_name),
+                "pending": False,
+            }
+
+        MetricsService.incr("oss_dedup.miss")
+        bucket = ImagePipelineService.pending_bucket()
+        pending_object = (
+            f"{ImagePipelineService.PENDING_FOLDER}/{uuid.uuid4().hex}.{ext}"
+        )
+        try:
+            uploaded = OssService.upload_file(
+                client_wrapper, uploaded_file, pending_object, content_type, bucket
+            )
+        except Exception as e:
+            raise UploadImageError(f"OSS暂存上传图片失败: {pending_object}") from e
+        if uploaded["checksum"] != checksum:
+            # 哈希与上传内容不一致（文件在上传过程中被改写），放弃本次暂存
+            client_wrapper.remove_object(pending_object, bucket=bucket)
+            raise UploadImageError(f"OSS暂存上传图片校验失败: {pending_object}")
+        url = client_wrapper.get_presigned_url(
+            pending_object,
+            bucket=bucket,
+            expires_time=timedelta(
+                seconds=getattr(settings, "OSS_PENDING_URL_EXPIRE_SECONDS", 3600)
+            ),
+        )
+        return {
+            "url": url,
+            "pending": True,
+            "pending_object": pending_object,
+            "object_name": object_name,
             "content_type": content_type,
         }
 
+    @staticmethod
+    def dispatch(instance, field_name, staged, previous_url=None):
+        """事务提交后投递处理任务，投递失败时当场处理"""
+        from common.tasks import process_uploaded_image
+
+        args = (
+            instance._meta.label,
+            instance.pk,
+            field_name,
+            staged["url"],
+            staged["pending_object"],
+            staged["object_name"],
+            staged["content_type"],
+            previous_url,
+        )
+
+        def _send():
+            try:
+                process_uploaded_image.delay(*args)
+            except Exception as e:
+                logger.warning(f"图片处理任务投递失败，改为同步处理: {e}")
+                try:
+                    ImagePipelineService.process(*args[:7])
+                except Exception as e:
+                    logger.error(f"图片处理失败 {staged['pending_object']}: {e}")
+                    ImagePipelineService.fail(*args)
+
+        transaction.on_commit(_send)
+
+    @staticmethod
+    def process(
+        model_label,
+        pk,
+        field_name,
+        pending_url,
+        pending_object,
+        object_name,
+        content_type,
+        client_wrapper=None,
+        processor=None,
+    ):
+        """处理暂存的原图并替换模型 URL 字段，返回是否替换成功"""
+        client_wrapper = client_wrapper or MinioClientWrapper
+        bucket = ImagePipelineService.pending_bucket()
+        started = time.monotonic()
+        raw_file = io.BytesIO(
+            client_wrapper.download_bytes(pending_object, bucket=bucket)
+        )
+        OssService.store(
+            raw_file, object_name, content_type, True, processor, client_wrapper
+        )
+        swapped = ImagePipelineService.swap_url(
+            apps.get_model(model_label),
+            pk,
+            field_name,
+            pending_url,
+            client_wrapper.get_public_url(object_name),
+        )
+        client_wrapper.remove_object(pending_object, bucket=bucket)
+        logger.info(
+            f"图片处理完成 {object_name}，耗时 {time.monotonic() - started:.2f}s"
+            + ("" if swapped else "（URL 已被更新，跳过替换）")
+        )
+        return swapped
+
+    @staticmethod
+    def fail(
+        model_label,
+        pk,
+        field_name,
+        pending_url,
+        pending_object,
+        object_name,
+        content_type,
+        previous_url,
+        client_wrapper=None,
+    ):
+        """处理最终失败：URL 字段仍为待处理 URL 时恢复为上传前的值，并删除暂存原图"""
+        client_wrapper = client_wrapper or MinioClientWrapper
+        ImagePipelineService.swap_url(
+            apps.get_model(model_label), pk, field_name, pending_url, previous_url
+        )
+        try:
+            client_wrapper.remove_object(
+                pending_object, bucket=ImagePipelineService.pending_bucket()
+            )
+        except Exception as e:
+            logger.warning(f"删除暂存图片失败 {pending_object}: {e}")
+        MetricsService.incr("image_pipeline.failed")
+        logger.error(f"图片处理最终失败，已恢复原 URL: {pending_object}")
+
+    @staticmethod
+    def swap_url(model, pk, field_name, expected_url, new_url):
+        """行锁下比对并替换 URL，避免覆盖处理期间再次上传的新图片"""
+        with transaction.atomic():
+            instance = model._default_manager.select_for_update().filter(pk=pk).first()
+            if instance is None or getattr(instance, field_name) != expected_url:
+                return False
+            setattr(instance, field_name, new_url)
+            # save 触发 post_save，相关缓存与搜索索引随之更新
+            instance.save(update_fields=[field_name])
+        return True
+
 
 # ---------- 通用序列化器封装 ----------
 
+
+class ImageSrcsetField(serializers.ReadOnlyField):
+    """由图片 URL 字段输出多尺寸地址字典，客户端按展示尺寸选择最小的合适图片"""
+
+    def to_representation(self, value):
+        return OssService.build_srcset(value)
+
+
 class BaseImageUploadSerializer(serializers.ModelSerializer):
     """
     通用图片上传序列化器基类
@@ -174,8 +811,12 @@ class BaseImageUploadSerializer(serializers.ModelSerializer):
         fields[self.file_field_name] = serializers.ImageField(write_only=True)
         # 添加URL字段
         fields[self.url_field_name] = serializers.CharField(read_only=True)
+        # 添加多尺寸地址字段，如 avatar_url -> avatar_srcset
+        fields[self.srcset_field_name()] = ImageSrcsetField(source=self.url_field_name)
         return fields
 
+    def srcset_field_name(self):
+        return f"{self.url_field_name.removesuffix('_url')}_srcset"
 
     def validate(self, attrs):
         """大小校验"""
@@ -184,6 +825,16 @@ class BaseImageUploadSerializer(serializers.ModelSerializer):
             settings, "OSS_MAX_IMAGE_SIZE", 5 * 1024 * 1024
         ):
             raise serializers.ValidationError("文件大小超过限制 (最大5MB)")
+        if file:
+            # 只读文件头校验像素数，超大尺寸图片在请求内即拒绝，不进入后台处理
+            try:
+                file.seek(0)
+                with Image.open(file) as img:
+                    ImageProcessor.check_pixels(img)
+            except UploadImageError:
+                raise serializers.ValidationError("图片尺寸超过限制")
+            finally:
+                file.seek(0)
         return attrs
 
     def upload_to_oss(self, file):
@@ -205,6 +856,27 @@ class BaseImageUploadSerializer(serializers.ModelSerializer):
             logger.warning(f"用户 {user} 没有上传图片")
             return instance
 
+        if not getattr(settings, "OSS_ASYNC_IMAGE_PROCESSING", True):
+            return self.update_inline(instance, file, user)
+
+        try:
+            staged = ImagePipelineService.stage(file, self.oss_folder)
+            previous_url = getattr(instance, self.url_field_name)
+            setattr(instance, self.url_field_name, staged["url"])
+            instance.save()
+            if staged["pending"]:
+                ImagePipelineService.dispatch(
+                    instance, self.url_field_name, staged, previous_url
+                )
+            logger.info(f"用户 {user} 上传 {self.oss_folder} 图片成功，等待后台处理")
+        except Exception as e:
+            logger.error(f"用户 {user} 上传 {self.oss_folder} 图片失败: {e}")
+            raise serializers.ValidationError("上传图片失败")
+
+        return instance
+
+    def update_inline(self, instance, file, user):
+        """请求内同步压缩上传"""
         try:
             oss_url = self.upload_to_oss(file)
             setattr(instance, self.url_field_name, oss_url)
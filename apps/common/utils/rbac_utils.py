@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import time
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from accounts.models import Permission, Role, RolePermissionMap
+from common.response_renders import UnifiedJSONRenderer
+
+logger = logging.getLogger("feat")
+
+
+def seed_version():
+    """
+    版本号丢失（被淘汰或清理）时以毫秒时间戳作为新版本号，
+    保证大于丢失前的任何版本，旧版本的进程内 LRU 项与缓存键不会被再次命中
+    """
+    return time.time_ns() // 1_000_000
+
+
+class RBACService:
+    """
+    角色权限集缓存（进程内 LRU + Redis + 全局版本号）
+      - 角色 -> {"level": 角色等级, "codes": 权限码集合}，父权限自动包含全部子孙权限
+      - Role / Permission / RolePermissionMap 任意变更只需递增版本号，
+        旧版本的 LRU 项与 Redis 键不再被命中，随容量/过期自然淘汰
+      - 权限判断只读一次版本号，之后是内存中的集合查找
+    """
+
+    RBAC_CACHE_NAME = "default"
+    VERSION_KEY = "rbac:version"
+    ROLE_KEY = "rbac:role:v{}:{}"  # version, role_id
+
+    @staticmethod
+    def _cache():
+        return caches[RBACService.RBAC_CACHE_NAME]
+
+    @staticmethod
+    def get_version():
+        cache = RBACService._cache()
+        version = cache.get(RBACService.VERSION_KEY)
+        if version is None:
+            cache.add(RBACService.VERSION_KEY, seed_version(), timeout=None)
+            version = cache.get(RBACService.VERSION_KEY) or seed_version()
+        return version
+
+    @staticmethod
+    def bump_version():
+        """递增版本号；缓存不可用时只记录日志（角色缓存随过期时间淘汰）"""
+        cache = RBACService._cache()
+        try:
+            try:
+                cache.incr(RBACService.VERSION_KEY)
+            except ValueError:
+                # 版本号不存在（过期或被清理），直接设置为新版本
+                cache.set(RBACService.VERSION_KEY, seed_version(), timeout=None)
+        except Exception as e:
+            logger.error(f"[RBAC] 权限版本号递增失败: {e}")
+
+    @staticmethod
+    def bump_version_on_commit():
+        """事务提交后再递增版本号，避免并发请求在提交前编译出旧权限集"""
+        transaction.on_commit(RBACService.bump_version)
+
+    @staticmethod
+    def compile_role(role_id):
+        """从数据库编译角色权限集（两次查询：全部权限树 + 角色直接授予的权限）"""
+        level = Role.objects.filter(pk=role_id).values_list("level", flat=True).first()
+        if level is None:
+            return {"level": 0, "codes": frozenset()}
+
+        children = defaultdict(list)
+        codes = {}
+        for perm_id, code, parent_id in Permission.objects.values_list(
+            "id", "code", "parent_id"
+        ):
+            codes[perm_id] = code
+            children[parent_id].append(perm_id)
+
+        granted = set()
+        stack = list(
+            RolePermissionMap.objects.filter(role_id=role_id).values_list(
+                "permission_id", flat=True
+            )
+        )
+        while stack:
+            perm_id = stack.pop()
+            if perm_id in granted:
+                continue
+            granted.add(perm_id)
+            stack.extend(children[perm_id])
+
+        return {"level": level, "codes": frozenset(codes[i] for i in granted)}
+
+    @staticmethod
+    @lru_cache(maxsize=getattr(settings, "RBAC_LOCAL_CACHE_SIZE", 256))
+    def _get_compiled(role_id, version):
+        """进程内 LRU：键里带版本号，版本变化后自动未命中"""
+        cache = RBACService._cache()
+        key = RBACService.ROLE_KEY.format(version, role_id)
+        compiled = cache.get(key)
+        if compiled is None:
+            compiled = RBACService.compile_role(role_id)
+            cache.set(
+                key, compiled, getattr(settings, "RBAC_CACHE_EXPIRE_SECONDS", 86400)
+            )
+        return compiled
+
+    @staticmethod
+    def get_role_permissions(role_id):
+        """获取角色编译后的权限集，缓存不可用时直接查库"""
+        if not role_id:
+            return {"level": 0, "codes": frozenset()}
+        try:
+            version = RBACService.get_version()
+        except Exception as e:
+            logger.warning(f"[RBAC] 权限版本号读取失败，直接查库: {e}")
+            return RBACService.compile_role(role_id)
+        return RBACService._get_compiled(role_id, version)
+
+    @staticmethod
+    def get_role_level(user):
+        return RBACService.get_role_permissions(getattr(user, "role_id", None))["level"]
+
+    @staticmethod
+    def has_permission(user, perm_code):
+        compiled = RBACService.get_role_permissions(getattr(user, "role_id", None))
+        return compiled["level"] >= 100 or perm_code in compiled["codes"]
+
+
+class PermissionTreeService:
+    """
+    权限树缓存（版本号 + 预序列化 JSON）
+      - 一次查询加载全部权限，在内存中组装树
+      - 连同统一响应外壳一起渲染成 JSON 字节缓存，命中时直接返回，不再序列化
+      - ETag 为内容摘要，客户端携带 If-None-Match 时可直接得到 304
+    """
+
+    TREE_CACHE_NAME = "default"
+    VERSION_KEY = "rbac:tree:version"
+    TREE_KEY = "rbac:tree:v{}"
+
+    @staticmethod
+    def _cache():
+        return caches[PermissionTreeService.TREE_CACHE_NAME]
+
+    @staticmethod
+    def get_version():
+        cache = PermissionTreeService._cache()
+        version = cache.get(PermissionTreeService.VERSION_KEY)
+        if version is None:
+            cache.add(PermissionTreeService.VERSION_KEY, seed_version(), timeout=None)
+            version = cache.get(PermissionTreeService.VERSION_KEY) or seed_version()
+        return version
+
+    @staticmethod
+    def bump_version():
+        cache = PermissionTreeService._cache()
+        try:
+            try:
+                cache.incr(PermissionTreeService.VERSION_KEY)
+            except ValueError:
+                cache.set(
+                    PermissionTreeService.VERSION_KEY, seed_version(), timeout=None
+                )
+        except Exception as e:
+            logger.error(f"[RBAC] 权限树版本号递增失败: {e}")
+
+    @staticmethod
+    def bump_version_on_commit():
+        transaction.on_commit(PermissionTreeService.bump_version)
+
+    @staticmethod
+    def build_tree():
+        """一次查询组装权限树，字段与 PermissionListSerializer 保持一致"""
+        nodes = {}
+        roots = []
+        rows = Permission.objects.values(
+            "id", "name", "code", "type", "parent_id", "description"
+        )
+        for row in rows:
+            nodes[row["id"]] = {
+                "id": row["id"],
+                "name": row["name"],
+                "code": row["code"],
+                "type": row["type"],
+                "parent": row["parent_id"],
+                "description": row["description"],
+                "children": [],
+            }
+        # rows 已按 Meta.ordering（name, id）排序，追加顺序即展示顺序
+        for node in nodes.values():
+            parent = nodes.get(node["parent"])
+            (parent["children"] if parent else roots).append(node)
+        return roots
+
+    @staticmethod
+    def render():
+        """渲染整棵树，返回 {"etag": ..., "body": bytes}"""
+        body = UnifiedJSONRenderer().render(
+            PermissionTreeService.build_tree(), renderer_context={}
+        )
+        return {"etag": f'"{hashlib.md5(body).hexdigest()}"', "body": body}
+
+    @staticmethod
+    def get_tree():
+        """读取缓存的权限树，缓存不可用时直接渲染"""
+        try:
+            cache = PermissionTreeService._cache()
+            key = PermissionTreeService.TREE_KEY.format(
+                PermissionTreeService.get_version()
+            )
+            tree = cache.get(key)
+            if tree is None:
+                tree = PermissionTreeService.render()
+                cache.set(
+                    key, tree, getattr(settings, "RBAC_CACHE_EXPIRE_SECONDS", 86400)
+                )
+            return tree
+        except Exception as e:
+            logger.warning(f"[RBAC] 权限树缓存不可用，直接查库: {e}")
+            return PermissionTreeService.render()
@@ -1,80 +1,235 @@
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from django.utils.timezone import localdate
+from django_redis import get_redis_connection
 from tencentcloud.common import credential
 from tencentcloud.sms.v20210111 import sms_client, models
 from tencentcloud.common.profile.client_profile import ClientProfile
 from tencentcloud.common.profile.http_profile import HttpProfile
-from django.conf import settings
 
 from common.utils.cache_utils import CacheService
+from common.utils.metrics_utils import MetricsService
+
+logger = logging.getLogger("feat")
 
 
 class TencentSMSService:
-    """腾讯云短信发送工具类"""
+    """腾讯云短信发送工具类（默认短信后端）"""
+
+    # 进程内按地域缓存客户端，凭证与 HTTP 配置只构建一次
+    _clients = {}
+    _lock = threading.Lock()
 
     @staticmethod
     def get_client(region="ap-guangzhou"):
-        cred = credential.Credential(
-            getattr(settings, "TENCENTCLOUD_SECRET_ID"),
-            getattr(settings, "TENCENTCLOUD_SECRET_KEY"),
-        )
-        http_profile = HttpProfile(endpoint="sms.tencentcloudapi.com")
-        client_profile = ClientProfile(httpProfile=http_profile)
-        return sms_client.SmsClient(cred, region, client_profile)
+        client = TencentSMSService._clients.get(region)
+        if client is None:
+            with TencentSMSService._lock:
+                client = TencentSMSService._clients.get(region)
+                if client is None:
+                    cred = credential.Credential(
+                        getattr(settings, "TENCENTCLOUD_SECRET_ID"),
+                        getattr(settings, "TENCENTCLOUD_SECRET_KEY"),
+                    )
+                    http_profile = HttpProfile(endpoint="sms.tencentcloudapi.com")
+                    client_profile = ClientProfile(httpProfile=http_profile)
+                    client = sms_client.SmsClient(cred, region, client_profile)
+                    TencentSMSService._clients[region] = client
+        return client
 
     @staticmethod
-    def send_sms(
-        phone_number, code, app_id, sign_name, template_id, region="ap-guangzhou"
-    ):
-        """发送验证码短信"""
+    def send_messages(messages, region="ap-guangzhou"):
+        """
+        逐条发送，messages: [(手机号, 模板参数列表)]
+        SendSms 同一请求内所有号码共用模板参数，而每条验证码都不同，因此一条一个请求
+        返回发送成功的手机号集合
+        """
         client = TencentSMSService.get_client(region)
-        req = models.SendSmsRequest()
-        req.SmsSdkAppId = app_id
-        req.SignName = sign_name
-        req.TemplateId = template_id
-        req.TemplateParamSet = [str(code), "5"]  # 模板参数，5分钟有效期
-        req.PhoneNumberSet = [f"+86{phone_number}"]
+        sent = set()
+        for phone_number, params in messages:
+            req = models.SendSmsRequest()
+            req.SmsSdkAppId = getattr(settings, "TENCENT_SMS_APP_ID")
+            req.SignName = getattr(settings, "TENCENT_SMS_SIGN")
+            req.TemplateId = getattr(settings, "TENCENT_SMS_TEMPLATE_ID")
+            req.TemplateParamSet = list(params)
+            req.PhoneNumberSet = [f"+86{phone_number}"]
+            try:
+                resp = client.SendSms(req)
+            except Exception as e:
+                logger.error(f"短信发送失败 {phone_number}: {e}")
+                continue
+            for status in resp.SendStatusSet or []:
+                if status.Code == "Ok":
+                    sent.add(status.PhoneNumber.removeprefix("+86"))
+                else:
+                    logger.error(f"短信发送失败 {status.PhoneNumber}: {status.Message}")
+        return sent
+
+    @staticmethod
+    def send_sms(phone_number, code, region="ap-guangzhou"):
+        """发送单条验证码短信"""
+        params = [str(code), str(SMSService.expire_minutes())]
+        return phone_number in TencentSMSService.send_messages(
+            [(phone_number, params)], region
+        )
 
-        try:
-            resp = client.SendSms(req)
-            print(f"短信发送成功: {resp.to_json_string()}")
-            return True
-        except Exception as e:
-            print(f"短信发送失败: {e}")
-            return False
+
+class StubSMSBackend:
+    """本地调试/测试用短信后端：不调用短信服务商，只记录日志并保存到 outbox"""
+
+    outbox = []
+
+    @staticmethod
+    def send_messages(messages, region="ap-guangzhou"):
+        for phone_number, params in messages:
+            logger.info(f"[短信桩] {phone_number}: {params}")
+            StubSMSBackend.outbox.append((phone_number, list(params)))
+        return {phone_number for phone_number, _ in messages}
 
 
 class SMSService:
-    """短信验证码验证服务"""
+    """
+    短信验证码服务
+      - 发送前在 Redis 中按手机号限频（发送间隔 + 每日上限）
+      - 请求线程只生成验证码并入队 sms:outbox，由 Celery 任务批量调用短信后端发送
+      - 短信后端由 SMS_BACKEND 配置（腾讯云 / 本地桩）
+      - 发送失败时退还限频额度并删除已缓存的验证码，用户可立即重新获取
+    """
+
+    SMS_CACHE_NAME = "default"
+    OUTBOX_KEY = "sms:outbox"
+    COOLDOWN_KEY = "sms:cooldown:{}"
+    DAILY_KEY = "sms:daily:{}:{}"  # phone_number, yyyymmdd
+    CODE_KEY = "sms:{}"
 
     @staticmethod
-    def send_code(phone_number, code):
-        """发送验证码"""
-        # 调用腾讯云短信服务
-        sent = TencentSMSService.send_sms(
-            phone_number=phone_number,
-            code=code,
-            app_id=getattr(settings, "TENCENT_SMS_APP_ID"),
-            sign_name=getattr(settings, "TENCENT_SMS_SIGN"),
-            template_id=getattr(settings, "TENCENT_SMS_TEMPLATE_ID"),
+    def _redis():
+        return get_redis_connection(SMSService.SMS_CACHE_NAME)
+
+    @staticmethod
+    def get_backend():
+        return import_string(
+            getattr(settings, "SMS_BACKEND", "common.utils.sms_utils.TencentSMSService")
+        )
+
+    @staticmethod
+    def expire_minutes():
+        return max(1, getattr(settings, "SMS_CODE_EXPIRE_SECONDS", 300) // 60)
+
+    @staticmethod
+    def acquire_quota(phone_number):
+        """
+        限频：间隔内只允许发送一次，且每日不超过上限
+        返回 True 表示允许发送
+        """
+        cache = caches[SMSService.SMS_CACHE_NAME]
+        interval = getattr(settings, "SMS_SEND_INTERVAL_SECONDS", 60)
+        if not cache.add(SMSService.COOLDOWN_KEY.format(phone_number), 1, interval):
+            return False
+
+        daily_key = SMSService.DAILY_KEY.format(
+            phone_number, localdate().strftime("%Y%m%d")
         )
+        cache.add(daily_key, 0, 24 * 3600)
+        if cache.incr(daily_key) > getattr(settings, "SMS_DAILY_LIMIT", 10):
+            return False
+        return True
 
-        if sent:
-            CacheService.set_value(
-                key=f"sms:{phone_number}",
-                val=code,
-                exp=getattr(settings, "SMS_CODE_EXPIRE_SECONDS", 300),
+    @staticmethod
+    def refund(phone_number, code):
+        """
+        发送失败后退还额度：清除发送间隔、每日计数减一，
+        缓存中仍是本次验证码时一并删除（避免用户收不到却被要求输入）
+        """
+        cache = caches[SMSService.SMS_CACHE_NAME]
+        cache.delete(SMSService.COOLDOWN_KEY.format(phone_number))
+        try:
+            cache.decr(
+                SMSService.DAILY_KEY.format(
+                    phone_number, localdate().strftime("%Y%m%d")
+                )
             )
+        except ValueError:
+            pass
+        code_key = SMSService.CODE_KEY.format(phone_number)
+        if str(CacheService.get_value(code_key)) == str(code):
+            CacheService.del_value(code_key)
+        MetricsService.incr("sms.refunded")
+
+    @staticmethod
+    def send_code(phone_number, code):
+        """
+        发送验证码：限频通过后缓存验证码并入队异步发送
+        返回 False 表示触发限频
+        """
+        if not SMSService.acquire_quota(phone_number):
+            MetricsService.incr("sms.throttled")
+            return False
+
+        CacheService.set_value(
+            key=SMSService.CODE_KEY.format(phone_number),
+            val=code,
+            exp=getattr(settings, "SMS_CODE_EXPIRE_SECONDS", 300),
+        )
+        item = [phone_number, [str(code), str(SMSService.expire_minutes())]]
+        try:
+            length = SMSService._redis().rpush(SMSService.OUTBOX_KEY, json.dumps(item))
+        except Exception as e:
+            logger.warning(f"短信入队失败，改为同步发送: {e}")
+            SMSService.dispatch([item])
             return True
-        return False
+
+        if length == 1:
+            from common.tasks import flush_sms_outbox
+
+            flush_sms_outbox.delay()
+        return True
+
+    @staticmethod
+    def dispatch(items):
+        """调用短信后端发送 [(手机号, 模板参数)]，返回成功数量，失败的逐条退还额度"""
+        try:
+            sent = SMSService.get_backend().send_messages(
+                [(phone_number, params) for phone_number, params in items]
+            )
+        except Exception as e:
+            logger.error(f"短信后端调用失败: {e}")
+            sent = set()
+        for phone_number, params in items:
+            if phone_number not in sent:
+                SMSService.refund(phone_number, params[0])
+        MetricsService.incr("sms.sent", len(sent))
+        MetricsService.incr("sms.failed", len(items) - len(sent))
+        return len(sent)
+
+    @staticmethod
+    def backlog():
+        return SMSService._redis().llen(SMSService.OUTBOX_KEY)
+
+    @staticmethod
+    def flush(batch_size=None):
+        """取出一批待发送短信合并发送，返回成功数量"""
+        batch_size = batch_size or getattr(settings, "SMS_BATCH_SIZE", 200)
+        pipe = SMSService._redis().pipeline(transaction=True)
+        pipe.lrange(SMSService.OUTBOX_KEY, 0, batch_size - 1)
+        pipe.ltrim(SMSService.OUTBOX_KEY, batch_size, -1)
+        items = [json.loads(raw) for raw in pipe.execute()[0]]
+        if not items:
+            return 0
+        sent = SMSService.dispatch(items)
+        logger.info(f"短信批量发送完成：成功 {sent} 条，共 {len(items)} 条")
+        return sent
 
     @staticmethod
     def verify_code(phone_number, input_code):
         """验证验证码是否正确"""
-        key = f"sms:{phone_number}"
+        key = SMSService.CODE_KEY.format(phone_number)
         is_valid = CacheService.validate_value(key, input_code)
         if is_valid:
             CacheService.del_value(key)
         return is_valid
-
-
-if __name__ == "__main__":
-    SMSService.send_code("13820826029", 1244)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ForumsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "forums"
+
+    def ready(self):
+        # 注册缓存失效等信号处理
+        from . import signals  # noqa: F401
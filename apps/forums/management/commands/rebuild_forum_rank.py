@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from forums.models import ForumActivity
+from forums.utils.rank_utils import ForumRankService
+from forums.utils.signin_utils import ForumSignInService
+
+
+class Command(BaseCommand):
+    help = "以 ForumActivity 为准全量重建贴吧排行榜（经验榜、活跃榜）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=1000, help="每批读取的活跃记录数量"
+        )
+
+    def handle(self, *args, **options):
+        # 先把未落库的签到经验写入数据库，避免重建后丢失
+        ForumSignInService.flush()
+        count = ForumRankService.rebuild(
+            ForumActivity.objects.all(), chunk_size=options["chunk_size"]
+        )
+        self.stdout.write(self.style.SUCCESS(f"已重建 {count} 条排行榜记录"))
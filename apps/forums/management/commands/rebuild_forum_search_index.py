@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from forums.models import Forum
+from forums.utils.search_utils import ForumSearchService
+
+
+class Command(BaseCommand):
+    help = "全量重建贴吧检索索引（增量索引异常或首次上线时使用）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=500, help="每批读取的贴吧数量"
+        )
+
+    def handle(self, *args, **options):
+        count = ForumSearchService.rebuild(
+            Forum.objects.filter(is_deleted=False), chunk_size=options["chunk_size"]
+        )
+        self.stdout.write(self.style.SUCCESS(f"已重建 {count} 个贴吧的检索索引"))
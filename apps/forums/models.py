@@ -1,6 +1,7 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 from django.utils import timezone
+from django.utils.functional import cached_property
 
 from common.delete import SoftDeleteModel
 
@@ -42,7 +43,9 @@ class Forum(SoftDeleteModel):
 
     name = models.CharField(max_length=100, unique=True, verbose_name="吧名称")
     description = models.TextField(blank=True, null=True, verbose_name="简介")
-    cover_image_url = models.URLField(blank=True, null=True, verbose_name="封面图片URL")
+    cover_image_url = models.URLField(
+        max_length=1024, blank=True, null=True, verbose_name="封面图片URL"
+    )
     creator = models.ForeignKey(
         UserModel,
         on_delete=models.CASCADE,
@@ -64,14 +67,30 @@ class Forum(SoftDeleteModel):
     def __str__(self):
         return self.name
 
+    @cached_property
+    def category_names(self):
+        """
+        分类名数组（实例内缓存）
+        优先读取 ForumViewSet 预取的 prefetched_category_maps，避免逐条查询分类
+        """
+        maps = getattr(self, "prefetched_category_maps", None)
+        if maps is None:
+            maps = self.categories.select_related("category")
+        return [m.category.name for m in maps]
+
     def delete(self, using=None, keep_parents=False):
         """软删除贴吧及所有关联对象"""
+        from forums.utils.role_utils import ForumRoleService
+
+        # 批量 update 不触发 ForumMember 信号，先记下成员以便失效其角色缓存
+        member_user_ids = list(self.members.values_list("user_id", flat=True))
         # 先软删除关联关系
         self.categories.all().update(is_deleted=True, deleted_at=timezone.now())
         self.relations.all().update(is_deleted=True, deleted_at=timezone.now())
         self.members.all().update(is_deleted=True, deleted_at=timezone.now())
         self.activities.all().update(is_deleted=True, deleted_at=timezone.now())
         super().delete(using, keep_parents)
+        ForumRoleService.invalidate_many_on_commit(member_user_ids)
 
 
 class ForumCategory(SoftDeleteModel):
@@ -79,7 +98,9 @@ class ForumCategory(SoftDeleteModel):
 
     name = models.CharField(max_length=50, unique=True, verbose_name="分类名称")
     description = models.TextField(blank=True, null=True, verbose_name="描述")
-    icon_url = models.URLField(blank=True, null=True, verbose_name="图标URL")
+    icon_url = models.URLField(
+        max_length=1024, blank=True, null=True, verbose_name="图标URL"
+    )
     sort_order = models.PositiveIntegerField(default=0, verbose_name="排序")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
@@ -203,6 +224,16 @@ class ForumMember(SoftDeleteModel):
         verbose_name = "贴吧成员"
         verbose_name_plural = "贴吧成员列表"
         unique_together = ("forum", "user")
+        indexes = [
+            # 成员列表游标分页：WHERE forum_id = ? AND (joined_at, id) > (?, ?)
+            models.Index(
+                fields=["forum", "joined_at", "id"], name="forum_member_keyset_idx"
+            ),
+            models.Index(
+                fields=["forum", "role_type", "joined_at", "id"],
+                name="forum_member_role_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.username} in {self.forum.name}"
@@ -5,6 +5,7 @@ from rest_framework import serializers
 
 from common.utils.oss_utils import (
     BaseImageUploadSerializer,
+    ImageSrcsetField,
 )
 from .models import (
     Forum,
@@ -16,6 +17,9 @@ from .models import (
     ForumRelation,
     ForumActivity,
 )
+from .utils.counter_utils import ForumCounterService
+from .utils.role_utils import ForumRoleService
+from .utils.signin_utils import ForumSignInService
 
 
 UserModel = get_user_model()
@@ -25,17 +29,31 @@ logger = logging.getLogger("feat")
 class ForumCategorySerializer(serializers.ModelSerializer):
     """贴吧分类序列化器"""
 
+    icon_srcset = ImageSrcsetField(source="icon_url")
+
     class Meta:
         model = ForumCategory
-        fields = ["id", "name", "description", "icon_url", "sort_order"]
+        fields = ["id", "name", "description", "icon_url", "icon_srcset", "sort_order"]
         read_only_fields = ["id", "icon_url"]
 
 
+class ForumListSerializer(serializers.ListSerializer):
+    """贴吧列表序列化器：一次性批量读取整页贴吧的分片计数增量"""
+
+    def to_representation(self, data):
+        forums = list(data.all() if hasattr(data, "all") else data)
+        ForumCounterService.attach_deltas(forums)
+        return super().to_representation(forums)
+
+
 class ForumSerializer(serializers.ModelSerializer):
     """贴吧主信息序列化器"""
 
     creator_name = serializers.CharField(source="creator.username", read_only=True)
-    category_names = serializers.SerializerMethodField()
+    category_names = serializers.ListField(
+        child=serializers.CharField(), read_only=True
+    )
+    cover_image_srcset = ImageSrcsetField(source="cover_image_url")
 
     class Meta:
         model = Forum
@@ -44,6 +62,7 @@ class ForumSerializer(serializers.ModelSerializer):
             "name",
             "description",
             "cover_image_url",
+            "cover_image_srcset",
             "creator_name",
             "post_count",
             "member_count",
@@ -61,10 +80,16 @@ class ForumSerializer(serializers.ModelSerializer):
             "created_at",
             "updated_at",
         ]
+        list_serializer_class = ForumListSerializer
 
-    def get_category_names(self, obj):
-        """展示贴吧分类名"""
-        return [c.category.name for c in obj.categories.all()]
+    def to_representation(self, instance):
+        """成员数、帖子数 = 数据库基数 + Redis 分片中尚未落库的增量"""
+        data = super().to_representation(instance)
+        if getattr(instance, "pending_counter_deltas", None) is None:
+            ForumCounterService.attach_deltas([instance])
+        for field in ForumCounterService.FIELDS:
+            data[field] = ForumCounterService.merged_value(instance, field)
+        return data
 
 
 class ForumCoverImageSerializer(BaseImageUploadSerializer):
@@ -127,19 +152,14 @@ class RoleUpdateSerializer(serializers.ModelSerializer):
         if not forum:
             raise serializers.ValidationError("该吧不存在")
 
-        # 权限检查
-        operator = ForumMember.objects.filter(
-            forum=forum,
-            user=operator,
-            role_type__in=[RoleChoices.OWNER, RoleChoices.ADMIN],
-        ).first()
-        if not operator:
+        # 权限检查（读取操作者的贴吧角色表缓存）
+        operator = ForumRoleService.get_membership(
+            operator.id, forum.pk, self.context["request"]
+        )
+        if not operator or operator[1] not in (RoleChoices.OWNER, RoleChoices.ADMIN):
             raise serializers.ValidationError("你没有权限修改成员角色")
 
-        if (
-            operator.role_type != RoleChoices.OWNER
-            and attrs["role_type"] == RoleChoices.OWNER
-        ):
+        if operator[1] != RoleChoices.OWNER and attrs["role_type"] == RoleChoices.OWNER:
             raise serializers.ValidationError("仅吧主能够修改成员角色为吧主")
 
         # 找目标成员
@@ -208,12 +228,14 @@ class BanMemberSerializer(serializers.ModelSerializer):
         operator = self.context["request"].user
         if member.role_type != RoleChoices.MEMBER:
             raise serializers.ValidationError("该用户不是普通成员，无法被封禁")
-        operator = ForumMember.objects.filter(
-            forum=forum,
-            user=operator,
-            role_type__in=[RoleChoices.OWNER, RoleChoices.ADMIN],
-        ).first()
-        if not operator or operator.is_banned:
+        operator = ForumRoleService.get_membership(
+            operator.id, forum.pk, self.context["request"]
+        )
+        if (
+            not operator
+            or operator[1] not in (RoleChoices.OWNER, RoleChoices.ADMIN)
+            or operator[2]
+        ):
             raise serializers.ValidationError("你没有权限封禁成员角色")
 
         attrs["forum"] = forum
@@ -333,17 +355,16 @@ class ForumActivitySerializer(serializers.ModelSerializer):
 
 
 class ForumSignInInputSerializer(serializers.Serializer):
-    """贴吧活跃度签到序列化器"""
+    """贴吧活跃度签到序列化器（成员校验走缓存，签到热路径不查库）"""
 
-    forum = serializers.PrimaryKeyRelatedField(
-        queryset=Forum.objects.all(), required=True
-    )
+    forum = serializers.IntegerField(min_value=1, required=True)
 
     def validate(self, attrs):
         request = self.context["request"]
-        forum = attrs["forum"]
-        member = ForumMember.objects.filter(forum=forum, user=request.user).first()
-        if not member:
+        member_id = ForumSignInService.get_member_id(
+            attrs["forum"], request.user.id, request
+        )
+        if not member_id:
             raise serializers.ValidationError("你不是该贴吧成员，无法签到")
-        attrs["forum_member"] = member
+        attrs["forum_member_id"] = member_id
         return attrs
@@ -0,0 +1,147 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.timezone import localdate
+
+from forums.models import (
+    Forum,
+    ForumActivity,
+    ForumCategory,
+    ForumCategoryMap,
+    ForumMember,
+)
+from forums.utils.cache_utils import ForumCacheService
+from forums.utils.rank_utils import ForumRankService
+from forums.utils.search_utils import ForumSearchService
+from forums.utils.role_utils import ForumRoleService
+from interactions.models import Comment
+from posts.models import Post
+
+logger = logging.getLogger("feat")
+
+
+# ========== 贴吧读缓存失效 ==========
+
+
+@receiver([post_save, post_delete], sender=Forum)
+def invalidate_forum_cache(sender, instance, **kwargs):
+    """贴吧创建/更新/（软）删除"""
+    ForumCacheService.invalidate_forum_on_commit(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=ForumCategoryMap)
+def invalidate_forum_category_map_cache(sender, instance, **kwargs):
+    """贴吧分类绑定关系变化"""
+    ForumCacheService.invalidate_forum_on_commit(instance.forum_id)
+
+
+@receiver([post_save, post_delete], sender=ForumCategory)
+def invalidate_category_forums_cache(sender, instance, **kwargs):
+    """分类改名/删除会影响所有绑定贴吧展示的分类名"""
+    forum_ids = ForumCategoryMap.all_objects.filter(category=instance).values_list(
+        "forum_id", flat=True
+    )
+    for forum_id in forum_ids:
+        ForumCacheService.invalidate_forum_on_commit(forum_id)
+
+
+@receiver([post_save, post_delete], sender=ForumMember)
+def invalidate_forum_member_count_cache(sender, instance, created=False, **kwargs):
+    """
+    成员加入/退出会改变 member_count；角色、封禁变更不影响贴吧展示
+    加入/退出频繁，只失效该贴吧详情缓存，不递增全局列表版本号；
+    列表页成员数最多滞后 FORUM_CACHE_EXPIRE_SECONDS，随列表缓存过期刷新
+    """
+    update_fields = kwargs.get("update_fields")
+    if created or update_fields is None or "is_deleted" in update_fields:
+        ForumCacheService.invalidate_detail_on_commit(instance.forum_id)
+
+
+# ========== 贴吧检索索引增量更新 ==========
+
+
+def _safe_search_call(func, *args):
+    """索引更新失败只记录日志，不影响业务写入（可通过重建命令修复）"""
+    try:
+        func(*args)
+    except Exception as e:
+        logger.error(f"贴吧检索索引更新失败: {e}")
+
+
+@receiver(post_save, sender=Forum)
+def index_forum_on_save(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: _safe_search_call(ForumSearchService.index_forum, instance)
+    )
+
+
+@receiver(post_delete, sender=Forum)
+def remove_forum_index_on_delete(sender, instance, **kwargs):
+    forum_id = instance.pk
+    transaction.on_commit(
+        lambda: _safe_search_call(ForumSearchService.remove_forum, forum_id)
+    )
+
+
+# ========== 用户贴吧角色表缓存失效 ==========
+
+
+@receiver([post_save, post_delete], sender=ForumMember)
+def invalidate_forum_role_cache(sender, instance, **kwargs):
+    """加入/退出、改角色（RoleUpdateSerializer）、封禁（BanMemberSerializer）都会触发"""
+    ForumRoleService.invalidate_on_commit(instance.user_id)
+
+
+# ========== 排行榜活跃度 ==========
+
+
+def record_forum_activity(forum_id, user_id):
+    """
+    吧成员发帖/回复：刷新活跃榜，并把 ForumActivity.last_active_at 更新为今天
+    （每天最多一次 UPDATE，排行榜重建时以此为准）；非成员不上榜
+    """
+    try:
+        membership = ForumRoleService.get_membership(user_id, forum_id)
+        if not membership:
+            return
+        today = localdate()
+        ForumActivity.objects.filter(
+            forum_member_id=membership[0], last_active_at__lt=today
+        ).update(last_active_at=today)
+        ForumRankService.record_activity(forum_id, user_id)
+    except Exception as e:
+        logger.warning(f"贴吧活跃度记录失败 {forum_id}:{user_id}: {e}")
+
+
+@receiver(post_save, sender=Post)
+def record_post_activity(sender, instance, created=False, **kwargs):
+    """帖子发布（新建即发布，或草稿转为发布）"""
+    if instance.is_draft or instance.is_deleted:
+        return
+    update_fields = kwargs.get("update_fields")
+    if created or (update_fields is not None and "is_draft" in update_fields):
+        forum_id, user_id = instance.forum_id, instance.author_id
+        transaction.on_commit(lambda: record_forum_activity(forum_id, user_id))
+
+
+@receiver(post_save, sender=Comment)
+def record_comment_activity(sender, instance, created=False, **kwargs):
+    """发表评论/回复"""
+    if not created or instance.is_deleted:
+        return
+    forum_id, user_id = instance.post.forum_id, instance.author_id
+    transaction.on_commit(lambda: record_forum_activity(forum_id, user_id))
+
+
+# ========== 排行榜成员移除 ==========
+
+
+@receiver([post_save, post_delete], sender=ForumMember)
+def remove_member_from_rank(sender, instance, **kwargs):
+    """成员退出（软删除或物理删除）后从排行榜移除"""
+    if kwargs.get("signal") is post_save and not instance.is_deleted:
+        return
+    forum_id, user_id = instance.forum_id, instance.user_id
+    transaction.on_commit(lambda: ForumRankService.remove_member(forum_id, user_id))
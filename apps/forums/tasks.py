@@ -2,6 +2,8 @@ from celery import shared_task
 from django.utils import timezone
 from django.db import transaction
 from forums.models import Forum, ForumMember, RoleChoices, ForumActivity
+from forums.utils.counter_utils import ForumCounterService
+from forums.utils.signin_utils import ForumSignInService
 
 
 @shared_task(bind=True, max_retries=3)
@@ -48,9 +50,21 @@ def toggle_forum_membership_task(self, forum_id, user_id):
 
 
 @shared_task
-def refresh_forum_member_counts():
-    for forum in Forum.objects.all():
-        forum.member_count = ForumMember.objects.filter(
-            forum=forum, is_deleted=False
-        ).count()
-        forum.save(update_fields=["member_count"])
+def refresh_forum_member_counts(chunk_size=None):
+    """
+    按源表对账贴吧成员数与帖子数（集合式 GROUP BY + 只更新有偏差的行）
+    返回各字段被修正的行数
+    """
+    return ForumCounterService.recount(chunk_size=chunk_size)
+
+
+@shared_task
+def reconcile_forum_counters():
+    """将 Redis 分片计数增量落回 Forum 行"""
+    return ForumCounterService.reconcile()
+
+
+@shared_task
+def flush_forum_sign_in_activity():
+    """将 Redis 中待落库的签到经验批量写入 ForumActivity"""
+    return ForumSignInService.flush()
@@ -1,3 +1,912 @@
-from django.test import TestCase
+import json
+from datetime import date, timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import localdate
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from common.permissions import IsForumAdmin
+from common.utils.metrics_utils import MetricsService
+
+from interactions.models import Comment
+from posts.models import Post
+
+from .models import (
+    Forum,
+    ForumActivity,
+    ForumCategory,
+    ForumCategoryMap,
+    ForumMember,
+    RoleChoices,
+)
+from .tasks import refresh_forum_member_counts
+from .utils.cache_utils import ForumCacheService
+from .utils.counter_utils import ForumCounterService
+from .utils.rank_utils import ForumRankService
+from .utils.role_utils import ForumRoleService
+from .utils.search_utils import ForumSearchService, ForumTokenizer
+from .utils.signin_utils import ForumSignInService
+from .views import ForumActivityViewSet, ForumMemberReadOnlyViewSet, ForumViewSet
+
+UserModel = get_user_model()
+
+# 关闭读缓存，保证每次请求都真实查库
+NO_CACHE = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+SQLITE_SEARCH_BACKEND = "forums.utils.search_utils.SQLiteFTSForumSearchBackend"
+
+
+@override_settings(CACHES=NO_CACHE)
+class ForumListQueryCountTest(TestCase):
+    """贴吧列表查询次数回归测试（分类名不能产生 N+1）"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserModel.objects.create(username="creator", email="c@test.com")
+        cls.categories = [
+            ForumCategory.objects.create(name=f"分类{i}") for i in range(3)
+        ]
+
+    def _create_forums(self, count):
+        for i in range(Forum.objects.count(), Forum.objects.count() + count):
+            forum = Forum.objects.create(name=f"forum-{i}", creator=self.user)
+            for category in self.categories:
+                ForumCategoryMap.objects.create(forum=forum, category=category)
+
+    def _list_forums(self):
+        request = APIRequestFactory().get("/api/forums/")
+        view = ForumViewSet.as_view({"get": "list"})
+        with CaptureQueriesContext(connection) as ctx:
+            response = view(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(ctx.captured_queries)
+
+    def test_query_count_constant_as_page_grows(self):
+        self._create_forums(1)
+        data, small_page_queries = self._list_forums()
+        self.assertEqual(len(data["results"]), 1)
+
+        self._create_forums(9)
+        data, full_page_queries = self._list_forums()
+        self.assertEqual(len(data["results"]), 10)
+
+        self.assertEqual(small_page_queries, full_page_queries)
+        for item in data["results"]:
+            self.assertEqual(
+                sorted(item["category_names"]), ["分类0", "分类1", "分类2"]
+            )
+
+
+@override_settings(CACHES=NO_CACHE, FORUM_SEARCH_BACKEND=SQLITE_SEARCH_BACKEND)
+class ForumSearchTest(TestCase):
+    """贴吧检索（SQLite FTS5 后端）"""
+
+    def setUp(self):
+        ForumSearchService.get_backend().clear()
+        self.user = UserModel.objects.create(username="creator", email="c@test.com")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.small = Forum.objects.create(
+                name="Python编程", description="小众编程吧", creator=self.user
+            )
+            self.big = Forum.objects.create(
+                name="编程交流",
+                description="程序员聚集地",
+                member_count=5000,
+                creator=self.user,
+            )
+            Forum.objects.create(name="美食", description="吃货", creator=self.user)
+
+    def _search(self, keyword):
+        request = APIRequestFactory().get("/api/forums/", {"search": keyword})
+        response = ForumViewSet.as_view({"get": "list"})(request)
+        return [item["id"] for item in response.data["results"]]
+
+    def test_tokenize_bigram(self):
+        self.assertEqual(
+            ForumTokenizer.tokenize("Python编程吧", for_query=True),
+            ["python", "编程", "程吧"],
+        )
+
+    def test_search_ranks_by_relevance_and_members(self):
+        self.assertEqual(self._search("编程"), [self.big.id, self.small.id])
+        self.assertEqual(self._search("程序员"), [self.big.id])
+        self.assertEqual(self._search("python"), [self.small.id])
+
+    def test_index_follows_update_and_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.small.name = "Java"
+            self.small.description = ""
+            self.small.save()
+            self.big.delete()
+        self.assertEqual(self._search("编程"), [])
+        self.assertEqual(self._search("java"), [self.small.id])
+
+    def test_suggest_prefix(self):
+        suggestions = ForumSearchService.suggest("编")
+        self.assertEqual([s["id"] for s in suggestions], [self.big.id])
+
+
+class FakeRedis:
+    """内存版 Redis，只实现计数分片用到的命令"""
+
+    def __init__(self):
+        self.values = {}
+        self.sets = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def incrby(self, key, amount):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def decrby(self, key, amount):
+        self.incrby(key, -amount)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def sadd(self, key, *members):
+        self.sets.setdefault(key, set()).update(str(m) for m in members)
+
+    def spop(self, key, count):
+        members = self.sets.get(key, set())
+        return [members.pop() for _ in range(min(count, len(members)))]
+
+    def zadd(self, key, mapping):
+        zset = self.sets.setdefault(key, {})
+        zset.update({str(member): float(score) for member, score in mapping.items()})
+
+    def zincrby(self, key, amount, member):
+        zset = self.sets.setdefault(key, {})
+        zset[str(member)] = zset.get(str(member), 0) + amount
+
+    def zrem(self, key, member):
+        self.sets.get(key, {}).pop(str(member), None)
+
+    def _ranked(self, key):
+        return sorted(self.sets.get(key, {}).items(), key=lambda item: -item[1])
+
+    def zrevrange(self, key, start, end, withscores=False):
+        rows = [(m.encode(), score) for m, score in self._ranked(key)][start : end + 1]
+        return rows if withscores else [member for member, _ in rows]
+
+    def zcard(self, key):
+        return len(self.sets.get(key, {}))
+
+    def zrevrank(self, key, member):
+        members = [m for m, _ in self._ranked(key)]
+        return members.index(str(member)) if str(member) in members else None
+
+    def zscore(self, key, member):
+        return self.sets.get(key, {}).get(str(member))
+
+    def exists(self, key):
+        return int(bool(self.sets.get(key)))
+
+    def delete(self, *keys):
+        for key in keys:
+            self.sets.pop(key, None)
+            self.values.pop(key, None)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = str(value).encode()
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def eval(self, script, numkeys, key, token):
+        # 只支持 RedisLockService 的比较后删除脚本
+        if self.values.get(key) == str(token).encode():
+            del self.values[key]
+            return 1
+        return 0
+
+    def hset(self, key, field, value):
+        self.sets.setdefault(key, {})[str(field).encode()] = str(value).encode()
+
+    def hget(self, key, field):
+        return self.sets.get(key, {}).get(str(field).encode())
+
+    def hgetall(self, key):
+        return dict(self.sets.get(key, {}))
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.sets.get(key, {}).pop(field, None)
+
+    def rename(self, src, dst):
+        self.sets[dst] = self.sets.pop(src)
+
+    def scan_iter(self, match):
+        prefix = match.rstrip("*")
+        return [key.encode() for key in list(self.sets) if key.startswith(prefix)]
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        return [
+            getattr(self.redis, name)(*args, **kwargs)
+            for name, args, kwargs in self.commands
+        ]
+
+
+@override_settings(CACHES=NO_CACHE, FORUM_SEARCH_BACKEND=SQLITE_SEARCH_BACKEND)
+class ForumCounterReconcileTest(TestCase):
+    """分片计数落库"""
+
+    def setUp(self):
+        ForumSearchService.get_backend().clear()
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(
+            ForumCounterService, "_redis", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = UserModel.objects.create(username="creator", email="c@test.com")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.small = Forum.objects.create(name="编程小吧", creator=user)
+            self.big = Forum.objects.create(
+                name="编程大吧", creator=user, member_count=10
+            )
+        for _ in range(20):
+            ForumCounterService.incr(self.small.pk, "member_count")
+
+    def test_failed_flush_keeps_deltas(self):
+        with mock.patch.object(
+            Forum.objects, "filter", side_effect=RuntimeError("db down")
+        ):
+            self.assertEqual(ForumCounterService.reconcile(), 0)
+        self.assertEqual(
+            ForumCounterService.get_deltas([self.small.pk])[self.small.pk],
+            {"member_count": 20, "post_count": 0},
+        )
+        self.assertEqual(
+            self.redis.sets[ForumCounterService.DIRTY_KEY], {str(self.small.pk)}
+        )
+
+    def test_flush_applies_deltas_and_reindexes(self):
+        self.assertEqual(
+            ForumSearchService.search("编程"), [self.big.pk, self.small.pk]
+        )
+        self.assertEqual(ForumCounterService.reconcile(), 1)
+        self.small.refresh_from_db()
+        self.assertEqual(self.small.member_count, 21)
+        self.assertEqual(
+            ForumCounterService.get_deltas([self.small.pk])[self.small.pk],
+            {"member_count": 0, "post_count": 0},
+        )
+        self.assertEqual(
+            ForumSearchService.search("编程"), [self.small.pk, self.big.pk]
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ForumSignInFlushTest(TestCase):
+    """签到经验落库与签到接口"""
+
+    def setUp(self):
+        cache.clear()
+        self.redis = FakeRedis()
+        for service in (ForumSignInService, ForumRankService):
+            patcher = mock.patch.object(service, "_redis", return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = UserModel.objects.create(username="u", email="u@test.com")
+        self.forum = Forum.objects.create(name="forum", creator=self.user)
+        self.member = ForumMember.objects.create(forum=self.forum, user=self.user)
+
+    def test_flush_merges_pending_exp(self):
+        ForumActivity.objects.create(
+            forum=self.forum, forum_member=self.member, exp_points=70
+        )
+        today = date(2026, 10, 17)
+        field = f"{self.forum.pk}:{self.user.pk}"
+        self.redis.hset(ForumSignInService.PENDING_EXP_KEY, field, 40)
+        self.redis.hset(ForumSignInService.PENDING_DATE_KEY, field, today.isoformat())
+        # 非成员的待落库记录被丢弃
+        self.redis.hset(ForumSignInService.PENDING_EXP_KEY, f"{self.forum.pk}:999", 30)
+        self.redis.hset(
+            ForumSignInService.STREAK_KEY.format(self.forum.pk), self.user.pk, 3
+        )
+
+        self.assertEqual(ForumSignInService.flush(batch_size=1), 1)
+
+        activity = ForumActivity.objects.get(forum_member=self.member)
+        self.assertEqual(
+            (activity.exp_points, activity.level, activity.sign_in_streak),
+            (110, 2, 3),
+        )
+        self.assertEqual(activity.last_active_at, today)
+        self.assertFalse(
+            [key for key in self.redis.sets if key.startswith("forum:signin:pending")]
+        )
+
+    def test_flush_skips_while_another_run_holds_lock(self):
+        field = f"{self.forum.pk}:{self.user.pk}"
+        self.redis.hset(ForumSignInService.PENDING_EXP_KEY, field, 40)
+        self.redis.hset(ForumSignInService.PENDING_DATE_KEY, field, "2026-10-17")
+        self.redis.set(ForumSignInService.FLUSH_LOCK_KEY, "other-run")
+        self.assertEqual(ForumSignInService.flush(), 0)
+        self.assertFalse(ForumActivity.objects.exists())
+
+        self.redis.delete(ForumSignInService.FLUSH_LOCK_KEY)
+        self.assertEqual(ForumSignInService.flush(), 1)
+        self.assertIsNone(self.redis.get(ForumSignInService.FLUSH_LOCK_KEY))
+
+    def test_sign_in_response_includes_activity(self):
+        ForumActivity.objects.create(
+            forum=self.forum, forum_member=self.member, exp_points=70, sign_in_streak=2
+        )
+        ForumActivity.objects.update(last_active_at=localdate() - timedelta(days=1))
+        script = mock.Mock(return_value=[1, 3, 32, 32])
+        request = APIRequestFactory().post(
+            "/api/forums/activity/signin/", {"forum": self.forum.pk}, format="json"
+        )
+        force_authenticate(request, user=self.user)
+        view = ForumActivityViewSet.as_view({"post": "sign_in"})
+        with mock.patch.object(
+            ForumSignInService, "_sign_in_script", return_value=script
+        ):
+            response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["gained_exp"], 32)
+        activity = response.data["activity"]
+        self.assertEqual(
+            (activity["exp_points"], activity["level"], activity["sign_in_streak"]),
+            (102, 2, 3),
+        )
+        self.assertEqual(activity["forum_member_name"], "u")
+        # 数据库中的连签天数作为 Redis 无记录时的回退传给脚本
+        self.assertEqual(script.call_args.kwargs["args"][6:], [2, 1])
+
+    def test_sign_in_stats_fall_back_to_database(self):
+        ForumActivity.objects.create(
+            forum=self.forum, forum_member=self.member, sign_in_streak=3
+        )
+        ForumActivity.objects.update(last_active_at=date(2026, 10, 2))
+        factory = APIRequestFactory()
+        view = ForumActivityViewSet.as_view
+        self.redis.get = mock.Mock(side_effect=ConnectionError("redis down"))
+        self.redis.bitcount = mock.Mock(side_effect=ConnectionError("redis down"))
+
+        request = factory.get(
+            f"/api/forums/activity/signin/calendar/?forum={self.forum.pk}&month=2026-10"
+        )
+        force_authenticate(request, user=self.user)
+        response = view({"get": "sign_in_calendar"})(request)
+        self.assertEqual(response.status_code, 200)
+        # 连签 3 天从 10 月 2 日倒推，9 月 30 日不属于本月
+        self.assertEqual(response.data["signed_days"], [1, 2])
+        self.assertTrue(response.data["degraded"])
+
+        request = factory.get(
+            f"/api/forums/activity/signin/count/?forum={self.forum.pk}"
+        )
+        force_authenticate(request, user=self.user)
+        with mock.patch(
+            "forums.utils.signin_utils.localdate", return_value=date(2026, 10, 2)
+        ):
+            response = view({"get": "sign_in_count"})(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["count"], response.data["degraded"]), (1, True))
+
+    def test_sign_in_reads_database_only_on_seed_miss(self):
+        activity = ForumActivity.objects.create(
+            forum=self.forum, forum_member=self.member, exp_points=70, sign_in_streak=2
+        )
+        ForumActivity.objects.update(last_active_at=localdate() - timedelta(days=1))
+        script = mock.Mock(return_value=[0, 3, 0, 32])
+        with mock.patch.object(
+            ForumSignInService, "_sign_in_script", return_value=script
+        ):
+            ForumSignInService.sign_in(self.forum.pk, self.user.pk, self.member.pk)
+            with self.assertNumQueries(0):
+                *_, cached = ForumSignInService.sign_in(
+                    self.forum.pk, self.user.pk, self.member.pk
+                )
+        self.assertEqual((cached.pk, cached.exp_points), (activity.pk, 102))
+        self.assertEqual(cached.forum_member.user.username, "u")
+        self.assertEqual(script.call_args.kwargs["args"][6:], [2, 1])
+
+        # 落库后种子同步为数据库中的新值，待落库经验已清空
+        field = f"{self.forum.pk}:{self.user.pk}"
+        self.redis.hset(ForumSignInService.PENDING_EXP_KEY, field, 32)
+        self.redis.hset(ForumSignInService.PENDING_DATE_KEY, field, "2026-10-17")
+        ForumSignInService.flush()
+        seed = json.loads(
+            self.redis.get(ForumSignInService.SEED_KEY.format(self.member.pk))
+        )
+        self.assertEqual((seed["exp"], seed["last"]), (102, "2026-10-17"))
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": f"{settings.REDIS_URL}/15",
+        }
+    }
+)
+class ForumSignInScriptTest(TestCase):
+    """签到 Lua 脚本（需要可用的 Redis，使用 15 号库）"""
+
+    def setUp(self):
+        ForumSignInService._script = None
+        self.addCleanup(setattr, ForumSignInService, "_script", None)
+        try:
+            self.redis = ForumSignInService._redis()
+            self.redis.flushdb()
+        except Exception as e:
+            self.skipTest(f"Redis 不可用: {e}")
+        self.addCleanup(self.redis.flushdb)
+        self.user = UserModel.objects.create(username="u", email="u@test.com")
+        self.forum = Forum.objects.create(name="forum", creator=self.user)
+        self.member = ForumMember.objects.create(forum=self.forum, user=self.user)
+        self.today = date(2026, 10, 17)
+
+    def _sign_in(self, day):
+        return ForumSignInService.sign_in(
+            self.forum.pk, self.user.pk, self.member.pk, today=day
+        )[:3]
+
+    def test_streak_and_duplicate(self):
+        yesterday = self.today - timedelta(days=1)
+        self.assertEqual(self._sign_in(yesterday), (True, 1, 30))
+        self.assertEqual(self._sign_in(self.today), (True, 2, 30))
+        self.assertEqual(self._sign_in(self.today), (False, 2, 0))
+        self.assertEqual(ForumSignInService.count_today(self.forum.pk, self.today), 1)
+        self.assertEqual(
+            ForumSignInService.month_calendar(self.forum.pk, self.user.pk, 2026, 10),
+            [16, 17],
+        )
+        # 日位图按吧内槽位置位，与 user_id 大小无关
+        day_key = ForumSignInService.DAY_KEY.format(self.forum.pk, "20261017")
+        self.assertEqual(self.redis.strlen(day_key), 1)
+
+    def test_streak_falls_back_to_database(self):
+        ForumActivity.objects.create(
+            forum=self.forum,
+            forum_member=self.member,
+            sign_in_streak=40,
+        )
+        ForumActivity.objects.update(last_active_at=self.today - timedelta(days=1))
+        self.assertEqual(self._sign_in(self.today), (True, 41, 50))
+
+    def test_signed_today_in_database(self):
+        ForumActivity.objects.create(
+            forum=self.forum, forum_member=self.member, sign_in_streak=5
+        )
+        ForumActivity.objects.update(last_active_at=self.today)
+        self.assertEqual(self._sign_in(self.today), (False, 5, 0))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ForumRankTest(TestCase):
+    """贴吧排行榜"""
+
+    def setUp(self):
+        cache.clear()
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(ForumRankService, "_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = UserModel.objects.create(username="u", email="u@test.com")
+        self.outsider = UserModel.objects.create(username="o", email="o@test.com")
+        self.forum = Forum.objects.create(name="forum", creator=self.user)
+        self.member = ForumMember.objects.create(forum=self.forum, user=self.user)
+
+    def _active_ids(self):
+        return ForumRankService.top_user_ids(
+            self.forum.pk, ForumRankService.ACTIVE_BOARD
+        )
+
+    def test_post_and_comment_record_activity(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                forum=self.forum, author=self.user, title="t", content="c"
+            )
+        # 草稿不算活跃
+        self.assertEqual(self._active_ids(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.is_draft = False
+            post.save(update_fields=["is_draft"])
+        self.assertEqual(self._active_ids(), [self.user.pk])
+        # 发帖只刷新活跃时间，不增加经验
+        self.assertEqual(
+            ForumRankService.my_rank(
+                self.forum.pk, ForumRankService.EXP_BOARD, self.user.pk
+            ),
+            (None, 0),
+        )
+
+        self.redis.sets.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=post, author=self.user, content="c")
+            # 非成员的评论不上榜
+            Comment.objects.create(post=post, author=self.outsider, content="c")
+        self.assertEqual(self._active_ids(), [self.user.pk])
+
+    def test_rebuild_swaps_keys(self):
+        other = Forum.objects.create(name="other", creator=self.user)
+        stale_key = ForumRankService._key(ForumRankService.EXP_BOARD, other.pk)
+        self.redis.zadd(stale_key, {self.user.pk: 99})
+        ForumRankService.record_sign_in(self.forum.pk, self.outsider.pk, 500)
+        second = ForumMember.objects.create(forum=self.forum, user=self.outsider)
+        ForumActivity.objects.create(
+            forum=self.forum, forum_member=self.member, exp_points=30
+        )
+        ForumActivity.objects.create(
+            forum=self.forum, forum_member=second, exp_points=80
+        )
+
+        self.assertEqual(ForumRankService.rebuild(ForumActivity.objects.all()), 2)
+
+        # 无活跃记录的贴吧榜单被清空，临时键全部换名
+        self.assertNotIn(stale_key, self.redis.sets)
+        self.assertFalse(any(key.endswith(":rebuilding") for key in self.redis.sets))
+        total, rows = ForumRankService.page(self.forum.pk, ForumRankService.EXP_BOARD)
+        self.assertEqual(total, 2)
+        self.assertEqual(
+            [(row["rank"], row["username"], row["score"]) for row in rows],
+            [(1, "o", 80), (2, "u", 30)],
+        )
+
+    def test_rank_endpoints_fall_back_to_database(self):
+        second = ForumMember.objects.create(forum=self.forum, user=self.outsider)
+        ForumActivity.objects.create(
+            forum=self.forum, forum_member=self.member, exp_points=30
+        )
+        ForumActivity.objects.create(
+            forum=self.forum, forum_member=second, exp_points=80
+        )
+        factory = APIRequestFactory()
+        query = f"?forum={self.forum.pk}&board=exp"
+        with mock.patch.object(
+            ForumRankService, "_redis", side_effect=ConnectionError("redis down")
+        ):
+            request = factory.get(f"/api/forums/activity/rank/{query}")
+            force_authenticate(request, user=self.user)
+            response = ForumActivityViewSet.as_view({"get": "rank"})(request)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["count"], 2)
+            self.assertEqual(
+                [
+                    (r["rank"], r["username"], r["score"])
+                    for r in response.data["results"]
+                ],
+                [(1, "o", 80), (2, "u", 30)],
+            )
+
+            request = factory.get(f"/api/forums/activity/myrank/{query}")
+            force_authenticate(request, user=self.user)
+            response = ForumActivityViewSet.as_view({"get": "my_rank"})(request)
+            self.assertEqual((response.data["rank"], response.data["score"]), (2, 30))
+
+
+@override_settings(CACHES=LOCMEM_CACHE, FORUM_SEARCH_BACKEND=SQLITE_SEARCH_BACKEND)
+class ForumRecountShardTest(TestCase):
+    """对账与分片增量"""
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(
+            ForumCounterService, "_redis", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = UserModel.objects.create(username="creator", email="c@test.com")
+        self.forum = Forum.objects.create(name="forum", creator=user, member_count=9)
+        for i in range(2):
+            ForumMember.objects.create(
+                forum=self.forum,
+                user=UserModel.objects.create(username=f"m{i}", email=f"m{i}@t.com"),
+            )
+
+    def test_delta_during_recount_is_not_double_counted(self):
+        read_shards = ForumCounterService._read_shards
+
+        def snapshot_then_join(forum_ids):
+            # 分片已有 1 个增量（对应的成员已计入聚合），快照之后又有人加入
+            ForumCounterService.incr(self.forum.pk, "member_count", 1)
+            snapshot = read_shards(forum_ids)
+            ForumCounterService.incr(self.forum.pk, "member_count", 1)
+            return snapshot
+
+        list_version = ForumCacheService._get_version(
+            ForumCacheService.LIST_VERSION_KEY
+        )
+        with mock.patch.object(ForumCounterService, "reconcile"), mock.patch.object(
+            ForumCounterService, "_read_shards", side_effect=snapshot_then_join
+        ):
+            result = ForumCounterService.recount()
+
+        self.assertEqual(result["member_count"], 1)
+        self.forum.refresh_from_db()
+        self.assertEqual(self.forum.member_count, 2)
+        self.assertEqual(
+            ForumCounterService.merged_value(self.forum, "member_count"), 3
+        )
+        self.assertEqual(
+            ForumCacheService._get_version(ForumCacheService.LIST_VERSION_KEY),
+            list_version + 1,
+        )
+
+    def test_join_committed_between_snapshot_and_aggregate_heals_next_run(self):
+        read_shards = ForumCounterService._read_shards
+        joiner = UserModel.objects.create(username="late", email="late@t.com")
+
+        def snapshot_then_commit_join(forum_ids):
+            snapshot = read_shards(forum_ids)
+            # 快照之后、聚合之前提交的加入：既在聚合结果中，增量也留在分片里
+            ForumMember.objects.create(forum=self.forum, user=joiner)
+            ForumCounterService.incr(self.forum.pk, "member_count", 1)
+            return snapshot
+
+        with mock.patch.object(ForumCounterService, "reconcile"), mock.patch.object(
+            ForumCounterService, "_read_shards", side_effect=snapshot_then_commit_join
+        ):
+            ForumCounterService.recount()
+        self.forum.refresh_from_db()
+        self.assertEqual(self.forum.member_count, 3)
+        # 已知的残留偏差：这一次加入会被多计一次
+        self.assertEqual(
+            ForumCounterService.merged_value(self.forum, "member_count"), 4
+        )
+
+        # 下一轮先落库分片、再按源表修正
+        ForumCounterService.recount()
+        self.forum.refresh_from_db()
+        self.assertEqual(self.forum.member_count, 3)
+        self.assertEqual(
+            ForumCounterService.merged_value(self.forum, "member_count"), 3
+        )
+
+
+@override_settings(CACHES=NO_CACHE)
+class ForumRecountTest(TestCase):
+    """贴吧计数集合式对账"""
+
+    def test_only_drifted_rows_are_corrected(self):
+        user = UserModel.objects.create(username="creator", email="c@test.com")
+        members = [
+            UserModel.objects.create(username=f"m{i}", email=f"m{i}@test.com")
+            for i in range(3)
+        ]
+        correct = Forum.objects.create(name="correct", creator=user, member_count=2)
+        drifted = Forum.objects.create(name="drifted", creator=user, member_count=9)
+        for forum in (correct, drifted):
+            for member in members[:2]:
+                ForumMember.objects.create(forum=forum, user=member)
+        ForumMember.objects.create(forum=drifted, user=members[2]).delete()
+
+        result = refresh_forum_member_counts(chunk_size=1)
+
+        self.assertEqual(result, {"member_count": 1, "post_count": 0})
+        drifted.refresh_from_db()
+        self.assertEqual(drifted.member_count, 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ForumReadCacheTest(TestCase):
+    """贴吧读穿透缓存"""
+
+    def _versions(self):
+        return (
+            ForumCacheService._get_version(ForumCacheService.LIST_VERSION_KEY),
+            ForumCacheService._get_version(
+                ForumCacheService.DETAIL_VERSION_KEY.format(self.forum.pk)
+            ),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserModel.objects.create(username="u", email="u@test.com")
+        self.forum = Forum.objects.create(name="forum", creator=self.user)
+
+    def _request(self, actions, **kwargs):
+        view = ForumViewSet.as_view(actions)
+        with CaptureQueriesContext(connection) as ctx:
+            response = view(APIRequestFactory().get("/api/forums/"), **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(ctx.captured_queries)
+
+    def _retrieve(self):
+        return self._request({"get": "retrieve"}, pk=self.forum.pk)
+
+    def _list(self):
+        return self._request({"get": "list"})
+
+    def test_detail_miss_then_hit(self):
+        data, queries = self._retrieve()
+        self.assertGreater(queries, 0)
+        self.assertEqual(data["name"], "forum")
+        self.assertEqual(self._retrieve(), (data, 0))
+        self.assertEqual(MetricsService.get("forum_cache.detail.miss"), 1)
+        self.assertEqual(MetricsService.get("forum_cache.detail.hit"), 1)
+
+    def test_forum_write_invalidates_detail_and_list(self):
+        self._retrieve()
+        self._list()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.forum.name = "renamed"
+            self.forum.save()
+        data, queries = self._retrieve()
+        self.assertGreater(queries, 0)
+        self.assertEqual(data["name"], "renamed")
+        data, _ = self._list()
+        self.assertEqual(data["results"][0]["name"], "renamed")
+
+    def test_category_map_write_invalidates_list(self):
+        data, _ = self._list()
+        self.assertEqual(data["results"][0]["category_names"], [])
+        category = ForumCategory.objects.create(name="分类")
+        with self.captureOnCommitCallbacks(execute=True):
+            ForumCategoryMap.objects.create(forum=self.forum, category=category)
+        data, queries = self._list()
+        self.assertGreater(queries, 0)
+        self.assertEqual(data["results"][0]["category_names"], ["分类"])
+
+    def test_member_join_only_invalidates_detail(self):
+        list_version, detail_version = self._versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            ForumMember.objects.create(forum=self.forum, user=self.user)
+        self.assertEqual(self._versions(), (list_version, detail_version + 1))
+
+
+@override_settings(CACHES=NO_CACHE)
+class ForumJoinToggleTest(TestCase):
+    """加入 / 退出贴吧"""
+
+    def setUp(self):
+        self.user = UserModel.objects.create(username="u", email="u@test.com")
+        self.forum = Forum.objects.create(name="forum", creator=self.user)
+
+    def _toggle(self):
+        request = APIRequestFactory().post(f"/api/forums/{self.forum.pk}/toggle/")
+        force_authenticate(request, user=self.user)
+        view = ForumViewSet.as_view({"post": "join_toggle"})
+        with self.captureOnCommitCallbacks(execute=True):
+            return view(request, pk=self.forum.pk)
+
+    def test_toggle_joins_and_leaves(self):
+        self.assertEqual(self._toggle().data["action"], "joined")
+        self.assertEqual(self._toggle().data["action"], "left")
+        self.assertEqual(self._toggle().data["action"], "rejoined")
+
+    def test_concurrent_first_join_does_not_fail(self):
+        # 模拟并发：读取成员行时对方尚未提交，插入时对方已提交
+        ForumMember.objects.create(forum=self.forum, user=self.user)
+        with mock.patch(
+            "forums.views.ForumMember.all_objects.select_for_update"
+        ) as select_for_update:
+            select_for_update.return_value.filter.return_value.first.return_value = None
+            select_for_update.return_value.get.return_value = None
+            with mock.patch(
+                "forums.utils.counter_utils.ForumCounterService.incr"
+            ) as incr:
+                response = self._toggle()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["action"], "joined")
+        incr.assert_not_called()
+        self.assertEqual(
+            ForumMember.objects.filter(forum=self.forum, user=self.user).count(), 1
+        )
+
+
+@override_settings(CACHES=NO_CACHE)
+class ForumMemberKeysetPaginationTest(TestCase):
+    """贴吧成员列表游标分页"""
+
+    @classmethod
+    def setUpTestData(cls):
+        creator = UserModel.objects.create(username="creator", email="c@test.com")
+        cls.forum = Forum.objects.create(name="forum", creator=creator, member_count=5)
+        cls.members = [
+            ForumMember.objects.create(
+                forum=cls.forum,
+                user=UserModel.objects.create(username=f"m{i}", email=f"m{i}@t.com"),
+            )
+            for i in range(5)
+        ]
+        # 加入时间相同的成员依靠 id 区分先后
+        ForumMember.objects.update(joined_at=cls.members[0].joined_at)
+        ForumMember.objects.filter(pk=cls.members[4].pk).update(
+            role_type=RoleChoices.OWNER
+        )
+
+    def _get(self, params):
+        request = APIRequestFactory().get("/api/forums/1/members/readonly/", params)
+        view = ForumMemberReadOnlyViewSet.as_view({"get": "list"})
+        with CaptureQueriesContext(connection) as ctx:
+            response = view(request, forum_pk=self.forum.pk)
+        self.assertEqual(response.status_code, 200)
+        for query in ctx.captured_queries:
+            self.assertNotIn("COUNT(", query["sql"].upper())
+        return response.data
+
+    def _walk(self, params):
+        ids, cursor = [], None
+        while True:
+            data = self._get(
+                {**params, "page_size": 2, **({"cursor": cursor} if cursor else {})}
+            )
+            ids.extend(item["id"] for item in data["results"])
+            if not data["next"]:
+                return data, ids
+            cursor = parse_qs(urlsplit(data["next"]).query)["cursor"][0]
+
+    def test_pages_cover_all_members_in_order(self):
+        data, ids = self._walk({})
+        self.assertEqual(ids, [m.pk for m in self.members])
+        self.assertEqual(data["count"], 5)
+
+    def test_role_ordering_puts_owner_first(self):
+        _, ids = self._walk({"order": "role"})
+        self.assertEqual(ids, [self.members[4].pk] + [m.pk for m in self.members[:4]])
+
+    def test_invalid_cursor(self):
+        request = APIRequestFactory().get("/", {"cursor": "bad"})
+        view = ForumMemberReadOnlyViewSet.as_view({"get": "list"})
+        self.assertEqual(view(request, forum_pk=self.forum.pk).status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ForumAdminPermissionCacheTest(TestCase):
+    """吧管理员权限判断走角色表缓存"""
+
+    def setUp(self):
+        self.user = UserModel.objects.create(username="admin", email="a@test.com")
+        self.forum = Forum.objects.create(name="forum", creator=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member = ForumMember.objects.create(forum=self.forum, user=self.user)
+
+    def _check(self):
+        request = Request(APIRequestFactory().get("/"))
+        request.user = self.user
+        view = ForumViewSet(kwargs={"pk": self.forum.pk})
+        permission = IsForumAdmin()
+        return permission.has_permission(
+            request, view
+        ) and permission.has_object_permission(request, view, self.forum)
+
+    def test_zero_query_after_warm_up_and_invalidated_on_role_change(self):
+        self.assertFalse(self._check())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member.role_type = RoleChoices.ADMIN
+            self.member.save(update_fields=["role_type"])
+        self.assertTrue(self._check())
+        with self.assertNumQueries(0):
+            self.assertTrue(self._check())
+
+    def test_forum_delete_invalidates_member_role_maps(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member.role_type = RoleChoices.ADMIN
+            self.member.save(update_fields=["role_type"])
+        self.assertTrue(ForumRoleService.is_forum_admin(self.user.pk, self.forum.pk))
+
+        # 删除贴吧批量软删除成员，不经过 ForumMember 信号
+        with self.captureOnCommitCallbacks(execute=True):
+            self.forum.delete()
+        self.assertIsNone(cache.get(ForumRoleService.ROLE_MAP_KEY.format(self.user.pk)))
+        self.assertFalse(ForumRoleService.is_forum_admin(self.user.pk, self.forum.pk))
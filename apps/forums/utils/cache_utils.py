@@ -0,0 +1,127 @@
+import hashlib
+import logging
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from common.utils.metrics_utils import MetricsService
+
+logger = logging.getLogger("feat")
+
+
+class ForumCacheService:
+    """
+    贴吧读缓存服务（版本号 + 读穿透）
+      - 列表页按查询参数缓存，共用一个全局版本号
+      - 详情按贴吧缓存，每个贴吧独立版本号
+      - 写操作只需递增版本号，旧缓存随过期时间自然淘汰
+      - 成员加入/退出只失效详情缓存：列表页的 member_count 允许最多滞后
+        FORUM_CACHE_EXPIRE_SECONDS（默认 300 秒），以免热门贴吧的每次加入都清空全部列表缓存
+    """
+
+    FORUM_CACHE_NAME = "default"
+    LIST_VERSION_KEY = "forum:cache:list:version"
+    DETAIL_VERSION_KEY = "forum:cache:detail:version:{}"
+
+    @staticmethod
+    def _cache():
+        return caches[ForumCacheService.FORUM_CACHE_NAME]
+
+    @staticmethod
+    def _get_version(key):
+        cache = ForumCacheService._cache()
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, 1, timeout=None)
+            version = cache.get(key) or 1
+        return version
+
+    @staticmethod
+    def _bump_version(key):
+        cache = ForumCacheService._cache()
+        try:
+            cache.incr(key)
+        except ValueError:
+            # 版本号不存在（过期或被清理），直接重置为新版本
+            cache.set(key, 2, timeout=None)
+
+    @staticmethod
+    def _params_digest(query_params):
+        """将查询参数规范化后做摘要，参数顺序不影响缓存键"""
+        items = sorted((k, v) for k in query_params for v in query_params.getlist(k))
+        return hashlib.md5(urlencode(items).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def list_key(query_params):
+        version = ForumCacheService._get_version(ForumCacheService.LIST_VERSION_KEY)
+        digest = ForumCacheService._params_digest(query_params)
+        return f"forum:cache:list:v{version}:{digest}"
+
+    @staticmethod
+    def detail_key(forum_id):
+        version = ForumCacheService._get_version(
+            ForumCacheService.DETAIL_VERSION_KEY.format(forum_id)
+        )
+        return f"forum:cache:detail:{forum_id}:v{version}"
+
+    @staticmethod
+    def get_or_set(key, loader, metric):
+        """
+        读穿透：命中直接返回缓存数据，未命中调用 loader 加载并回填
+        缓存异常时降级为直接查库，不影响接口可用性
+        """
+        cache = ForumCacheService._cache()
+        try:
+            data = cache.get(key)
+        except Exception as e:
+            logger.warning(f"贴吧缓存读取失败 {key}: {e}")
+            return loader()
+
+        if data is not None:
+            MetricsService.incr(f"{metric}.hit")
+            return data
+
+        MetricsService.incr(f"{metric}.miss")
+        data = loader()
+        try:
+            cache.set(key, data, getattr(settings, "FORUM_CACHE_EXPIRE_SECONDS", 300))
+        except Exception as e:
+            logger.warning(f"贴吧缓存回填失败 {key}: {e}")
+        return data
+
+    @staticmethod
+    def invalidate_list():
+        """使所有列表页缓存失效"""
+        ForumCacheService._bump_version(ForumCacheService.LIST_VERSION_KEY)
+
+    @staticmethod
+    def invalidate_detail(forum_id):
+        """只使指定贴吧的详情缓存失效"""
+        ForumCacheService._bump_version(
+            ForumCacheService.DETAIL_VERSION_KEY.format(forum_id)
+        )
+
+    @staticmethod
+    def invalidate_forum(forum_id):
+        """使指定贴吧的详情缓存和所有列表页缓存失效"""
+        ForumCacheService.invalidate_detail(forum_id)
+        ForumCacheService.invalidate_list()
+
+    @staticmethod
+    def invalidate_forum_on_commit(forum_id):
+        """事务提交后再失效，避免并发读在提交前回填旧数据"""
+        transaction.on_commit(lambda: ForumCacheService.invalidate_forum(forum_id))
+
+    @staticmethod
+    def invalidate_detail_on_commit(forum_id):
+        """
+        事务提交后只使详情缓存失效（成员数等高频变化不影响列表缓存）
+        列表页中该贴吧的 member_count 会保持旧值，直到列表缓存过期（FORUM_CACHE_EXPIRE_SECONDS）
+        """
+        transaction.on_commit(lambda: ForumCacheService.invalidate_detail(forum_id))
+
+    @staticmethod
+    def hit_ratio(metric):
+        return MetricsService.ratio(f"{metric}.hit", f"{metric}.miss")
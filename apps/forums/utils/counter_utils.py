@@ -0,0 +1,286 @@
+import logging
+import random
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django_redis import get_redis_connection
+
+from forums.models import Forum, ForumMember
+from forums.utils.cache_utils import ForumCacheService
+from forums.utils.search_utils import ForumSearchService
+from posts.models import Post
+
+logger = logging.getLogger("feat")
+
+
+class ForumCounterService:
+    """
+    贴吧计数分片服务（member_count / post_count）
+      - 增量随机写入 N 个分片键，热点吧的并发加减不再争抢 Forum 行锁或同一个键
+      - 读取时：Forum 行上的基数 + 各分片增量之和
+      - 定时任务 reconcile 把分片增量落回 Forum 行并清零
+    """
+
+    COUNTER_CACHE_NAME = "default"
+    SHARD_KEY = "forum:counter:{}:{}:{}"  # forum_id, field, shard
+    DIRTY_KEY = "forum:counter:dirty"
+    FIELDS = ("member_count", "post_count")
+
+    @staticmethod
+    def _redis():
+        return get_redis_connection(ForumCounterService.COUNTER_CACHE_NAME)
+
+    @staticmethod
+    def _shards():
+        return getattr(settings, "FORUM_COUNTER_SHARDS", 8)
+
+    @staticmethod
+    def _shard_keys(forum_id, field):
+        return [
+            ForumCounterService.SHARD_KEY.format(forum_id, field, shard)
+            for shard in range(ForumCounterService._shards())
+        ]
+
+    @staticmethod
+    def incr(forum_id, field, amount=1):
+        """计数增量写入随机分片；Redis 不可用时降级为直接更新数据库"""
+        if field not in ForumCounterService.FIELDS:
+            raise ValueError(f"不支持的计数字段: {field}")
+        shard = random.randrange(ForumCounterService._shards())
+        try:
+            pipe = ForumCounterService._redis().pipeline()
+            pipe.incrby(
+                ForumCounterService.SHARD_KEY.format(forum_id, field, shard), amount
+            )
+            pipe.sadd(ForumCounterService.DIRTY_KEY, forum_id)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"贴吧计数分片写入失败，降级写库 {forum_id}.{field}: {e}")
+            Forum.objects.filter(pk=forum_id).update(**{field: F(field) + amount})
+
+    @staticmethod
+    def incr_on_commit(forum_id, field, amount=1):
+        """与成员关系等写操作同事务：事务提交后才计数，回滚则不计数"""
+        transaction.on_commit(lambda: ForumCounterService.incr(forum_id, field, amount))
+
+    @staticmethod
+    def _read_shards(forum_ids):
+        """
+        批量读取贴吧的全部分片（一次 MGET，不清空）
+        返回 {forum_id: ({分片键: 值}, {计数字段: 增量和})}
+        """
+        layout = [
+            (forum_id, field, key)
+            for forum_id in forum_ids
+            for field in ForumCounterService.FIELDS
+            for key in ForumCounterService._shard_keys(forum_id, field)
+        ]
+        values = ForumCounterService._redis().mget([key for _, _, key in layout])
+        result = {
+            forum_id: ({}, dict.fromkeys(ForumCounterService.FIELDS, 0))
+            for forum_id in forum_ids
+        }
+        for (forum_id, field, key), value in zip(layout, values):
+            if value and int(value):
+                shards, deltas = result[forum_id]
+                shards[key] = int(value)
+                deltas[field] += int(value)
+        return result
+
+    @staticmethod
+    def get_deltas(forum_ids):
+        """
+        批量读取未落库的增量（一次 MGET）
+        返回 {forum_id: {"member_count": delta, "post_count": delta}}
+        """
+        forum_ids = list(forum_ids)
+        if not forum_ids:
+            return {}
+        try:
+            shards = ForumCounterService._read_shards(forum_ids)
+        except Exception as e:
+            logger.warning(f"贴吧计数分片读取失败，仅返回数据库计数: {e}")
+            return {}
+        return {forum_id: deltas for forum_id, (_, deltas) in shards.items()}
+
+    @staticmethod
+    def attach_deltas(forums):
+        """为一批贴吧对象挂载增量，供序列化时合并，避免逐个访问 Redis"""
+        deltas = ForumCounterService.get_deltas(forum.pk for forum in forums)
+        for forum in forums:
+            forum.pending_counter_deltas = deltas.get(forum.pk, {})
+        return forums
+
+    @staticmethod
+    def merged_value(forum, field):
+        """数据库基数 + 分片增量"""
+        deltas = getattr(forum, "pending_counter_deltas", None)
+        if deltas is None:
+            deltas = ForumCounterService.get_deltas([forum.pk]).get(forum.pk, {})
+        return max(0, getattr(forum, field) + deltas.get(field, 0))
+
+    @staticmethod
+    def _consume_shards(shards):
+        """按已落库的值扣减分片（DECRBY），读取之后新写入的增量保留在分片中"""
+        pipe = ForumCounterService._redis().pipeline(transaction=True)
+        for key, value in shards.items():
+            pipe.decrby(key, value)
+        pipe.execute()
+
+    @staticmethod
+    def reconcile(batch_size=500):
+        """
+        将分片增量落回 Forum 行
+          - 先落库、后按落库的值扣减分片：两步之间进程崩溃只会多计（由 recount 修正），
+            不会丢失增量
+          - 落库失败时把贴吧放回待落库集合，分片保持不变
+          - update() 不触发信号，成员数变化的贴吧手动刷新检索索引中的人气值
+        返回本次落库的贴吧数量
+        """
+        redis = ForumCounterService._redis()
+        flushed = 0
+        member_changed = []
+        while True:
+            forum_ids = redis.spop(ForumCounterService.DIRTY_KEY, batch_size)
+            if not forum_ids:
+                break
+            for raw_id in forum_ids:
+                forum_id = int(raw_id)
+                shards, deltas = ForumCounterService._read_shards([forum_id])[forum_id]
+                updates = {
+                    field: Greatest(F(field) + delta, 0)
+                    for field, delta in deltas.items()
+                    if delta
+                }
+                if not updates:
+                    continue
+                try:
+                    Forum.objects.filter(pk=forum_id).update(**updates)
+                except Exception as e:
+                    logger.error(f"贴吧计数落库失败 {forum_id}: {e}")
+                    redis.sadd(ForumCounterService.DIRTY_KEY, forum_id)
+                    continue
+                ForumCounterService._consume_shards(shards)
+                flushed += 1
+                if deltas["member_count"]:
+                    member_changed.append(forum_id)
+            if len(forum_ids) < batch_size:
+                break
+        ForumCounterService._reindex_member_counts(member_changed)
+        return flushed
+
+    @staticmethod
+    def _reindex_member_counts(forum_ids):
+        """刷新检索索引中的成员数（人气），失败只记录日志"""
+        if not forum_ids:
+            return
+        try:
+            ForumSearchService.update_member_counts(
+                dict(
+                    Forum.objects.filter(pk__in=forum_ids).values_list(
+                        "pk", "member_count"
+                    )
+                )
+            )
+        except Exception as e:
+            logger.error(f"贴吧检索索引成员数刷新失败: {e}")
+
+    @staticmethod
+    def _count_sources():
+        """计数字段 -> 计数来源（未删除的成员 / 已发布且未删除的帖子）"""
+        return {
+            "member_count": ForumMember.objects.all(),
+            "post_count": Post.objects.filter(is_deleted=False, is_draft=False),
+        }
+
+    @staticmethod
+    def recount(chunk_size=None):
+        """
+        以源表为准的集合式对账（按贴吧 ID 分块）
+          - 每块每个计数字段只执行一次 GROUP BY forum_id 聚合
+          - 数据库计数 + 分片快照与聚合结果不一致才 bulk_update，并按快照扣减分片
+          - 详情缓存逐个失效，列表缓存整轮只失效一次
+        快照与聚合之间无锁（分片写入本身无锁），存在一个很短的窗口会重复计数，
+        见下方注释；残留的偏差由下一轮对账修正
+        返回各字段被修正的行数，如 {"member_count": 3, "post_count": 0}
+        """
+        chunk_size = chunk_size or getattr(settings, "FORUM_RECOUNT_CHUNK_SIZE", 1000)
+        # 先把分片增量落库，避免对账后与分片增量重复计算
+        try:
+            ForumCounterService.reconcile()
+        except Exception as e:
+            logger.warning(f"贴吧计数分片落库失败，直接按源表对账: {e}")
+
+        sources = ForumCounterService._count_sources()
+        fields = list(sources.keys())
+        corrected = dict.fromkeys(fields, 0)
+        member_changed = []
+        last_id = 0
+        while True:
+            rows = list(
+                Forum.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", *fields)[:chunk_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            forum_ids = [row[0] for row in rows]
+
+            # 聚合前为本块贴吧的分片拍快照：增量在事务提交后才写入分片，
+            # 快照内的增量对应的行必然已提交、包含在聚合结果中，修正后按快照扣减分片。
+            # 快照之后写入的增量保留在分片中，其中绝大多数对应的行在聚合开始时尚未提交、
+            # 不在聚合结果里，保留是正确的；但若某行恰好在快照与聚合开始之间提交，
+            # 它既计入聚合结果又留在分片中，reconcile 会再加一次（多计）。
+            # 窗口只有一次 MGET 到聚合语句开始的时间，多计的差值由下一轮对账修正
+            try:
+                snapshot = ForumCounterService._read_shards(forum_ids)
+            except Exception as e:
+                logger.warning(f"贴吧计数分片读取失败，按数据库计数对账: {e}")
+                snapshot = {}
+            actual = {
+                field: dict(
+                    queryset.filter(forum_id__in=forum_ids)
+                    .order_by()
+                    .values("forum_id")
+                    .annotate(total=Count("pk"))
+                    .values_list("forum_id", "total")
+                )
+                for field, queryset in sources.items()
+            }
+
+            drifted = []
+            for forum_id, *stored in rows:
+                _, deltas = snapshot.get(forum_id, ({}, {}))
+                forum = Forum(pk=forum_id)
+                changed = False
+                for field, stored_value in zip(fields, stored):
+                    value = actual[field].get(forum_id, 0)
+                    setattr(forum, field, value)
+                    if value != stored_value + deltas.get(field, 0):
+                        corrected[field] += 1
+                        changed = True
+                        if field == "member_count":
+                            member_changed.append(forum_id)
+                if changed:
+                    drifted.append(forum)
+
+            if drifted:
+                Forum.objects.bulk_update(drifted, fields, batch_size=chunk_size)
+                for forum in drifted:
+                    shards, _ = snapshot.get(forum.pk, ({}, {}))
+                    if shards:
+                        ForumCounterService._consume_shards(shards)
+                    # bulk_update 不触发信号，手动使详情缓存失效
+                    ForumCacheService.invalidate_detail(forum.pk)
+            if len(rows) < chunk_size:
+                break
+
+        if any(corrected.values()):
+            # 列表缓存共用一个版本号，整轮对账只递增一次
+            ForumCacheService.invalidate_list()
+        ForumCounterService._reindex_member_counts(member_changed)
+        logger.info(f"贴吧计数对账完成，修正行数: {corrected}")
+        return corrected
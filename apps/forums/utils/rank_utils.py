@@ -0,0 +1,249 @@
+import logging
+import time
+from datetime import datetime
+
+from django.contrib.auth import get_user_model
+from django_redis import get_redis_connection
+
+from forums.models import ForumActivity
+
+logger = logging.getLogger("feat")
+
+UserModel = get_user_model()
+
+
+class ForumRankService:
+    """
+    贴吧排行榜（Redis 有序集合，member=user_id）
+      - forum:rank:exp:{forum_id}     score=经验值
+      - forum:rank:active:{forum_id}  score=最后活跃时间戳
+    Top-N、我的排名、分页区间均为 O(log N) 级别，不再排序 ForumActivity 全表
+    Redis 不可用时接口可改用 *_from_db 按 ForumActivity 排序降级返回
+    """
+
+    RANK_CACHE_NAME = "default"
+    EXP_BOARD = "exp"
+    ACTIVE_BOARD = "active"
+    BOARDS = (EXP_BOARD, ACTIVE_BOARD)
+    RANK_KEY = "forum:rank:{}:{}"  # board, forum_id
+
+    @staticmethod
+    def _redis():
+        return get_redis_connection(ForumRankService.RANK_CACHE_NAME)
+
+    @staticmethod
+    def _key(board, forum_id):
+        if board not in ForumRankService.BOARDS:
+            raise ValueError(f"不支持的排行榜: {board}")
+        return ForumRankService.RANK_KEY.format(board, forum_id)
+
+    @staticmethod
+    def record_sign_in(forum_id, user_id, gained_exp):
+        """签到：经验榜累加经验，活跃榜刷新时间（失败只记录日志，可通过重建命令修复）"""
+        try:
+            pipe = ForumRankService._redis().pipeline()
+            pipe.zincrby(
+                ForumRankService._key(ForumRankService.EXP_BOARD, forum_id),
+                gained_exp,
+                user_id,
+            )
+            pipe.zadd(
+                ForumRankService._key(ForumRankService.ACTIVE_BOARD, forum_id),
+                {user_id: time.time()},
+            )
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"贴吧排行榜更新失败 {forum_id}:{user_id}: {e}")
+
+    @staticmethod
+    def record_activity(forum_id, user_id, gained_exp=0):
+        """其他活跃事件（发帖、回复等）：刷新活跃时间，有经验时才累加经验榜"""
+        try:
+            pipe = ForumRankService._redis().pipeline()
+            if gained_exp:
+                pipe.zincrby(
+                    ForumRankService._key(ForumRankService.EXP_BOARD, forum_id),
+                    gained_exp,
+                    user_id,
+                )
+            pipe.zadd(
+                ForumRankService._key(ForumRankService.ACTIVE_BOARD, forum_id),
+                {user_id: time.time()},
+            )
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"贴吧排行榜更新失败 {forum_id}:{user_id}: {e}")
+
+    @staticmethod
+    def remove_member(forum_id, user_id):
+        """成员退出后从所有榜单移除"""
+        try:
+            pipe = ForumRankService._redis().pipeline()
+            for board in ForumRankService.BOARDS:
+                pipe.zrem(ForumRankService._key(board, forum_id), user_id)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"贴吧排行榜移除成员失败 {forum_id}:{user_id}: {e}")
+
+    @staticmethod
+    def top_user_ids(forum_id, board, limit=10):
+        """榜单前 limit 名的用户 ID"""
+        return [
+            int(user_id)
+            for user_id in ForumRankService._redis().zrevrange(
+                ForumRankService._key(board, forum_id), 0, limit - 1
+            )
+        ]
+
+    @staticmethod
+    def page(forum_id, board, page=1, page_size=20):
+        """
+        分页读取榜单（ZREVRANGE）
+        返回 (总人数, [{"rank", "user_id", "username", "score"}, ...])
+        """
+        key = ForumRankService._key(board, forum_id)
+        start = (page - 1) * page_size
+        pipe = ForumRankService._redis().pipeline()
+        pipe.zcard(key)
+        pipe.zrevrange(key, start, start + page_size - 1, withscores=True)
+        total, rows = pipe.execute()
+
+        user_ids = [int(user_id) for user_id, _ in rows]
+        usernames = dict(
+            UserModel.objects.filter(id__in=user_ids).values_list("id", "username")
+        )
+        return total, [
+            {
+                "rank": start + index + 1,
+                "user_id": user_id,
+                "username": usernames.get(user_id),
+                "score": int(score),
+            }
+            for index, (user_id, (_, score)) in enumerate(zip(user_ids, rows))
+        ]
+
+    @staticmethod
+    def my_rank(forum_id, board, user_id):
+        """我的排名（从 1 开始）与分数，未上榜返回 (None, 0)"""
+        key = ForumRankService._key(board, forum_id)
+        pipe = ForumRankService._redis().pipeline()
+        pipe.zrevrank(key, user_id)
+        pipe.zscore(key, user_id)
+        rank, score = pipe.execute()
+        if rank is None:
+            return None, 0
+        return rank + 1, int(score)
+
+    @staticmethod
+    def _db_order_field(board):
+        return "exp_points" if board == ForumRankService.EXP_BOARD else "last_active_at"
+
+    @staticmethod
+    def _db_score(board, exp_points, last_active_at):
+        """与榜单一致的分数：经验值 / 最后活跃日期零点的时间戳"""
+        if board == ForumRankService.EXP_BOARD:
+            return exp_points
+        return int(datetime.combine(last_active_at, datetime.min.time()).timestamp())
+
+    @staticmethod
+    def _db_rows(forum_id, board):
+        field = ForumRankService._db_order_field(board)
+        return ForumActivity.objects.filter(
+            forum_id=forum_id, forum_member__is_deleted=False
+        ).order_by(f"-{field}", "id")
+
+    @staticmethod
+    def page_from_db(forum_id, board, page=1, page_size=20):
+        """page 的数据库降级版本，返回结构相同"""
+        rows = ForumRankService._db_rows(forum_id, board)
+        start = (page - 1) * page_size
+        return rows.count(), [
+            {
+                "rank": start + index + 1,
+                "user_id": user_id,
+                "username": username,
+                "score": ForumRankService._db_score(board, exp_points, last_active_at),
+            }
+            for index, (user_id, username, exp_points, last_active_at) in enumerate(
+                rows.values_list(
+                    "forum_member__user_id",
+                    "forum_member__user__username",
+                    "exp_points",
+                    "last_active_at",
+                )[start : start + page_size]
+            )
+        ]
+
+    @staticmethod
+    def my_rank_from_db(forum_id, board, user_id):
+        """my_rank 的数据库降级版本：分数更高的人数 + 1"""
+        rows = ForumRankService._db_rows(forum_id, board)
+        mine = (
+            rows.filter(forum_member__user_id=user_id)
+            .values_list("exp_points", "last_active_at")
+            .first()
+        )
+        if mine is None:
+            return None, 0
+        field = ForumRankService._db_order_field(board)
+        value = mine[0] if field == "exp_points" else mine[1]
+        rank = rows.filter(**{f"{field}__gt": value}).count() + 1
+        return rank, ForumRankService._db_score(board, *mine)
+
+    @staticmethod
+    def rebuild(queryset, chunk_size=1000):
+        """
+        以 ForumActivity 为准全量重建排行榜，返回写入的记录数
+        先写入临时键再 RENAME 替换，重建期间榜单照常可读
+        """
+        redis = ForumRankService._redis()
+        suffix = ":rebuilding"
+        building = set()
+        count = 0
+        pipe = redis.pipeline()
+        rows = (
+            queryset.filter(forum_member__is_deleted=False)
+            .order_by()
+            .values_list(
+                "forum_id", "forum_member__user_id", "exp_points", "last_active_at"
+            )
+        )
+        for forum_id, user_id, exp_points, last_active_at in rows.iterator(
+            chunk_size=chunk_size
+        ):
+            if forum_id not in building:
+                for board in ForumRankService.BOARDS:
+                    pipe.delete(ForumRankService._key(board, forum_id) + suffix)
+                building.add(forum_id)
+            active_at = datetime.combine(last_active_at, datetime.min.time())
+            pipe.zadd(
+                ForumRankService._key(ForumRankService.EXP_BOARD, forum_id) + suffix,
+                {user_id: exp_points},
+            )
+            pipe.zadd(
+                ForumRankService._key(ForumRankService.ACTIVE_BOARD, forum_id) + suffix,
+                {user_id: active_at.timestamp()},
+            )
+            count += 1
+            if count % chunk_size == 0:
+                pipe.execute()
+        pipe.execute()
+
+        # 旧榜单中已无活跃记录的贴吧直接清空
+        for board in ForumRankService.BOARDS:
+            for key in redis.scan_iter(match=ForumRankService._key(board, "*")):
+                key = key.decode()
+                if key.endswith(suffix):
+                    continue
+                if int(key.rsplit(":", 1)[1]) not in building:
+                    redis.delete(key)
+        for forum_id in building:
+            for board in ForumRankService.BOARDS:
+                key = ForumRankService._key(board, forum_id)
+                if redis.exists(key + suffix):
+                    redis.rename(key + suffix, key)
+                else:
+                    redis.delete(key)
+
+        logger.info(f"贴吧排行榜重建完成，共 {count} 条记录")
+        return count
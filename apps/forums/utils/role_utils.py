@@ -0,0 +1,106 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from common.utils.cache_utils import CacheService
+from forums.models import ForumMember, RoleChoices
+
+logger = logging.getLogger("feat")
+
+
+class ForumRoleService:
+    """
+    用户贴吧角色表缓存
+      - forum:roles:{user_id} -> {forum_id: (member_id, role_type, is_banned)}
+      - 一次查询加载用户全部成员关系，权限判断、签到成员校验都从这里读取
+      - ForumMember 任何变更（加入/退出、改角色、封禁）由信号使对应用户的缓存失效；
+        删除贴吧时批量 update 成员不触发信号，由 Forum.delete 批量失效全部成员的缓存
+    """
+
+    ROLE_MAP_KEY = "forum:roles:{}"
+    # 请求级缓存挂在 request 上，同一请求内多次权限判断只读一次 Redis
+    REQUEST_ATTR = "_forum_role_map"
+
+    @staticmethod
+    def _expire():
+        return getattr(settings, "FORUM_ROLE_CACHE_EXPIRE_SECONDS", 3600)
+
+    @staticmethod
+    def _load(user_id):
+        return {
+            forum_id: (member_id, role_type, is_banned)
+            for member_id, forum_id, role_type, is_banned in ForumMember.objects.filter(
+                user_id=user_id
+            ).values_list("id", "forum_id", "role_type", "is_banned")
+        }
+
+    @staticmethod
+    def get_role_map(user_id, request=None):
+        """获取用户的贴吧角色表（请求内缓存 -> Redis -> 数据库）"""
+        if request is not None:
+            role_map = getattr(request, ForumRoleService.REQUEST_ATTR, None)
+            if role_map is not None:
+                return role_map
+
+        key = ForumRoleService.ROLE_MAP_KEY.format(user_id)
+        try:
+            role_map = CacheService.get_value(key)
+        except Exception as e:
+            logger.warning(f"贴吧角色缓存读取失败 {user_id}: {e}")
+            role_map = None
+        if role_map is None:
+            role_map = ForumRoleService._load(user_id)
+            try:
+                CacheService.set_value(key, role_map, exp=ForumRoleService._expire())
+            except Exception as e:
+                logger.warning(f"贴吧角色缓存写入失败 {user_id}: {e}")
+
+        if request is not None:
+            setattr(request, ForumRoleService.REQUEST_ATTR, role_map)
+        return role_map
+
+    @staticmethod
+    def get_membership(user_id, forum_id, request=None):
+        """返回 (member_id, role_type, is_banned)，非成员返回 None"""
+        return ForumRoleService.get_role_map(user_id, request).get(int(forum_id))
+
+    @staticmethod
+    def is_forum_admin(user_id, forum_id, request=None):
+        membership = ForumRoleService.get_membership(user_id, forum_id, request)
+        return bool(membership) and membership[1] in (
+            RoleChoices.ADMIN,
+            RoleChoices.OWNER,
+        )
+
+    @staticmethod
+    def invalidate(user_id):
+        try:
+            CacheService.del_value(ForumRoleService.ROLE_MAP_KEY.format(user_id))
+        except Exception as e:
+            logger.warning(f"贴吧角色缓存失效失败 {user_id}: {e}")
+
+    @staticmethod
+    def invalidate_many(user_ids, chunk_size=1000):
+        """批量失效多个用户的角色表（分批 delete_many）"""
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), chunk_size):
+            keys = [
+                ForumRoleService.ROLE_MAP_KEY.format(user_id)
+                for user_id in user_ids[start : start + chunk_size]
+            ]
+            try:
+                caches["default"].delete_many(keys)
+            except Exception as e:
+                logger.warning(f"贴吧角色缓存批量失效失败: {e}")
+
+    @staticmethod
+    def invalidate_many_on_commit(user_ids):
+        user_ids = list(user_ids)
+        transaction.on_commit(lambda: ForumRoleService.invalidate_many(user_ids))
+
+    @staticmethod
+    def invalidate_on_commit(user_id):
+        """事务提交后再失效，避免并发请求把旧角色回填进缓存"""
+        transaction.on_commit(lambda: ForumRoleService.invalidate(user_id))
@@ -0,0 +1,381 @@
+import logging
+import math
+import re
+import sqlite3
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+
+logger = logging.getLogger("feat")
+
+
+# ---------- 分词组件 ----------
+class ForumTokenizer:
+    """
+    中英文混合分词器
+      - 中文连续片段切成二元组（bigram），建索引时额外保留单字，便于单字检索
+      - 英文/数字按单词切分并转小写
+    """
+
+    CJK_PATTERN = re.compile(r"[\u4e00-\u9fff]+|[a-z0-9]+")
+
+    @staticmethod
+    def _is_cjk(segment):
+        return "\u4e00" <= segment[0] <= "\u9fff"
+
+    @staticmethod
+    def tokenize(text, for_query=False):
+        if not text:
+            return []
+        tokens = []
+        for segment in ForumTokenizer.CJK_PATTERN.findall(text.lower()):
+            if not ForumTokenizer._is_cjk(segment):
+                tokens.append(segment)
+                continue
+            if len(segment) == 1:
+                tokens.append(segment)
+                continue
+            tokens.extend(segment[i : i + 2] for i in range(len(segment) - 1))
+            if not for_query:
+                tokens.extend(segment)
+        return tokens
+
+
+# ---------- 检索后端 ----------
+class BaseForumSearchBackend:
+    """
+    检索后端基类，子类需实现:
+      - index_forum / remove_forum / clear
+      - _match: 返回 [(forum_id, relevance, member_count), ...]
+      - suggest
+    """
+
+    # 吧名命中的权重高于简介
+    NAME_WEIGHT = 3
+    DESCRIPTION_WEIGHT = 1
+
+    @staticmethod
+    def weighted_tokens(name, description):
+        counter = Counter()
+        for token in ForumTokenizer.tokenize(name):
+            counter[token] += BaseForumSearchBackend.NAME_WEIGHT
+        for token in ForumTokenizer.tokenize(description):
+            counter[token] += BaseForumSearchBackend.DESCRIPTION_WEIGHT
+        return counter
+
+    @staticmethod
+    def score(relevance, member_count):
+        """相关度 × 人气（成员数取对数，避免大吧完全压制相关度）"""
+        return relevance * math.log2(2 + (member_count or 0))
+
+    def search(self, query, limit):
+        """返回按 相关度 × 人气 排序后的贴吧 ID 列表"""
+        tokens = sorted(set(ForumTokenizer.tokenize(query, for_query=True)))
+        if not tokens:
+            return []
+        matches = self._match(tokens, limit)
+        matches.sort(key=lambda m: self.score(m[1], m[2]), reverse=True)
+        return [forum_id for forum_id, _, _ in matches[:limit]]
+
+    def index_forum(self, forum_id, name, description, member_count):
+        raise NotImplementedError
+
+    def update_member_counts(self, member_counts):
+        """只更新人气值 {forum_id: member_count}，不重新分词"""
+        raise NotImplementedError
+
+    def remove_forum(self, forum_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def suggest(self, prefix, limit):
+        raise NotImplementedError
+
+    def _match(self, tokens, limit):
+        raise NotImplementedError
+
+
+class RedisForumSearchBackend(BaseForumSearchBackend):
+    """
+    基于 Redis 的倒排索引
+      - forum:search:token:{token}  ZSET  forum_id -> 词项权重
+      - forum:search:doc:{id}       SET   该贴吧已建索引的词项（增量更新时用于清理）
+      - forum:search:popularity     HASH  forum_id -> member_count
+      - forum:search:name           HASH  forum_id -> 吧名
+      - forum:search:suggest        ZSET  "吧名小写\\0forum_id"，按字典序做前缀联想
+    """
+
+    TOKEN_KEY = "forum:search:token:{}"
+    DOC_KEY = "forum:search:doc:{}"
+    POPULARITY_KEY = "forum:search:popularity"
+    NAME_KEY = "forum:search:name"
+    SUGGEST_KEY = "forum:search:suggest"
+    # 多词求交集时候选集的上限
+    MAX_CANDIDATES = 1000
+
+    def __init__(self, alias="default"):
+        self.alias = alias
+
+    @property
+    def redis(self):
+        return get_redis_connection(self.alias)
+
+    @staticmethod
+    def _decode(value):
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    @staticmethod
+    def _suggest_member(name, forum_id):
+        return f"{name.lower()}\0{forum_id}"
+
+    def index_forum(self, forum_id, name, description, member_count):
+        redis = self.redis
+        doc_key = self.DOC_KEY.format(forum_id)
+        new_tokens = self.weighted_tokens(name, description)
+        old_tokens = {self._decode(t) for t in redis.smembers(doc_key)}
+        old_name = self._decode(redis.hget(self.NAME_KEY, forum_id))
+
+        pipe = redis.pipeline()
+        for token in old_tokens - set(new_tokens):
+            pipe.zrem(self.TOKEN_KEY.format(token), forum_id)
+        for token, weight in new_tokens.items():
+            pipe.zadd(self.TOKEN_KEY.format(token), {forum_id: weight})
+        pipe.delete(doc_key)
+        if new_tokens:
+            pipe.sadd(doc_key, *new_tokens.keys())
+        pipe.hset(self.POPULARITY_KEY, forum_id, member_count or 0)
+        if old_name:
+            pipe.zrem(self.SUGGEST_KEY, self._suggest_member(old_name, forum_id))
+        pipe.hset(self.NAME_KEY, forum_id, name)
+        pipe.zadd(self.SUGGEST_KEY, {self._suggest_member(name, forum_id): 0})
+        pipe.execute()
+
+    def update_member_counts(self, member_counts):
+        if member_counts:
+            self.redis.hset(
+                self.POPULARITY_KEY,
+                mapping={k: v or 0 for k, v in member_counts.items()},
+            )
+
+    def remove_forum(self, forum_id):
+        redis = self.redis
+        doc_key = self.DOC_KEY.format(forum_id)
+        tokens = {self._decode(t) for t in redis.smembers(doc_key)}
+        old_name = self._decode(redis.hget(self.NAME_KEY, forum_id))
+
+        pipe = redis.pipeline()
+        for token in tokens:
+            pipe.zrem(self.TOKEN_KEY.format(token), forum_id)
+        pipe.delete(doc_key)
+        pipe.hdel(self.POPULARITY_KEY, forum_id)
+        pipe.hdel(self.NAME_KEY, forum_id)
+        if old_name:
+            pipe.zrem(self.SUGGEST_KEY, self._suggest_member(old_name, forum_id))
+        pipe.execute()
+
+    def clear(self):
+        redis = self.redis
+        keys = list(redis.scan_iter(match="forum:search:*", count=1000))
+        if keys:
+            redis.delete(*keys)
+
+    def _match(self, tokens, limit):
+        redis = self.redis
+        keys = [self.TOKEN_KEY.format(t) for t in tokens]
+        if len(keys) == 1:
+            rows = redis.zrevrange(keys[0], 0, self.MAX_CANDIDATES - 1, withscores=True)
+        else:
+            # 所有词项都命中才算匹配（AND 语义），临时结果集用完即删
+            tmp_key = f"forum:search:tmp:{uuid.uuid4().hex}"
+            pipe = redis.pipeline()
+            pipe.zinterstore(tmp_key, keys, aggregate="SUM")
+            pipe.zrevrange(tmp_key, 0, self.MAX_CANDIDATES - 1, withscores=True)
+            pipe.delete(tmp_key)
+            rows = pipe.execute()[1]
+        if not rows:
+            return []
+
+        forum_ids = [int(member) for member, _ in rows]
+        counts = redis.hmget(self.POPULARITY_KEY, forum_ids)
+        return [
+            (forum_id, relevance, int(count or 0))
+            for (forum_id, (_, relevance), count) in zip(forum_ids, rows, counts)
+        ]
+
+    def suggest(self, prefix, limit):
+        prefix = (prefix or "").strip().lower()
+        if not prefix:
+            return []
+        # 上界用原始字节 0xff，保证覆盖所有以 prefix 开头的 UTF-8 字符串
+        raw_prefix = prefix.encode("utf-8")
+        members = self.redis.zrangebylex(
+            self.SUGGEST_KEY,
+            b"[" + raw_prefix,
+            b"[" + raw_prefix + b"\xff",
+            start=0,
+            num=limit,
+        )
+        results = []
+        for member in members:
+            _, forum_id = self._decode(member).rsplit("\0", 1)
+            results.append(int(forum_id))
+        names = self.redis.hmget(self.NAME_KEY, results) if results else []
+        return [
+            {"id": forum_id, "name": self._decode(name)}
+            for forum_id, name in zip(results, names)
+            if name is not None
+        ]
+
+
+class SQLiteFTSForumSearchBackend(BaseForumSearchBackend):
+    """
+    基于 SQLite FTS5 的本地检索后端（测试/开发环境使用，无需 Redis）
+    预先用 ForumTokenizer 分好词，以空格拼接后交给 FTS5 建索引
+    """
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, "FORUM_SEARCH_SQLITE_PATH", ":memory:")
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS forum_fts "
+                "USING fts5(forum_id UNINDEXED, name, description)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS forum_meta ("
+                "forum_id INTEGER PRIMARY KEY, name TEXT, member_count INTEGER)"
+            )
+
+    @staticmethod
+    def _joined_tokens(text):
+        return " ".join(ForumTokenizer.tokenize(text))
+
+    def index_forum(self, forum_id, name, description, member_count):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM forum_fts WHERE forum_id = ?", (forum_id,))
+            self.conn.execute(
+                "INSERT INTO forum_fts (forum_id, name, description) VALUES (?, ?, ?)",
+                (forum_id, self._joined_tokens(name), self._joined_tokens(description)),
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO forum_meta (forum_id, name, member_count) "
+                "VALUES (?, ?, ?)",
+                (forum_id, name, member_count or 0),
+            )
+
+    def update_member_counts(self, member_counts):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE forum_meta SET member_count = ? WHERE forum_id = ?",
+                [(count or 0, forum_id) for forum_id, count in member_counts.items()],
+            )
+
+    def remove_forum(self, forum_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM forum_fts WHERE forum_id = ?", (forum_id,))
+            self.conn.execute("DELETE FROM forum_meta WHERE forum_id = ?", (forum_id,))
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM forum_fts")
+            self.conn.execute("DELETE FROM forum_meta")
+
+    def _match(self, tokens, limit):
+        expr = " AND ".join('"{}"'.format(t.replace('"', '""')) for t in tokens)
+        with self.lock:
+            rows = self.conn.execute(
+                # bm25 越小越相关，取负数作为相关度；列权重与 Redis 后端保持一致
+                "SELECT f.forum_id, -bm25(forum_fts, 0, ?, ?), m.member_count "
+                "FROM forum_fts f JOIN forum_meta m ON m.forum_id = f.forum_id "
+                "WHERE forum_fts MATCH ?",
+                (self.NAME_WEIGHT, self.DESCRIPTION_WEIGHT, expr),
+            ).fetchall()
+        return [(int(forum_id), score, count) for forum_id, score, count in rows]
+
+    def suggest(self, prefix, limit):
+        prefix = (prefix or "").strip().lower()
+        if not prefix:
+            return []
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT forum_id, name FROM forum_meta "
+                "WHERE lower(name) LIKE ? ESCAPE '\\' ORDER BY lower(name) LIMIT ?",
+                (f"{escaped}%", limit),
+            ).fetchall()
+        return [{"id": forum_id, "name": name} for forum_id, name in rows]
+
+
+# ---------- 检索服务封装 ----------
+class ForumSearchService:
+    """贴吧检索服务（后端由 FORUM_SEARCH_BACKEND 配置，进程内单例）"""
+
+    _backend = None
+    _backend_path = None
+
+    @staticmethod
+    def get_backend():
+        path = getattr(
+            settings,
+            "FORUM_SEARCH_BACKEND",
+            "forums.utils.search_utils.RedisForumSearchBackend",
+        )
+        if (
+            ForumSearchService._backend is None
+            or ForumSearchService._backend_path != path
+        ):
+            ForumSearchService._backend = import_string(path)()
+            ForumSearchService._backend_path = path
+        return ForumSearchService._backend
+
+    @staticmethod
+    def index_forum(forum):
+        """增量更新单个贴吧的索引，软删除的贴吧直接移出索引"""
+        backend = ForumSearchService.get_backend()
+        if forum.is_deleted:
+            backend.remove_forum(forum.pk)
+        else:
+            backend.index_forum(
+                forum.pk, forum.name, forum.description, forum.member_count
+            )
+
+    @staticmethod
+    def remove_forum(forum_id):
+        ForumSearchService.get_backend().remove_forum(forum_id)
+
+    @staticmethod
+    def update_member_counts(member_counts):
+        """批量刷新成员数（计数落库、对账等不触发信号的写入后调用）"""
+        ForumSearchService.get_backend().update_member_counts(member_counts)
+
+    @staticmethod
+    def search(query, limit=None):
+        limit = limit or getattr(settings, "FORUM_SEARCH_MAX_RESULTS", 200)
+        return ForumSearchService.get_backend().search(query, limit)
+
+    @staticmethod
+    def suggest(prefix, limit=10):
+        return ForumSearchService.get_backend().suggest(prefix, limit)
+
+    @staticmethod
+    def rebuild(queryset, chunk_size=500):
+        """全量重建索引，返回建索引的贴吧数量"""
+        backend = ForumSearchService.get_backend()
+        backend.clear()
+        count = 0
+        for forum in queryset.only(
+            "id", "name", "description", "member_count"
+        ).iterator(chunk_size=chunk_size):
+            backend.index_forum(
+                forum.pk, forum.name, forum.description, forum.member_count
+            )
+            count += 1
+        logger.info(f"贴吧检索索引重建完成，共 {count} 个贴吧")
+        return count
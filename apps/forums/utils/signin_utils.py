@@ -0,0 +1,425 @@
+import calendar
+import json
+import logging
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils.timezone import localdate
+from django_redis import get_redis_connection
+
+from common.utils.lock_utils import RedisLockService
+from forums.models import ForumActivity, ForumMember
+from forums.utils.rank_utils import ForumRankService
+from forums.utils.role_utils import ForumRoleService
+
+logger = logging.getLogger("feat")
+
+
+# 原子签到脚本：分配位图槽位 -> 当天位图置位 -> 计算连签 -> 记录月历 -> 累加待落库经验
+# KEYS: 今日位图, 昨日位图, 连签哈希, 月历位图, 待落库经验哈希, 待落库日期哈希, 槽位哈希
+# ARGV: user_id, 当月第几天(0起), "forum_id:user_id", 今日日期, 日位图TTL, 月历TTL,
+#       数据库连签天数, 数据库签到状态(0 断签 / 1 昨日已签 / 2 今日已签)
+# 返回: {是否本次签到, 连签天数, 获得经验, 待落库经验}
+SIGN_IN_SCRIPT = """
+local slot = redis.call('HGET', KEYS[7], ARGV[1])
+if not slot then
+    slot = redis.call('HINCRBY', KEYS[7], '#next', 1) - 1
+    redis.call('HSET', KEYS[7], ARGV[1], slot)
+end
+local prev = redis.call('HGET', KEYS[3], ARGV[1])
+if not prev and ARGV[8] == '2' then
+    -- Redis 无记录（如上线后首次签到）但数据库显示今日已签到
+    prev = ARGV[7]
+    redis.call('HSET', KEYS[3], ARGV[1], prev)
+    redis.call('SETBIT', KEYS[1], slot, 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+end
+if redis.call('SETBIT', KEYS[1], slot, 1) == 1 then
+    local pending = redis.call('HGET', KEYS[5], ARGV[3])
+    return {0, tonumber(prev or 0), 0, tonumber(pending or 0)}
+end
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+local streak = 1
+if prev then
+    if redis.call('GETBIT', KEYS[2], slot) == 1 then
+        streak = tonumber(prev) + 1
+    end
+elseif ARGV[8] == '1' then
+    -- 连签记录不在 Redis 中时沿用数据库中的连签天数
+    streak = tonumber(ARGV[7]) + 1
+end
+redis.call('HSET', KEYS[3], ARGV[1], streak)
+redis.call('SETBIT', KEYS[4], ARGV[2], 1)
+redis.call('EXPIRE', KEYS[4], ARGV[6])
+local exp = math.max(30, 10 + math.max(0, streak - 1))
+local pending = redis.call('HINCRBY', KEYS[5], ARGV[3], exp)
+redis.call('HSET', KEYS[6], ARGV[3], ARGV[4])
+return {1, streak, exp, pending}
+"""
+
+
+class ForumSignInService:
+    """
+    贴吧签到引擎（Redis 位图）
+      - forum:signin:slot:{forum_id}                   HASH    user_id -> 吧内位图槽位
+      - forum:signin:day:{forum_id}:{yyyymmdd}        BITMAP  offset=槽位，当天是否签到
+      - forum:signin:cal:{forum_id}:{user_id}:{yyyymm} BITMAP  offset=日-1，个人月历
+      - forum:signin:streak:{forum_id}                 HASH    user_id -> 连签天数
+      - forum:signin:pending:exp / pending:date        HASH    "forum_id:user_id" -> 待落库经验/日期
+      - forum:signin:seed:{member_id}                  STRING  已落库的活跃度（JSON），用作连签兜底与返回值
+    签到热路径不查库：活跃度种子只在 Redis 未命中时读一次 ForumActivity 并回填，
+    定时任务批量落库经验、等级后同步刷新种子
+    日位图按吧内槽位而不是 user_id 置位，位图大小只与该吧签到过的人数有关
+    """
+
+    SIGNIN_CACHE_NAME = "default"
+    SLOT_KEY = "forum:signin:slot:{}"
+    DAY_KEY = "forum:signin:day:{}:{}"
+    CALENDAR_KEY = "forum:signin:cal:{}:{}:{}"
+    STREAK_KEY = "forum:signin:streak:{}"
+    PENDING_EXP_KEY = "forum:signin:pending:exp"
+    PENDING_DATE_KEY = "forum:signin:pending:date"
+    FLUSH_LOCK_KEY = "forum:signin:flush:lock"
+    SEED_KEY = "forum:signin:seed:{}"  # member_id
+    # 日位图只用于今日统计和判断昨日是否签到，保留 3 天足够
+    DAY_KEY_TTL = 3 * 24 * 3600
+    CALENDAR_KEY_TTL = 400 * 24 * 3600
+    SEED_KEY_TTL = 7 * 24 * 3600
+
+    _script = None
+
+    @staticmethod
+    def _redis():
+        return get_redis_connection(ForumSignInService.SIGNIN_CACHE_NAME)
+
+    @staticmethod
+    def _sign_in_script():
+        if ForumSignInService._script is None:
+            ForumSignInService._script = ForumSignInService._redis().register_script(
+                SIGN_IN_SCRIPT
+            )
+        return ForumSignInService._script
+
+    @staticmethod
+    def get_member_id(forum_id, user_id, request=None):
+        """查询吧成员 ID（读取用户贴吧角色表缓存），非成员返回 0"""
+        membership = ForumRoleService.get_membership(user_id, forum_id, request)
+        return membership[0] if membership else 0
+
+    @staticmethod
+    def _seed(activity, username):
+        return {
+            "id": activity.pk,
+            "exp": activity.exp_points,
+            "streak": activity.sign_in_streak,
+            "last": (
+                activity.last_active_at.isoformat() if activity.last_active_at else None
+            ),
+            "name": username,
+        }
+
+    @staticmethod
+    def _seed_from_db(member_id):
+        activity = (
+            ForumActivity.all_objects.select_related("forum_member__user")
+            .filter(forum_member_id=member_id)
+            .first()
+        )
+        if activity is None:
+            member = ForumMember.objects.select_related("user").get(pk=member_id)
+            return {
+                "id": None,
+                "exp": 0,
+                "streak": 0,
+                "last": None,
+                "name": member.user.username,
+            }
+        return ForumSignInService._seed(activity, activity.forum_member.user.username)
+
+    @staticmethod
+    def _load_activity(forum_id, user_id, member_id):
+        """
+        读取成员活跃度：优先读 Redis 种子，未命中才查库并回填
+        返回未保存的 ForumActivity（关联对象已就位，序列化时不再查库）
+        """
+        redis = ForumSignInService._redis()
+        key = ForumSignInService.SEED_KEY.format(member_id)
+        raw = redis.get(key)
+        if raw:
+            seed = json.loads(raw)
+        else:
+            seed = ForumSignInService._seed_from_db(member_id)
+            redis.set(key, json.dumps(seed), ex=ForumSignInService.SEED_KEY_TTL)
+
+        member = ForumMember(
+            pk=member_id,
+            forum_id=forum_id,
+            user=get_user_model()(pk=user_id, username=seed["name"]),
+        )
+        return ForumActivity(
+            pk=seed["id"],
+            forum_id=forum_id,
+            forum_member=member,
+            exp_points=seed["exp"],
+            level=1 + seed["exp"] // 100,
+            sign_in_streak=seed["streak"],
+            last_active_at=date.fromisoformat(seed["last"]) if seed["last"] else None,
+        )
+
+    @staticmethod
+    def _db_state(activity, today):
+        """数据库中的签到状态：0 断签 / 1 昨日已签 / 2 今日已签"""
+        if not activity.pk or not activity.sign_in_streak:
+            return 0
+        if activity.last_active_at == today:
+            return 2
+        if activity.last_active_at == today - timedelta(days=1):
+            return 1
+        return 0
+
+    @staticmethod
+    def sign_in(forum_id, user_id, member_id=None, today=None):
+        """
+        签到
+        返回 (是否本次签到成功, 连签天数, 获得经验, 活跃度)；今日已签到时签到成功为 False、经验为 0
+        活跃度为合并了待落库经验的 ForumActivity（未保存），供接口直接序列化返回
+        """
+        today = today or localdate()
+        yesterday = today - timedelta(days=1)
+        member_id = member_id or ForumSignInService.get_member_id(forum_id, user_id)
+        activity = ForumSignInService._load_activity(forum_id, user_id, member_id)
+        keys = [
+            ForumSignInService.DAY_KEY.format(forum_id, today.strftime("%Y%m%d")),
+            ForumSignInService.DAY_KEY.format(forum_id, yesterday.strftime("%Y%m%d")),
+            ForumSignInService.STREAK_KEY.format(forum_id),
+            ForumSignInService.CALENDAR_KEY.format(
+                forum_id, user_id, today.strftime("%Y%m")
+            ),
+            ForumSignInService.PENDING_EXP_KEY,
+            ForumSignInService.PENDING_DATE_KEY,
+            ForumSignInService.SLOT_KEY.format(forum_id),
+        ]
+        args = [
+            user_id,
+            today.day - 1,
+            f"{forum_id}:{user_id}",
+            today.isoformat(),
+            ForumSignInService.DAY_KEY_TTL,
+            ForumSignInService.CALENDAR_KEY_TTL,
+            activity.sign_in_streak,
+            ForumSignInService._db_state(activity, today),
+        ]
+        signed, streak, gained_exp, pending_exp = ForumSignInService._sign_in_script()(
+            keys=keys, args=args
+        )
+        if signed:
+            ForumRankService.record_sign_in(forum_id, user_id, gained_exp)
+
+        activity.exp_points += int(pending_exp)
+        activity.level = 1 + activity.exp_points // 100
+        activity.sign_in_streak = int(streak)
+        activity.last_active_at = today
+        return bool(signed), int(streak), int(gained_exp), activity
+
+    @staticmethod
+    def count_today(forum_id, today=None):
+        """今日签到人数（BITCOUNT）"""
+        today = today or localdate()
+        return ForumSignInService._redis().bitcount(
+            ForumSignInService.DAY_KEY.format(forum_id, today.strftime("%Y%m%d"))
+        )
+
+    @staticmethod
+    def month_calendar(forum_id, user_id, year, month):
+        """个人月签到日历，返回已签到的日期（几号）列表"""
+        raw = ForumSignInService._redis().get(
+            ForumSignInService.CALENDAR_KEY.format(
+                forum_id, user_id, f"{year:04d}{month:02d}"
+            )
+        )
+        if not raw:
+            return []
+        days = calendar.monthrange(year, month)[1]
+        # Redis 位图按字节高位在前存储
+        return [
+            day
+            for day in range(1, days + 1)
+            if (day - 1) // 8 < len(raw)
+            and raw[(day - 1) // 8] & (0x80 >> ((day - 1) % 8))
+        ]
+
+    @staticmethod
+    def count_today_from_db(forum_id, today=None):
+        """
+        Redis 不可用时的降级统计：已落库的今日活跃记录数
+        未落库的签到不计入，发帖等活跃也会被计入，只是近似值
+        """
+        today = today or localdate()
+        return ForumActivity.objects.filter(
+            forum_id=forum_id, last_active_at=today, sign_in_streak__gt=0
+        ).count()
+
+    @staticmethod
+    def month_calendar_from_db(forum_id, user_id, year, month):
+        """Redis 不可用时的降级日历：按已落库的连签天数从最后签到日倒推，更早的断签记录无法还原"""
+        activity = (
+            ForumActivity.objects.filter(
+                forum_id=forum_id, forum_member__user_id=user_id
+            )
+            .values_list("last_active_at", "sign_in_streak")
+            .first()
+        )
+        if not activity or not activity[0]:
+            return []
+        last_date, streak = activity
+        signed = (last_date - timedelta(days=offset) for offset in range(streak))
+        return sorted(
+            day.day for day in signed if (day.year, day.month) == (year, month)
+        )
+
+    @staticmethod
+    def _take_pending():
+        """
+        取出待落库数据：RENAME 到 flushing 键后再读取，新签到继续写入原键
+        上次落库中途失败遗留的 flushing 键会被优先处理
+        """
+        redis = ForumSignInService._redis()
+        exp_key = ForumSignInService.PENDING_EXP_KEY
+        date_key = ForumSignInService.PENDING_DATE_KEY
+        flushing_exp = f"{exp_key}:flushing"
+        flushing_date = f"{date_key}:flushing"
+
+        if not redis.exists(flushing_exp) and redis.exists(exp_key):
+            pipe = redis.pipeline(transaction=True)
+            pipe.rename(exp_key, flushing_exp)
+            pipe.rename(date_key, flushing_date)
+            pipe.execute()
+
+        exps = redis.hgetall(flushing_exp)
+        dates = redis.hgetall(flushing_date)
+        return flushing_exp, flushing_date, exps, dates
+
+    @staticmethod
+    def flush(batch_size=None):
+        """
+        将待落库的签到经验批量写入 ForumActivity
+        返回落库的记录数
+        持锁执行：两次任务重叠时若同时读取同一个 flushing 哈希，经验会被重复累加
+        """
+        redis = ForumSignInService._redis()
+        token = RedisLockService.acquire(
+            redis,
+            ForumSignInService.FLUSH_LOCK_KEY,
+            getattr(settings, "FORUM_SIGNIN_FLUSH_LOCK_SECONDS", 300),
+        )
+        if token is None:
+            logger.info("签到经验落库正在进行，跳过本次")
+            return 0
+        try:
+            return ForumSignInService._flush_pending(redis, batch_size)
+        finally:
+            RedisLockService.release(redis, ForumSignInService.FLUSH_LOCK_KEY, token)
+
+    @staticmethod
+    def _flush_pending(redis, batch_size=None):
+        batch_size = batch_size or getattr(settings, "FORUM_SIGNIN_FLUSH_BATCH", 500)
+        flushing_exp, flushing_date, exps, dates = ForumSignInService._take_pending()
+        if not exps:
+            return 0
+
+        fields = list(exps.keys())
+        flushed = 0
+        for start in range(0, len(fields), batch_size):
+            batch = fields[start : start + batch_size]
+            pending = {}
+            for field in batch:
+                forum_id, user_id = map(int, field.decode().split(":"))
+                pending[(forum_id, user_id)] = (
+                    int(exps[field]),
+                    dates.get(field, b"").decode() or localdate().isoformat(),
+                )
+            flushed += ForumSignInService._flush_batch(pending)
+            # 本批已提交，立即移除，避免失败重试时重复累加
+            pipe = redis.pipeline()
+            pipe.hdel(flushing_exp, *batch)
+            pipe.hdel(flushing_date, *batch)
+            pipe.execute()
+
+        redis.delete(flushing_exp, flushing_date)
+        logger.info(f"签到经验落库完成，共 {flushed} 条")
+        return flushed
+
+    @staticmethod
+    def _flush_batch(pending):
+        """pending: {(forum_id, user_id): (待加经验, 最后签到日期)}"""
+        redis = ForumSignInService._redis()
+        forum_ids = {forum_id for forum_id, _ in pending}
+        user_ids = {user_id for _, user_id in pending}
+        members, usernames = {}, {}
+        for member_id, forum_id, user_id, username in ForumMember.objects.filter(
+            forum_id__in=forum_ids, user_id__in=user_ids
+        ).values_list("id", "forum_id", "user_id", "user__username"):
+            if (forum_id, user_id) in pending:
+                members[(forum_id, user_id)] = member_id
+                usernames[member_id] = username
+        if not members:
+            return 0
+
+        pipe = redis.pipeline()
+        for forum_id, user_id in members:
+            pipe.hget(ForumSignInService.STREAK_KEY.format(forum_id), user_id)
+        streaks = dict(zip(members.keys(), pipe.execute()))
+
+        with transaction.atomic():
+            activities = {
+                activity.forum_member_id: activity
+                for activity in ForumActivity.all_objects.select_for_update().filter(
+                    forum_member_id__in=members.values()
+                )
+            }
+            to_create, to_update = [], []
+            for (forum_id, user_id), member_id in members.items():
+                gained_exp, last_date = pending[(forum_id, user_id)]
+                activity = activities.get(member_id)
+                if activity is None:
+                    activity = ForumActivity(
+                        forum_id=forum_id, forum_member_id=member_id
+                    )
+                    to_create.append(activity)
+                else:
+                    to_update.append(activity)
+                activity.is_deleted = False
+                activity.deleted_at = None
+                activity.exp_points += gained_exp
+                activity.level = 1 + activity.exp_points // 100
+                activity.sign_in_streak = int(streaks[(forum_id, user_id)] or 1)
+                activity.last_active_at = date.fromisoformat(last_date)
+
+            ForumActivity.all_objects.bulk_create(to_create)
+            ForumActivity.all_objects.bulk_update(
+                to_update,
+                [
+                    "is_deleted",
+                    "deleted_at",
+                    "exp_points",
+                    "level",
+                    "sign_in_streak",
+                    "last_active_at",
+                ],
+            )
+
+        # 刷新签到热路径读取的种子；批量插入拿不到主键时（MySQL）删除，下次签到回源
+        pipe = redis.pipeline()
+        for activity in to_create + to_update:
+            key = ForumSignInService.SEED_KEY.format(activity.forum_member_id)
+            if activity.pk:
+                seed = ForumSignInService._seed(
+                    activity, usernames[activity.forum_member_id]
+                )
+                pipe.set(key, json.dumps(seed), ex=ForumSignInService.SEED_KEY_TTL)
+            else:
+                pipe.delete(key)
+        pipe.execute()
+        return len(to_create) + len(to_update)
@@ -1,8 +1,8 @@
 import logging
 import time
 
-from django.db import transaction
-from django.db.models import F
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Prefetch, Value, When
 from django.http import Http404
 from django.utils import timezone
 from django.utils.timezone import localdate
@@ -15,11 +15,18 @@ from rest_framework.response import Response
 from rest_framework.generics import UpdateAPIView, get_object_or_404
 from rest_framework.viewsets import ModelViewSet, GenericViewSet, ReadOnlyModelViewSet
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from common.pagination import KeysetPagination
 from common.permissions import IsForumAdmin, RBACPermission
 from .tasks import toggle_forum_membership_task
+from .utils.cache_utils import ForumCacheService
+from .utils.counter_utils import ForumCounterService
+from .utils.rank_utils import ForumRankService
+from .utils.search_utils import ForumSearchService
+from .utils.signin_utils import ForumSignInService
 from .models import (
     Forum,
     ForumCategory,
+    ForumCategoryMap,
     ForumMember,
     RoleChoices,
     ForumRelation,
@@ -109,15 +116,72 @@ class ForumViewSet(ModelViewSet):
 
     def get_queryset(self):
         """支持搜索和分类过滤"""
-        queryset = self.queryset.filter(is_deleted=False)
+        queryset = self.queryset.filter(is_deleted=False).prefetch_related(
+            # 一次性预取分类名，供 Forum.category_names 使用
+            Prefetch(
+                "categories",
+                queryset=ForumCategoryMap.objects.select_related("category").only(
+                    "id", "forum_id", "category__name"
+                ),
+                to_attr="prefetched_category_maps",
+            )
+        )
         name = self.request.query_params.get("search")
         category = self.request.query_params.get("category")
-        if name:
-            queryset = queryset.filter(name__icontains=name)
         if category:
             queryset = queryset.filter(categories__category__id=category)
+        if name:
+            queryset = self.search_queryset(queryset, name)
         return queryset
 
+    @staticmethod
+    def search_queryset(queryset, keyword):
+        """按检索索引过滤，并保持 相关度 × 人气 的排序"""
+        try:
+            forum_ids = ForumSearchService.search(keyword)
+        except Exception as e:
+            # 索引不可用时降级为模糊匹配，保证搜索可用
+            logger.warning(f"贴吧检索索引不可用，降级为模糊查询: {e}")
+            return queryset.filter(name__icontains=keyword)
+        if not forum_ids:
+            return queryset.none()
+        ranking = Case(*[When(pk=pk, then=pos) for pos, pk in enumerate(forum_ids)])
+        return queryset.filter(pk__in=forum_ids).order_by(ranking)
+
+    def list(self, request, *args, **kwargs):
+        """贴吧列表（按查询参数读穿透缓存）"""
+        key = ForumCacheService.list_key(request.query_params)
+        data = ForumCacheService.get_or_set(
+            key,
+            lambda: super(ForumViewSet, self).list(request, *args, **kwargs).data,
+            metric="forum_cache.list",
+        )
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        """贴吧详情（按贴吧读穿透缓存）"""
+        key = ForumCacheService.detail_key(kwargs.get(self.lookup_field))
+        data = ForumCacheService.get_or_set(
+            key,
+            lambda: super(ForumViewSet, self).retrieve(request, *args, **kwargs).data,
+            metric="forum_cache.detail",
+        )
+        return Response(data)
+
+    @action(detail=False, methods=["get"], url_path="suggest")
+    def suggest(self, request, *args, **kwargs):
+        """吧名前缀联想"""
+        prefix = request.query_params.get("q", "").strip()
+        if not prefix:
+            return Response([], status=status.HTTP_200_OK)
+        try:
+            suggestions = ForumSearchService.suggest(prefix)
+        except Exception as e:
+            logger.warning(f"贴吧联想查询失败: {e}")
+            queryset = Forum.objects.filter(name__istartswith=prefix)
+            suggestions = list(queryset.values("id", "name")[:10])
+        return Response(suggestions, status=status.HTTP_200_OK)
+
     # @action(detail=False, methods=["post"], url_path="toggle")
     # def join_toggle(self, request, forum_pk=None):
     #     forum = get_object_or_404(Forum, pk=forum_pk)
@@ -146,27 +210,32 @@ class ForumViewSet(ModelViewSet):
     @action(detail=True, methods=["post"], url_path="toggle")
     def join_toggle(self, request, pk=None):
         user = request.user
+        forum = get_object_or_404(Forum.objects.only("id", "member_count"), pk=pk)
         with transaction.atomic():
-            # 锁住论坛行，确保 member_count 的加减是原子且串行的
-            forum = (
-                Forum.objects.select_for_update().only("id", "member_count").get(pk=pk)
+            # 只锁当前用户的成员行；member_count 改由分片计数累加，不再锁论坛行
+            member = (
+                ForumMember.all_objects.select_for_update()
+                .filter(forum=forum, user_id=user.id)
+                .first()
             )
 
-            # 查找包含软删除的记录；必要时也可以 .select_for_update() 锁住这一行
-            member = ForumMember.all_objects.filter(
-                forum=forum, user_id=user.id
-            ).first()
-
             if not member:
-                # 新加入
-                ForumMember.objects.create(
-                    forum=forum,
-                    user_id=user.id,
-                    role_type=RoleChoices.MEMBER,
-                )
-                Forum.objects.filter(pk=forum.pk).update(
-                    member_count=F("member_count") + 1
-                )
+                # 新加入：成员行不存在时行锁锁不住任何东西，并发的首次加入
+                # 会在唯一约束上冲突，冲突时回滚保存点并以已提交的成员行为准
+                try:
+                    with transaction.atomic():
+                        ForumMember.objects.create(
+                            forum=forum,
+                            user_id=user.id,
+                            role_type=RoleChoices.MEMBER,
+                        )
+                    delta = 1
+                except IntegrityError:
+                    ForumMember.all_objects.select_for_update().get(
+                        forum=forum, user_id=user.id
+                    )
+                    # 并发请求已完成加入并计数，本次不重复计数
+                    delta = 0
                 action = "joined"
 
             elif member.is_deleted:
@@ -175,9 +244,7 @@ class ForumViewSet(ModelViewSet):
                 member.deleted_at = None
                 member.joined_at = timezone.now()
                 member.save(update_fields=["is_deleted", "deleted_at", "joined_at"])
-                Forum.objects.filter(pk=forum.pk).update(
-                    member_count=F("member_count") + 1
-                )
+                delta = 1
                 action = "rejoined"
 
             else:
@@ -185,20 +252,19 @@ class ForumViewSet(ModelViewSet):
                 member.is_deleted = True
                 member.deleted_at = timezone.now()
                 member.save(update_fields=["is_deleted", "deleted_at"])
-                Forum.objects.filter(pk=forum.pk).update(
-                    member_count=F("member_count") - 1
-                )
+                delta = -1
                 action = "left"
 
-            # 读回最新计数（F() 只在数据库里生效，reload 一下内存值）
-            forum.refresh_from_db(fields=["member_count"])
+            # 成员关系提交后再累加分片计数，事务回滚则不计数
+            if delta:
+                ForumCounterService.incr_on_commit(forum.pk, "member_count", delta)
 
         return Response(
             {
                 "status": "success",
                 "action": action,
                 "forum": forum.id,
-                "member_count": forum.member_count,
+                "member_count": ForumCounterService.merged_value(forum, "member_count"),
             },
             status=status.HTTP_200_OK,
         )
@@ -260,15 +326,50 @@ class ForumMemberReadOnlyViewSet(ReadOnlyModelViewSet):
 
     serializer_class = ForumMemberReadOnlySerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
-    filterset_fields = ["forum"]
+    filterset_fields = ["forum", "role_type"]
     search_fields = ["user__username"]
 
+    # 吧主 -> 管理员 -> 普通成员
+    ROLE_RANK = Case(
+        When(role_type=RoleChoices.OWNER, then=Value(0)),
+        When(role_type=RoleChoices.ADMIN, then=Value(1)),
+        default=Value(2),
+        output_field=IntegerField(),
+    )
+
     def get_queryset(self):
         forum_pk = self.kwargs.get("forum_pk")
-        return ForumMember.objects.select_related("user", "forum").filter(
+        queryset = ForumMember.objects.select_related("user", "forum").filter(
             forum__pk=forum_pk, forum__is_deleted=False
         )
+        if self._order_by_role():
+            queryset = queryset.annotate(role_rank=self.ROLE_RANK)
+        return queryset
+
+    def _order_by_role(self):
+        return self.request.query_params.get("order") == "role"
+
+    def get_keyset_ordering(self):
+        """游标排序：默认按加入时间；?order=role 时吧主、管理员优先"""
+        if self._order_by_role():
+            return ("role_rank", "joined_at", "id")
+        return ("joined_at", "id")
+
+    def get_pagination_count(self):
+        """未筛选时直接使用反规范化的 member_count，避免 COUNT(*)"""
+        params = self.request.query_params
+        if params.get("search") or params.get("role_type"):
+            return None
+        forum = (
+            Forum.objects.only("id", "member_count")
+            .filter(pk=self.kwargs.get("forum_pk"))
+            .first()
+        )
+        if forum is None:
+            return 0
+        return ForumCounterService.merged_value(forum, "member_count")
 
     def get_object(self):
         obj = super().get_object()
@@ -381,12 +482,79 @@ class ForumActivityViewSet(GenericViewSet):
 
         queryset = (
             self.get_queryset()
+            .select_related("forum_member__user")
             .filter(forum__pk=forum_id)
-            .order_by("-last_active_at")[:10]
         )
-        serializer = self.get_serializer(queryset, many=True)
+        try:
+            user_ids = ForumRankService.top_user_ids(
+                forum_id, ForumRankService.ACTIVE_BOARD, limit=10
+            )
+        except Exception as e:
+            logger.warning(f"活跃榜读取失败，回退数据库排序: {e}")
+            user_ids = []
+
+        if user_ids:
+            # 按榜单顺序返回，只查询上榜的 10 条记录
+            activities = {
+                activity.forum_member.user_id: activity
+                for activity in queryset.filter(forum_member__user_id__in=user_ids)
+            }
+            instances = [activities[uid] for uid in user_ids if uid in activities]
+        else:
+            instances = queryset.order_by("-last_active_at")[:10]
+        serializer = self.get_serializer(instances, many=True)
         return Response(serializer.data)
 
+    def _get_rank_params(self, request):
+        """解析榜单参数，返回 (forum_id, board, 错误信息)"""
+        forum_id = request.query_params.get("forum")
+        board = request.query_params.get("board", ForumRankService.EXP_BOARD)
+        if not forum_id or not forum_id.isdigit():
+            return None, None, "缺少 forum 参数"
+        if board not in ForumRankService.BOARDS:
+            return None, None, "board 参数只能是 exp 或 active"
+        return int(forum_id), board, None
+
+    @action(detail=False, methods=["get"], url_path="rank")
+    def rank(self, request, *args, **kwargs):
+        """排行榜分页（?forum=&board=exp|active&page=&page_size=）"""
+        forum_id, board, error = self._get_rank_params(request)
+        if error:
+            return Response({"detail": error}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = max(1, int(request.query_params.get("page", 1)))
+            page_size = min(100, max(1, int(request.query_params.get("page_size", 20))))
+        except ValueError:
+            return Response(
+                {"detail": "分页参数必须是整数"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            total, results = ForumRankService.page(forum_id, board, page, page_size)
+        except Exception as e:
+            logger.warning(f"排行榜读取失败，回退数据库排序: {e}")
+            total, results = ForumRankService.page_from_db(
+                forum_id, board, page, page_size
+            )
+        return Response({"count": total, "results": results})
+
+    @action(detail=False, methods=["get"], url_path="myrank")
+    def my_rank(self, request, *args, **kwargs):
+        """我的排名（?forum=&board=exp|active）"""
+        forum_id, board, error = self._get_rank_params(request)
+        if error:
+            return Response({"detail": error}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            rank, score = ForumRankService.my_rank(forum_id, board, request.user.id)
+        except Exception as e:
+            logger.warning(f"我的排名读取失败，回退数据库排序: {e}")
+            rank, score = ForumRankService.my_rank_from_db(
+                forum_id, board, request.user.id
+            )
+        return Response(
+            {"forum": forum_id, "board": board, "rank": rank, "score": score}
+        )
+
     @action(detail=False, methods=["get"], url_path="myactivity")
     def my_activity(self, request, *args, **kwargs):
         forum_id = request.query_params.get("forum")
@@ -416,55 +584,95 @@ class ForumActivityViewSet(GenericViewSet):
     def sign_in(self, request, *args, **kwargs):
         in_ser = self.get_serializer(data=request.data)
         in_ser.is_valid(raise_exception=True)
-        forum = in_ser.validated_data["forum"]
-        member = in_ser.validated_data["forum_member"]
-
-        today = localdate()
+        forum_id = in_ser.validated_data["forum"]
 
-        with transaction.atomic():
-            # 行级锁，避免并发重复签到
-            activity, created = ForumActivity.objects.select_for_update().get_or_create(
-                forum=forum,
-                forum_member=member,
+        # 位图签到：写入只访问 Redis，经验与等级由定时任务批量落库
+        signed, streak, gained_exp, activity = ForumSignInService.sign_in(
+            forum_id, request.user.id, in_ser.validated_data["forum_member_id"]
+        )
+        out = ForumActivitySerializer(activity).data
+        if not signed:
+            return Response(
+                {"detail": "今日已签到", "sign_in_streak": streak, "activity": out},
+                status=status.HTTP_200_OK,
             )
 
-            # 已经签过今天
-            if activity.last_active_at == today and not created:
-                out = ForumActivitySerializer(activity).data
-                return Response(
-                    {"detail": "今日已签到", "activity": out}, status=status.HTTP_200_OK
-                )
+        return Response(
+            {
+                "detail": "签到成功",
+                "gained_exp": gained_exp,
+                "sign_in_streak": streak,
+                "activity": out,
+            },
+            status=status.HTTP_200_OK,
+        )
 
-            # 计算连续天数
-            if activity.last_active_at is None:
-                new_streak = 1
-            else:
-                delta_days = (today - activity.last_active_at).days
-                if delta_days == 1:
-                    new_streak = activity.sign_in_streak + 1
-                else:
-                    new_streak = 1
-
-            # 经验与等级规则
-            gained_exp = max(30, 10 + max(0, new_streak - 1))  # 连续越久奖励越多
-            activity.exp_points = F("exp_points") + gained_exp
-            activity.sign_in_streak = new_streak
-            activity.last_active_at = today
-            activity.save(
-                update_fields=["exp_points", "sign_in_streak", "last_active_at"]
+    @action(detail=False, methods=["get"], url_path="signin/count")
+    def sign_in_count(self, request, *args, **kwargs):
+        """今日签到人数"""
+        forum_id = request.query_params.get("forum")
+        if not forum_id or not forum_id.isdigit():
+            return Response(
+                {"detail": "缺少 forum 参数"}, status=status.HTTP_400_BAD_REQUEST
             )
+        degraded = False
+        try:
+            count = ForumSignInService.count_today(int(forum_id))
+        except Exception as e:
+            logger.warning(f"今日签到人数读取失败，回退数据库统计: {e}")
+            count, degraded = (
+                ForumSignInService.count_today_from_db(int(forum_id)),
+                True,
+            )
+        return Response(
+            {
+                "forum": int(forum_id),
+                "date": localdate().isoformat(),
+                "count": count,
+                "degraded": degraded,
+            },
+            status=status.HTTP_200_OK,
+        )
 
-        # 重新读出 F() 更新后的值
-        activity.refresh_from_db()
-        # 简单的升级规则
-        activity.level = 1 + activity.exp_points // 100
-        activity.save(update_fields=["level"])
+    @action(detail=False, methods=["get"], url_path="signin/calendar")
+    def sign_in_calendar(self, request, *args, **kwargs):
+        """我的月签到日历，month 格式 YYYY-MM，默认本月"""
+        forum_id = request.query_params.get("forum")
+        if not forum_id or not forum_id.isdigit():
+            return Response(
+                {"detail": "缺少 forum 参数"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        month = request.query_params.get("month")
+        try:
+            if month:
+                year, month = map(int, month.split("-"))
+                if not 1 <= month <= 12:
+                    raise ValueError
+            else:
+                today = localdate()
+                year, month = today.year, today.month
+        except ValueError:
+            return Response(
+                {"detail": "month 格式应为 YYYY-MM"}, status=status.HTTP_400_BAD_REQUEST
+            )
 
+        degraded = False
+        try:
+            days = ForumSignInService.month_calendar(
+                int(forum_id), request.user.id, year, month
+            )
+        except Exception as e:
+            logger.warning(f"签到日历读取失败，回退数据库连签记录: {e}")
+            days = ForumSignInService.month_calendar_from_db(
+                int(forum_id), request.user.id, year, month
+            )
+            degraded = True
         return Response(
             {
-                "detail": "签到成功",
-                "gained_exp": gained_exp,
-                "activity": ForumActivitySerializer(activity).data,
+                "forum": int(forum_id),
+                "month": f"{year:04d}-{month:02d}",
+                "signed_days": days,
+                "degraded": degraded,
             },
             status=status.HTTP_200_OK,
         )
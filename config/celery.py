@@ -16,12 +16,42 @@ os.environ.setdefault(
 app = Celery("MiniTieba")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
+# common 不是 Django 应用，单独注册其任务模块
+app.autodiscover_tasks(["common"])
 
 app.conf.beat_schedule = {
     "refresh_forum_member_counts_daily": {
-        "task": "apps.forum.tasks.refresh_forum_member_counts",
+        "task": "forums.tasks.refresh_forum_member_counts",
         "schedule": crontab(minute=0, hour=2),  # 每天2点执行
     },
+    "reconcile_forum_counters_every_minute": {
+        "task": "forums.tasks.reconcile_forum_counters",
+        "schedule": crontab(),  # 每分钟执行
+    },
+    "flush_forum_sign_in_activity_every_minute": {
+        "task": "forums.tasks.flush_forum_sign_in_activity",
+        "schedule": crontab(),  # 每分钟执行
+    },
+    "prune_expired_tokens_daily": {
+        "task": "accounts.tasks.prune_expired_tokens",
+        "schedule": crontab(minute=30, hour=3),  # 每天3点半执行
+    },
+    "flush_login_history_every_minute": {
+        "task": "accounts.tasks.flush_login_history",
+        "schedule": crontab(),  # 每分钟执行
+    },
+    "flush_email_outbox_every_minute": {
+        "task": "common.tasks.flush_email_outbox",
+        "schedule": crontab(),  # 每分钟执行（补发积压与到期重试的邮件）
+    },
+    "flush_sms_outbox_every_minute": {
+        "task": "common.tasks.flush_sms_outbox",
+        "schedule": crontab(),  # 每分钟执行（补发积压的短信）
+    },
+    "rollup_login_history_daily": {
+        "task": "accounts.tasks.rollup_login_history",
+        "schedule": crontab(minute=0, hour=4),  # 每天4点执行
+    },
 }
 
 """
@@ -104,6 +104,16 @@ AUTHENTICATION_BACKENDS = [
     "common.auth.EmailOrUsernameBackend",
 ]
 
+# 首选 Argon2（带耗时指标），旧 PBKDF2 哈希在登录成功后自动升级
+PASSWORD_HASHERS = [
+    "common.hashers.TunedArgon2PasswordHasher",
+    "common.hashers.TimedPBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+]
+PASSWORD_ARGON2_TIME_COST = int(os.getenv("PASSWORD_ARGON2_TIME_COST", 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv("PASSWORD_ARGON2_MEMORY_COST", 102400))
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv("PASSWORD_ARGON2_PARALLELISM", 8))
+
 LANGUAGE_CODE = "zh-Hans"
 TIME_ZONE = "Asia/Shanghai"
 USE_I18N = True
@@ -126,7 +136,7 @@ REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "apps.common.auth.RevocationAwareJWTAuthentication",
     ),
     "DEFAULT_RENDERER_CLASSES": (
         "apps.common.response_renders.UnifiedJSONRenderer",
@@ -243,8 +253,56 @@ LOGGING = {
 
 DEFAULT_EXPIRE_SECONDS = int(os.getenv("DEFAULT_EXPIRE_SECONDS", 300))
 CAPTCHA_EXPIRE_SECONDS = int(os.getenv("CAPTCHA_EXPIRE_SECONDS", 300))
+# 预渲染验证码池：低于低水位时由 captcha_pool_worker 并行补充到高水位
+CAPTCHA_POOL_LOW_WATERMARK = int(os.getenv("CAPTCHA_POOL_LOW_WATERMARK", 200))
+CAPTCHA_POOL_HIGH_WATERMARK = int(os.getenv("CAPTCHA_POOL_HIGH_WATERMARK", 1000))
+CAPTCHA_POOL_WORKERS = int(os.getenv("CAPTCHA_POOL_WORKERS", 4))
+CAPTCHA_POOL_POLL_SECONDS = float(os.getenv("CAPTCHA_POOL_POLL_SECONDS", 1))
 EMAIL_EXPIRE_SECONDS = int(os.getenv("EMAIL_EXPIRE_SECONDS", 300))
 SMS_CODE_EXPIRE_SECONDS = int(os.getenv("SMS_CODE_EXPIRE_SECONDS", 300))
+FORUM_CACHE_EXPIRE_SECONDS = int(os.getenv("FORUM_CACHE_EXPIRE_SECONDS", 300))
+
+# 贴吧检索：默认 Redis 倒排索引，测试可切换为 SQLite FTS5 后端
+FORUM_SEARCH_BACKEND = os.getenv(
+    "FORUM_SEARCH_BACKEND", "forums.utils.search_utils.RedisForumSearchBackend"
+)
+FORUM_SEARCH_SQLITE_PATH = os.getenv("FORUM_SEARCH_SQLITE_PATH", ":memory:")
+FORUM_SEARCH_MAX_RESULTS = int(os.getenv("FORUM_SEARCH_MAX_RESULTS", 200))
+
+# 贴吧成员数/帖子数的 Redis 分片数量
+FORUM_COUNTER_SHARDS = int(os.getenv("FORUM_COUNTER_SHARDS", 8))
+# 计数对账每批处理的贴吧数量
+FORUM_RECOUNT_CHUNK_SIZE = int(os.getenv("FORUM_RECOUNT_CHUNK_SIZE", 1000))
+# 签到经验每批落库的记录数
+FORUM_SIGNIN_FLUSH_BATCH = int(os.getenv("FORUM_SIGNIN_FLUSH_BATCH", 500))
+# 签到经验落库锁的过期时间，应大于单次落库的最长耗时
+FORUM_SIGNIN_FLUSH_LOCK_SECONDS = int(os.getenv("FORUM_SIGNIN_FLUSH_LOCK_SECONDS", 300))
+# 用户贴吧角色表缓存过期时间（秒）
+FORUM_ROLE_CACHE_EXPIRE_SECONDS = int(
+    os.getenv("FORUM_ROLE_CACHE_EXPIRE_SECONDS", 3600)
+)
+# RBAC 编译权限集的 Redis 过期时间（秒）与进程内 LRU 容量
+RBAC_CACHE_EXPIRE_SECONDS = int(os.getenv("RBAC_CACHE_EXPIRE_SECONDS", 86400))
+RBAC_LOCAL_CACHE_SIZE = int(os.getenv("RBAC_LOCAL_CACHE_SIZE", 256))
+# 过期令牌清理：每批删除行数与单次任务最多批数
+TOKEN_PRUNE_BATCH_SIZE = int(os.getenv("TOKEN_PRUNE_BATCH_SIZE", 5000))
+TOKEN_PRUNE_MAX_BATCHES = int(os.getenv("TOKEN_PRUNE_MAX_BATCHES", 100))
+# 登录历史：每批落库的事件数与明细保留天数（之前的按天汇总）
+LOGIN_HISTORY_FLUSH_BATCH = int(os.getenv("LOGIN_HISTORY_FLUSH_BATCH", 1000))
+LOGIN_HISTORY_RETENTION_DAYS = int(os.getenv("LOGIN_HISTORY_RETENTION_DAYS", 90))
+# 登录历史落库锁的过期时间，应大于单次落库的最长耗时
+LOGIN_HISTORY_FLUSH_LOCK_SECONDS = int(
+    os.getenv("LOGIN_HISTORY_FLUSH_LOCK_SECONDS", 300)
+)
+# 登录防护：不存在账号负缓存时间、失败计数窗口、锁定阈值与指数锁定时长
+LOGIN_UNKNOWN_CACHE_SECONDS = int(os.getenv("LOGIN_UNKNOWN_CACHE_SECONDS", 300))
+LOGIN_FAIL_WINDOW_SECONDS = int(os.getenv("LOGIN_FAIL_WINDOW_SECONDS", 900))
+LOGIN_FAIL_THRESHOLD = int(os.getenv("LOGIN_FAIL_THRESHOLD", 5))
+LOGIN_IP_FAIL_THRESHOLD = int(os.getenv("LOGIN_IP_FAIL_THRESHOLD", 20))
+LOGIN_LOCK_BASE_SECONDS = int(os.getenv("LOGIN_LOCK_BASE_SECONDS", 60))
+LOGIN_LOCK_MAX_SECONDS = int(os.getenv("LOGIN_LOCK_MAX_SECONDS", 3600))
+# 客户端与应用之间可信反向代理的层数（0 表示直接使用 REMOTE_ADDR，忽略 X-Forwarded-For）
+TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", 0))
 
 REDIS_URL = os.getenv("REDIS_BASE_URL", "redis://127.0.0.1:6379")
 
@@ -283,7 +341,11 @@ CACHES = {
 # 邮件
 # =========================
 
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+# 本地调试可改为 console / filebased 后端（filebased 写入 EMAIL_FILE_PATH）
+EMAIL_BACKEND = os.getenv(
+    "EMAIL_BACKEND", "django.core.mail.backends.smtp.EmailBackend"
+)
+EMAIL_FILE_PATH = os.getenv("EMAIL_FILE_PATH", str(BASE_DIR / "logs/emails"))
 EMAIL_HOST = os.getenv("EMAIL_HOST", "smtp.163.com")
 EMAIL_PORT = int(os.getenv("EMAIL_PORT", 25))
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "")
@@ -292,6 +354,13 @@ EMAIL_USE_TLS = True
 EMAIL_ACTIVATE_RETURN_URL = os.getenv(
     "EMAIL_ACTIVATE_RETURN_URL", "http://127.0.0.1:8000"
 )
+# 邮件批量投递：每批封数、单次任务最多批数、最大重试次数、首次重试退避秒数（之后翻倍）
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", 50))
+EMAIL_FLUSH_MAX_BATCHES = int(os.getenv("EMAIL_FLUSH_MAX_BATCHES", 20))
+EMAIL_MAX_RETRIES = int(os.getenv("EMAIL_MAX_RETRIES", 5))
+EMAIL_RETRY_BACKOFF_SECONDS = int(os.getenv("EMAIL_RETRY_BACKOFF_SECONDS", 30))
+# 批量发送锁的过期时间，应大于单次 flush 的最长耗时
+EMAIL_FLUSH_LOCK_SECONDS = int(os.getenv("EMAIL_FLUSH_LOCK_SECONDS", 300))
 
 # =========================
 # MinIO / OSS
@@ -303,12 +372,42 @@ MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "")
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "")
 MINIO_BUCKET_NAME = os.getenv("MINIO_BUCKET_NAME", "mini-tieba")
 MINIO_USE_SSL = False
+MINIO_REGION = os.getenv("MINIO_REGION", "us-east-1")
+# MinIO 进程内共享连接池大小与超时（秒）
+MINIO_POOL_MAXSIZE = int(os.getenv("MINIO_POOL_MAXSIZE", 10))
+MINIO_CONNECT_TIMEOUT = float(os.getenv("MINIO_CONNECT_TIMEOUT", 3))
+MINIO_READ_TIMEOUT = float(os.getenv("MINIO_READ_TIMEOUT", 30))
 DEFAULT_IMAGE_FOLDER_NAME = os.getenv("DEFAULT_IMAGE_FOLDER_NAME", "images")
 
 OSS_MAX_IMAGE_SIZE = 5 * 1024 * 1024
+# 流式上传的分片大小（MinIO 要求不小于 5MB），决定上传时的内存占用上限
+OSS_MULTIPART_PART_SIZE = int(os.getenv("OSS_MULTIPART_PART_SIZE", 5 * 1024 * 1024))
 OSS_ALLOWED_IMAGE_TYPES = ["image/jpeg", "image/png", "image/webp"]
 OSS_MAX_IMAGE_WIDTH = 2000
+# 解码前按文件头尺寸拒绝的最大像素数
+OSS_MAX_IMAGE_PIXELS = 40_000_000
 OSS_DEFAULT_IMAGE_QUALITY = 85
+# 压缩上传时额外生成的缩略图尺寸（最长边像素）及是否生成 WebP 版本
+OSS_IMAGE_DERIVATIVE_SIZES = [64, 256, 1024]
+OSS_IMAGE_WEBP_VARIANTS = True
+# 图片上传后由 Celery 任务在请求外压缩处理；关闭后在请求内同步处理
+OSS_ASYNC_IMAGE_PROCESSING = True
+# 待处理原图存放在私有暂存桶，模型中先保存其临时链接（秒）
+MINIO_PENDING_BUCKET_NAME = os.getenv(
+    "MINIO_PENDING_BUCKET_NAME", f"{MINIO_BUCKET_NAME}-pending"
+)
+OSS_PENDING_URL_EXPIRE_SECONDS = int(os.getenv("OSS_PENDING_URL_EXPIRE_SECONDS", 3600))
+# 上传去重索引（原始文件哈希 -> 已上传对象）保留时间
+OSS_DEDUP_EXPIRE_SECONDS = int(os.getenv("OSS_DEDUP_EXPIRE_SECONDS", 7 * 24 * 3600))
+# 临时链接缓存：进程内最多缓存条数，以及缓存的链接至少保留的剩余有效期（秒）
+OSS_PRESIGN_CACHE_SIZE = int(os.getenv("OSS_PRESIGN_CACHE_SIZE", 10000))
+OSS_PRESIGN_SAFETY_MARGIN_SECONDS = int(
+    os.getenv("OSS_PRESIGN_SAFETY_MARGIN_SECONDS", 300)
+)
+# 临时链接缓存命中统计在进程内累加，每隔多少秒写入一次指标
+OSS_PRESIGN_METRICS_FLUSH_SECONDS = int(
+    os.getenv("OSS_PRESIGN_METRICS_FLUSH_SECONDS", 60)
+)
 
 # =========================
 # 腾讯短信
@@ -319,6 +418,12 @@ TENCENTCLOUD_SECRET_KEY = os.getenv("TENCENTCLOUD_SECRET_KEY", "")
 TENCENT_SMS_APP_ID = os.getenv("TENCENT_SMS_APP_ID", "")
 TENCENT_SMS_SIGN = os.getenv("TENCENT_SMS_SIGN", "")
 TENCENT_SMS_TEMPLATE_ID = os.getenv("TENCENT_SMS_TEMPLATE_ID", "")
+# 短信后端：腾讯云 / 本地桩（common.utils.sms_utils.StubSMSBackend）
+SMS_BACKEND = os.getenv("SMS_BACKEND", "common.utils.sms_utils.TencentSMSService")
+# 单个手机号发送间隔与每日上限，每次批量发送的条数
+SMS_SEND_INTERVAL_SECONDS = int(os.getenv("SMS_SEND_INTERVAL_SECONDS", 60))
+SMS_DAILY_LIMIT = int(os.getenv("SMS_DAILY_LIMIT", 10))
+SMS_BATCH_SIZE = int(os.getenv("SMS_BATCH_SIZE", 200))
 
 # =========================
 # Celery
@@ -31,6 +31,9 @@ REST_FRAMEWORK.update(
 # 邮件直接打到控制台，不连真实 SMTP
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
+# 短信只写日志，不调用短信服务商
+SMS_BACKEND = "common.utils.sms_utils.StubSMSBackend"
+
 # API 文档：开发环境完全开放
 SPECTACULAR_SETTINGS.update(
     {